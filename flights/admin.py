@@ -1,7 +1,151 @@
-from django.contrib import admin
-from .models import Flight, Booking, Profile
+from django import forms
+from django.contrib import admin, messages
+from django.contrib.admin.helpers import ActionForm
+from django.core.paginator import Paginator
+from django.db import connections
+from django.utils.functional import cached_property
 
-admin.site.register(Flight)
-admin.site.register(Booking)
-admin.site.register(Profile)
+from .models import Flight, Booking, ArchivedBooking, Profile, TierThreshold
+from .search import listed, match_destinations
 
+
+class EstimatedCountPaginator(Paginator):
+	# Counts at most `count_limit` rows, so a changelist never counts a whole
+	# big table. Past the limit an unfiltered list takes the table's row
+	# count from SQLite's statistics (kept by ANALYZE), and a filtered one
+	# stays at the limit: its first pages are all reachable, and filters
+	# narrow it down from there.
+	count_limit = 10000
+
+	@cached_property
+	def count(self):
+		queryset = self.object_list
+		count = queryset.order_by()[:self.count_limit].count()
+		if count < self.count_limit or queryset.query.where:
+			return count
+		return max(count, estimated_rows(queryset.model, queryset.db) or 0)
+
+
+def estimated_rows(model, using):
+	connection = connections[using]
+	if connection.vendor != 'sqlite':
+		return None
+	with connection.cursor() as cursor:
+		cursor.execute("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'sqlite_stat1'")
+		if cursor.fetchone() is None:
+			return None
+		# The first number of an index's statistics is its row count.
+		cursor.execute('SELECT stat FROM sqlite_stat1 WHERE tbl = %s', [model._meta.db_table])
+		row = cursor.fetchone()
+	return int(row[0].split()[0]) if row else None
+
+
+class ScalableAdmin(admin.ModelAdmin):
+	paginator = EstimatedCountPaginator
+	# Filtered lists would otherwise count the whole table too.
+	show_full_result_count = False
+
+
+class RedateForm(ActionForm):
+	date = forms.DateField(required=False, help_text='New date for "Move selected bookings".')
+
+
+class BookingAdmin(ScalableAdmin):
+	list_display = ['id', 'username', 'destination', 'date', 'passengers', 'totalprice']
+	list_select_related = ['user', 'flight']
+	# date has an index of its own; the destination filter goes through the
+	# flight's index and then (flight, date).
+	list_filter = ['date', 'flight__destination']
+	raw_id_fields = ['user']
+	autocomplete_fields = ['flight']
+	action_form = RedateForm
+	actions = ['cancel_bookings', 'redate_bookings']
+
+	def get_queryset(self, request):
+		return super().get_queryset(request).with_totalprice()
+
+	def get_actions(self, request):
+		# delete_selected loads and confirms every booking; cancel_bookings
+		# does the same job in a few queries.
+		actions = super().get_actions(request)
+		actions.pop('delete_selected', None)
+		return actions
+
+	def username(self, obj):
+		return obj.user.username
+	username.admin_order_field = 'user__username'
+
+	def destination(self, obj):
+		return obj.flight.destination
+	destination.admin_order_field = 'flight__destination'
+
+	def totalprice(self, obj):
+		return obj.totalprice
+	totalprice.admin_order_field = 'totalprice'
+
+	def cancel_bookings(self, request, queryset):
+		cancelled = queryset.cancel()
+		self.message_user(request, 'Cancelled %d booking(s).' % cancelled)
+	cancel_bookings.short_description = 'Cancel selected bookings'
+	cancel_bookings.allowed_permissions = ['delete']
+
+	def redate_bookings(self, request, queryset):
+		form = self.action_form(request.POST)
+		form.fields['action'].choices = self.get_action_choices(request)
+		if not form.is_valid() or form.cleaned_data['date'] is None:
+			self.message_user(request, 'Pick a valid date to move the bookings to.', messages.ERROR)
+			return
+		moved = queryset.redate(form.cleaned_data['date'])
+		self.message_user(request, 'Moved %d booking(s) to %s.' % (moved, form.cleaned_data['date']))
+	redate_bookings.short_description = 'Move selected bookings to the date below'
+	redate_bookings.allowed_permissions = ['change']
+
+
+class ArchivedBookingAdmin(BookingAdmin):
+	# Written only by `manage.py archive_bookings`. The archive has no date
+	# index, bookings are found by destination.
+	list_filter = ['flight__destination']
+	actions = None
+
+	def has_add_permission(self, request):
+		return False
+
+	def has_change_permission(self, request, obj=None):
+		return False
+
+
+class FlightAdmin(ScalableAdmin):
+	list_display = ['id', 'destination', 'time', 'price', 'miles', 'capacity']
+	ordering = ['destination', 'id']
+	# Searched through the trigram index, see get_search_results().
+	search_fields = ['destination']
+
+	def get_search_results(self, request, queryset, search_term):
+		if not search_term:
+			return queryset, False
+		destinations = [destination for destination, score in match_destinations(search_term)]
+		return queryset.filter(destination__in=listed(destinations, queryset.db)), False
+
+
+class ProfileAdmin(ScalableAdmin):
+	list_display = ['id', 'username', 'miles', 'tier', 'past_bookings_count']
+	list_select_related = ['user']
+	list_filter = ['tier']
+	raw_id_fields = ['user']
+	search_fields = ['=user__username']
+
+	def username(self, obj):
+		return obj.user.username
+	username.admin_order_field = 'user__username'
+
+
+class TierThresholdAdmin(admin.ModelAdmin):
+	# Profiles keep their stored tier until `manage.py retier` runs.
+	list_display = ['name', 'min_miles']
+
+
+admin.site.register(Flight, FlightAdmin)
+admin.site.register(Booking, BookingAdmin)
+admin.site.register(ArchivedBooking, ArchivedBookingAdmin)
+admin.site.register(Profile, ProfileAdmin)
+admin.site.register(TierThreshold, TierThresholdAdmin)
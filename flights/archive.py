@@ -0,0 +1,54 @@
+from django.db import connection, transaction
+from django.db.models import DateTimeField, F, Max, Min, Q, Value
+from django.utils import timezone
+
+from .models import ArchivedBooking, Booking, MilesLedger, Profile
+
+COLUMNS = ('id', 'flight', 'date', 'user', 'passengers', 'archived_at')
+
+
+def archive_chunk(first_id, last_id, before):
+	# Moves the bookings with first_id <= id <= last_id dated before `before`
+	# into ArchivedBooking, with one INSERT ... SELECT and one DELETE in a
+	# single transaction. Only bookings that have their miles credited and
+	# are in their user's past bookings count move. The DELETE is raw: the
+	# Booking signals would take archived bookings out of that count.
+	# Returns the number of bookings archived.
+	archived_at = timezone.now()
+	archivable = (
+		Booking.objects
+		.filter(id__gte=first_id, id__lte=last_id, date__lt=before, user__profile__past_bookings_counted_until__gt=F('date'))
+		.filter(id__in=MilesLedger.objects.filter(booking_id__gte=first_id, booking_id__lte=last_id).values('booking_id'))
+		.annotate(archived_at=Value(archived_at, output_field=DateTimeField()))
+		.order_by()
+		.values_list('id', 'flight_id', 'date', 'user_id', 'passengers', 'archived_at')
+	)
+	select, params = archivable.query.sql_with_params()
+	columns = ', '.join(connection.ops.quote_name(ArchivedBooking._meta.get_field(name).column) for name in COLUMNS)
+	booking_table = connection.ops.quote_name(Booking._meta.db_table)
+	archive_table = connection.ops.quote_name(ArchivedBooking._meta.db_table)
+
+	with transaction.atomic():
+		with connection.cursor() as cursor:
+			cursor.execute('INSERT INTO %s (%s) %s' % (archive_table, columns, select), params)
+			archived = cursor.rowcount
+			if archived:
+				cursor.execute(
+					'DELETE FROM %s WHERE id >= %%s AND id <= %%s AND id IN (SELECT id FROM %s WHERE id >= %%s AND id <= %%s)' % (booking_table, archive_table),
+					[first_id, last_id, first_id, last_id],
+				)
+	return archived
+
+
+def archive_bookings(before, chunk_size=10000):
+	# Walks the bookings table in primary key ranges of `chunk_size` like
+	# accrue_miles(), each chunk a short transaction. Past bookings counts
+	# are brought up to date first, so that every booking before `before`
+	# is in one. Yields (last_id, archived) after each chunk.
+	Profile.refresh_past_bookings_counts(Profile.objects.filter(Q(past_bookings_counted_until__isnull=True) | Q(past_bookings_counted_until__lt=before)))
+	bounds = Booking.objects.aggregate(first=Min('id'), last=Max('id'))
+	if bounds['first'] is None:
+		return
+	for first_id in range(bounds['first'], bounds['last'] + 1, chunk_size):
+		last_id = min(first_id + chunk_size - 1, bounds['last'])
+		yield last_id, archive_chunk(first_id, last_id, before)
@@ -0,0 +1,76 @@
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.contrib.auth.backends import ModelBackend
+from django.core.cache import caches
+from rest_framework.request import Request
+from rest_framework_simplejwt.authentication import JWTAuthentication
+from rest_framework_simplejwt.settings import api_settings
+
+from . import hashing
+from .instrumentation import timed
+from .metrics import CACHE
+from .routers import use_primary
+
+
+def user_cache():
+	return caches[settings.AUTH_USER_CACHE]
+
+
+def user_cache_key(user_id):
+	return 'flights:auth-user:%s' % user_id
+
+
+class CachedJWTAuthentication(JWTAuthentication):
+	# JWTAuthentication loads the token's user from the database on every
+	# request. This keeps recently seen users in the AUTH_USER_CACHE cache
+	# for AUTH_USER_CACHE_TIMEOUT seconds; signals.py drops an entry whenever the
+	# user is saved (password change, deactivation, ...) or deleted.
+	@timed('auth')
+	def authenticate(self, request):
+		return super().authenticate(request)
+
+	def get_user(self, validated_token):
+		user_id = validated_token.get(api_settings.USER_ID_CLAIM)
+		if user_id is None:
+			return super().get_user(validated_token)
+
+		key = user_cache_key(user_id)
+		user = user_cache().get(key)
+		CACHE.inc('auth-user', 'miss' if user is None else 'hit')
+		if user is None:
+			# From the primary, so a change that just dropped the entry
+			# isn't undone by a lagging replica.
+			with use_primary():
+				user = super().get_user(validated_token)
+			user_cache().set(key, user, settings.AUTH_USER_CACHE_TIMEOUT)
+		return user
+
+
+class PooledModelBackend(ModelBackend):
+	# ModelBackend with the password check done by the hashing pool. A hash
+	# made with outdated parameters is replaced on a successful login, as
+	# User.check_password would. Only DRF views, which answer HashingBusy
+	# with a 429, are turned away when the pool is busy; other callers (the
+	# admin login) hash on their own thread instead.
+	@timed('auth')
+	def authenticate(self, request, username=None, password=None, **kwargs):
+		UserModel = get_user_model()
+		if username is None:
+			username = kwargs.get(UserModel.USERNAME_FIELD)
+		if username is None or password is None:
+			return None
+		inline_when_busy = not isinstance(request, Request)
+		try:
+			user = UserModel._default_manager.get_by_natural_key(username)
+		except UserModel.DoesNotExist:
+			# Hash anyway so unknown usernames take as long as wrong passwords.
+			hashing.make_password(password, inline_when_busy)
+			return None
+
+		valid, rehashed = hashing.check_password(password, user.password, inline_when_busy)
+		if not valid or not self.user_can_authenticate(user):
+			return None
+		if rehashed:
+			user.password = rehashed
+			user.save(update_fields=['password'])
+		return user
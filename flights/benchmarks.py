@@ -0,0 +1,213 @@
+import json
+import math
+import os
+import random
+import tempfile
+import threading
+import time
+from contextlib import contextmanager
+from datetime import date, timedelta, time as dtime
+from decimal import Decimal
+from urllib.error import HTTPError
+from urllib.request import Request, urlopen
+
+from django.contrib.auth.hashers import make_password
+from django.contrib.auth.models import User
+from django.core.management import call_command
+from django.core.servers.basehttp import ThreadedWSGIServer, WSGIRequestHandler
+from django.core.wsgi import get_wsgi_application
+from django.db import connections
+
+from .models import Flight, Booking, Profile
+from .miles import accrue_miles
+from . import search
+
+SYLLABLES = ['ka', 'na', 'wa', 'la', 'ri', 'to', 'mo', 'sa', 'ne', 'lu', 'da', 'ti', 'po', 'ra', 've', 'zu', 'in', 'or']
+
+
+@contextmanager
+def scratch_database(alias='default'):
+	# Benchmarks always run against a freshly migrated throw-away SQLite file,
+	# never against the configured database.
+	connection = connections[alias]
+	connection.close()
+	original = connection.settings_dict['NAME']
+	handle, path = tempfile.mkstemp(suffix='.sqlite3')
+	os.close(handle)
+	connection.settings_dict['NAME'] = path
+	try:
+		call_command('migrate', database=alias, verbosity=0, interactive=False)
+		yield path
+	finally:
+		connection.close()
+		connection.settings_dict['NAME'] = original
+		for suffix in ('', '-wal', '-shm'):
+			if os.path.exists(path + suffix):
+				os.remove(path + suffix)
+
+
+def destination_names(count, rng):
+	names = set()
+	while len(names) < count:
+		words = [''.join(rng.choice(SYLLABLES) for _ in range(rng.randint(2, 4))) for _ in range(rng.choice((1, 1, 1, 2)))]
+		names.add(' '.join(word.capitalize() for word in words))
+	return sorted(names)
+
+
+def generate_flights(count, destinations=1000, seed=0, batch_size=5000):
+	rng = random.Random(seed)
+	names = destination_names(min(destinations, count), rng)
+	batch = []
+	for _ in range(count):
+		batch.append(Flight(
+			destination=rng.choice(names),
+			time=dtime(rng.randrange(24), rng.choice((0, 15, 30, 45))),
+			price=Decimal(rng.randrange(5000, 200000)) / 100,
+			miles=rng.randrange(100, 9000),
+		))
+		if len(batch) >= batch_size:
+			Flight.objects.bulk_create(batch)
+			batch = []
+	Flight.objects.bulk_create(batch)
+	search.rebuild_index()
+	return names
+
+
+def generate_dataset(flights=2000, users=200, bookings_per_user=20, past_share=0.5, seed=0, password='bench-password-1', batch_size=5000):
+	# A deterministic data set for the endpoint benchmarks: `past_share` of
+	# every user's bookings lie in the past year (and get their miles
+	# credited), the rest are 4 to 365 days ahead so they can still be
+	# changed. Every user has the same password, hashed once.
+	rng = random.Random(seed)
+	names = generate_flights(flights, seed=seed, batch_size=batch_size)
+	flight_ids = list(Flight.objects.order_by('id').values_list('id', flat=True))
+	encoded = make_password(password)
+	User.objects.bulk_create([User(username='bench%d' % index, password=encoded) for index in range(users)])
+	user_ids = list(User.objects.filter(username__startswith='bench').order_by('id').values_list('id', flat=True))
+	Profile.objects.bulk_create([Profile(user_id=user_id) for user_id in user_ids])
+
+	today = date.today()
+	batch = []
+	for user_id in user_ids:
+		for _ in range(bookings_per_user):
+			days = -rng.randint(1, 365) if rng.random() < past_share else rng.randint(4, 365)
+			batch.append(Booking(user_id=user_id, flight_id=rng.choice(flight_ids), date=today + timedelta(days=days), passengers=rng.randint(1, 4)))
+			if len(batch) >= batch_size:
+				Booking.objects.bulk_create(batch)
+				batch = []
+	Booking.objects.bulk_create(batch)
+	for _ in accrue_miles(today):
+		pass
+
+	admin = User.objects.create(username='bench-admin', password=encoded, is_staff=True, is_superuser=True)
+	Profile.objects.create(user=admin)
+	return {
+		'names': names,
+		'flight_ids': flight_ids,
+		'users': [('bench%d' % index, user_id) for index, user_id in enumerate(user_ids)],
+		'admin': admin,
+		'password': password,
+	}
+
+
+def percentile(samples, pct):
+	ordered = sorted(samples)
+	return ordered[max(0, math.ceil(pct / 100 * len(ordered)) - 1)]
+
+
+def summarize(samples):
+	total = sum(samples)
+	return {
+		'count': len(samples),
+		'mean_ms': total / len(samples) * 1000,
+		'p50_ms': percentile(samples, 50) * 1000,
+		'p95_ms': percentile(samples, 95) * 1000,
+		'p99_ms': percentile(samples, 99) * 1000,
+		'per_sec': len(samples) / total if total else float('inf'),
+	}
+
+
+def measure(func, repeat):
+	samples = []
+	for _ in range(repeat):
+		start = time.perf_counter()
+		func()
+		samples.append(time.perf_counter() - start)
+	return summarize(samples)
+
+
+def format_summary(label, summary):
+	return '%-40s p50 %8.3f ms  p95 %8.3f ms  p99 %8.3f ms  %10.1f/s' % (
+		label, summary['p50_ms'], summary['p95_ms'], summary['p99_ms'], summary['per_sec'],
+	)
+
+
+class QuietRequestHandler(WSGIRequestHandler):
+	def log_message(self, format, *args):
+		pass
+
+
+@contextmanager
+def live_server(host='127.0.0.1'):
+	# The project behind a threaded WSGI server on a free port, for load
+	# tests over real sockets. Yields the base URL.
+	server = ThreadedWSGIServer((host, 0), QuietRequestHandler)
+	server.set_app(get_wsgi_application())
+	thread = threading.Thread(target=server.serve_forever, daemon=True)
+	thread.start()
+	try:
+		yield 'http://%s:%d' % server.server_address[:2]
+	finally:
+		server.shutdown()
+		server.server_close()
+
+
+def http_request(method, url, data=None, headers=None):
+	# Returns the status code, for load tests against live_server().
+	body = json.dumps(data).encode('utf-8') if data is not None else None
+	request = Request(url, body, dict(headers or {}, **({'Content-Type': 'application/json'} if body else {})), method=method)
+	try:
+		with urlopen(request) as response:
+			response.read()
+			return response.status
+	except HTTPError as error:
+		return error.code
+
+
+def load(request, clients, duration, backoff=0, limit=None):
+	# Calls `request(client_index, n)` from `clients` threads for `duration`
+	# seconds, or until each client has made `limit` requests. `request`
+	# returns a (label, status code) pair; after a 429 the client waits
+	# `backoff` seconds (untimed) before its next request.
+	# Returns {label: (summary, statuses)}.
+	samples, statuses = {}, {}
+	lock = threading.Lock()
+	deadline = time.perf_counter() + duration
+
+	def client(index):
+		n = 0
+		while time.perf_counter() < deadline and (limit is None or n < limit):
+			start = time.perf_counter()
+			label, code = request(index, n)
+			elapsed = time.perf_counter() - start
+			n += 1
+			with lock:
+				samples.setdefault(label, []).append(elapsed)
+				counts = statuses.setdefault(label, {})
+				counts[code] = counts.get(code, 0) + 1
+			if code == 429 and backoff:
+				time.sleep(backoff)
+
+	threads = [threading.Thread(target=client, args=(index,)) for index in range(clients)]
+	start = time.perf_counter()
+	for thread in threads:
+		thread.start()
+	for thread in threads:
+		thread.join()
+	elapsed = time.perf_counter() - start
+	results = {}
+	for label, label_samples in samples.items():
+		summary = summarize(label_samples)
+		summary['per_sec'] = len(label_samples) / elapsed
+		results[label] = summary, statuses[label]
+	return results
@@ -0,0 +1,71 @@
+import hashlib
+import time
+
+from django.conf import settings
+from django.core.cache import caches
+from django.utils.http import parse_etags, urlencode
+from rest_framework import status
+from rest_framework.response import Response
+
+from .metrics import CACHE
+from .routers import use_primary
+
+CATALOG_VERSION_KEY = 'flights:catalog-version'
+
+
+def catalog_cache():
+	return caches[settings.CATALOG_CACHE]
+
+
+def catalog_version():
+	cache = catalog_cache()
+	version = cache.get(CATALOG_VERSION_KEY)
+	if version is None:
+		# Seeded from the clock so that a counter lost to eviction or a
+		# restart never comes back to a version that still has entries.
+		cache.add(CATALOG_VERSION_KEY, int(time.time() * 1000000), timeout=None)
+		version = cache.get(CATALOG_VERSION_KEY)
+	return version
+
+
+def bump_catalog_version():
+	# A fresh version from the clock rather than incr(): file and database
+	# caches incr() with a get and a set, so two workers bumping at once
+	# could both store the same version and keep pages cached in between.
+	cache = catalog_cache()
+	version = cache.get(CATALOG_VERSION_KEY)
+	new_version = int(time.time() * 1000000)
+	if version is not None and new_version <= version:
+		new_version = version + 1
+	cache.set(CATALOG_VERSION_KEY, new_version, timeout=None)
+
+
+class CatalogCacheMixin:
+	# Caches the serialized list response per catalog version and request URL,
+	# and answers If-None-Match revalidations with 304 before touching the
+	# cached data. Writes to Flight bump the version (see signals.py), which
+	# retires every cached page at once.
+	def get_cache_keys(self, request, version):
+		params = urlencode(sorted(request.query_params.lists()), doseq=True)
+		url = '%s?%s' % (request.build_absolute_uri(request.path), params)
+		digest = hashlib.sha1(('%s|%s' % (version, url)).encode('utf-8')).hexdigest()
+		etag = '"%s-%s"' % (digest, request.accepted_renderer.format)
+		return 'flights:list:%s' % digest, etag
+
+	def list(self, request, *args, **kwargs):
+		cache = catalog_cache()
+		key, etag = self.get_cache_keys(request, catalog_version())
+
+		if etag in parse_etags(request.META.get('HTTP_IF_NONE_MATCH', '')):
+			CACHE.inc('catalog', 'not_modified')
+			return Response(status=status.HTTP_304_NOT_MODIFIED, headers={'ETag': etag})
+
+		data = cache.get(key)
+		CACHE.inc('catalog', 'miss' if data is None else 'hit')
+		if data is None:
+			# Read from the primary: a lagging replica would otherwise get
+			# its stale page cached under the new version.
+			with use_primary():
+				data = super().list(request, *args, **kwargs).data
+			cache.set(key, data)
+		return Response(data, headers={'ETag': etag})
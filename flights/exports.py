@@ -0,0 +1,63 @@
+import csv
+
+from django.http import StreamingHttpResponse
+from rest_framework.exceptions import NotFound
+from rest_framework.negotiation import BaseContentNegotiation
+
+from .renderers import FastJSONRenderer
+from .rows import RowReader, merged_keyset_chunks
+
+
+class Echo:
+	# A file for csv.writer that hands each line back instead of storing it.
+	def write(self, value):
+		return value
+
+
+def ndjson_chunks(reader, chunks):
+	renderer = FastJSONRenderer()
+	for rows in chunks:
+		yield b''.join(renderer.render(reader.build(row)) + b'\n' for row in rows)
+
+
+def csv_chunks(reader, chunks):
+	writer = csv.writer(Echo())
+	yield writer.writerow(reader.names).encode('utf-8')
+	for rows in chunks:
+		yield ''.join(writer.writerow(reader.build(row).values()) for row in rows).encode('utf-8')
+
+
+class ExportNegotiation(BaseContentNegotiation):
+	# The export format comes from the URL, whatever the Accept header says;
+	# the view's renderers are only used for error responses.
+	def select_parser(self, request, parsers):
+		return parsers[0]
+
+	def select_renderer(self, request, renderers, format_suffix=None):
+		return renderers[0], renderers[0].media_type
+
+
+class StreamingExportMixin:
+	# get() streams the filtered queryset through the serializer's RowReader
+	# as NDJSON or CSV, fetched in primary key chunks of `chunk_size` while
+	# the response is sent, so memory use doesn't grow with the export.
+	formats = {
+		'ndjson': ('application/x-ndjson', ndjson_chunks),
+		'csv': ('text/csv; charset=utf-8', csv_chunks),
+	}
+	chunk_size = 2000
+	export_name = None
+
+	def get(self, request, export_format):
+		if export_format not in self.formats:
+			raise NotFound('Unknown export format.')
+		content_type, encode = self.formats[export_format]
+		reader = RowReader.for_serializer(self.get_serializer_class())
+		chunks = merged_keyset_chunks(self.get_export_querysets(), reader.columns, self.chunk_size)
+		response = StreamingHttpResponse(encode(reader, chunks), content_type=content_type)
+		response['Content-Disposition'] = 'attachment; filename="%s.%s"' % (self.export_name, export_format)
+		return response
+
+	def get_export_querysets(self):
+		# Exported as one sequence in primary key order.
+		return [self.filter_queryset(self.get_queryset())]
@@ -0,0 +1,97 @@
+from django.core.exceptions import ValidationError as DjangoValidationError
+from django.db.models import F, Func
+from rest_framework.exceptions import ValidationError
+from rest_framework.filters import BaseFilterBackend
+
+
+def resolve_field(queryset, name):
+	if name in queryset.query.annotations:
+		return queryset.query.annotations[name].output_field
+	if name == 'pk':
+		return queryset.model._meta.pk
+	return queryset.model._meta.get_field(name)
+
+
+class Unindexed(Func):
+	# The same value as its expression, in a form SQLite won't look up
+	# through an index: the unary + is SQLite's documented way to keep a
+	# WHERE term out of index selection ("Disqualifying WHERE clause terms
+	# using unary-+" in its query optimizer overview). Other databases
+	# evaluate it as the plain value.
+	template = '+%(expressions)s'
+
+
+class LookupFilter(BaseFilterBackend):
+	# Filters on `<field>__<lookup>=value` query parameters, restricted to the
+	# fields and lookups the view lists in `filter_lookups`, for example
+	# {'totalprice': ['gte', 'lte']}. Annotations can be filtered like fields.
+	# `in` takes comma-separated values, at most `max_in_values` of them so
+	# the query stays within SQLite's parameter limit. A lower bound above
+	# the upper bound is rejected rather than answered with nothing.
+	#
+	# Views paginated in index order can set `ranges_follow_ordering`: range
+	# lookups on fields other than the leading ordering field are then kept
+	# out of the index choice, so SQLite walks the ordering's index and stops
+	# once the page is full instead of reading the whole range and sorting
+	# it. Without range statistics (STAT4) it can't tell which is cheaper,
+	# and guesses the range. Ranges on several fields other than the leading
+	# one are left to SQLite: together they are narrow, and sorting the few
+	# rows they match beats walking the index past all the others. This
+	# backend has to run after OrderingFilter.
+	max_in_values = 100
+	lower_bounds = ('gt', 'gte')
+	upper_bounds = ('lt', 'lte')
+
+	def get_filters(self, request, queryset, view):
+		filters = {}
+		errors = {}
+		for name, lookups in getattr(view, 'filter_lookups', {}).items():
+			field = resolve_field(queryset, name)
+			for lookup in lookups:
+				param = name if lookup == 'exact' else '%s__%s' % (name, lookup)
+				if param not in request.query_params:
+					continue
+				try:
+					filters[param] = self.to_python(field, lookup, request.query_params[param])
+				except DjangoValidationError as exc:
+					errors[param] = exc.messages
+			self.check_range(name, filters, errors)
+		if errors:
+			raise ValidationError(errors)
+		return filters
+
+	def to_python(self, field, lookup, value):
+		if lookup != 'in':
+			return field.to_python(value)
+		values = [item.strip() for item in value.split(',') if item.strip()]
+		if not values:
+			raise DjangoValidationError('Give at least one value.')
+		if len(values) > self.max_in_values:
+			raise DjangoValidationError('Give at most %d values.' % self.max_in_values)
+		return [field.to_python(item) for item in values]
+
+	def check_range(self, name, filters, errors):
+		for lower in self.lower_bounds:
+			for upper in self.upper_bounds:
+				lower_param, upper_param = '%s__%s' % (name, lower), '%s__%s' % (name, upper)
+				if lower_param in filters and upper_param in filters and filters[lower_param] > filters[upper_param]:
+					errors[lower_param] = ['Must not be greater than %s.' % upper_param]
+
+	def filter_queryset(self, request, queryset, view):
+		filters = self.get_filters(request, queryset, view)
+		if getattr(view, 'ranges_follow_ordering', False) and queryset.query.order_by:
+			leading = queryset.query.order_by[0].lstrip('-')
+			ranges = {}
+			for param in filters:
+				name, _, lookup = param.rpartition('__')
+				if lookup in self.lower_bounds + self.upper_bounds:
+					ranges.setdefault(name, []).append(lookup)
+			if leading in ranges or len(ranges) == 1:
+				for name, lookups in ranges.items():
+					if name == leading:
+						continue
+					alias = '%s_unindexed' % name
+					queryset = queryset.annotate(**{alias: Unindexed(F(name))})
+					for lookup in lookups:
+						filters['%s__%s' % (alias, lookup)] = filters.pop('%s__%s' % (name, lookup))
+		return queryset.filter(**filters)
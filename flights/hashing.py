@@ -0,0 +1,110 @@
+import threading
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+
+from django.conf import settings
+from django.contrib.auth import hashers
+from django.core.signals import setting_changed
+from django.dispatch import receiver
+from rest_framework.exceptions import Throttled
+
+
+class HashingBusy(Throttled):
+	default_detail = 'Too many sign-ins in progress, please retry shortly.'
+
+
+def _make_password(password):
+	return hashers.make_password(password)
+
+
+def _check_password(password, encoded):
+	# Returns (valid, rehashed): `rehashed` is a fresh hash when `encoded`
+	# uses outdated parameters (e.g. fewer PBKDF2 iterations), else None.
+	rehashed = []
+	valid = hashers.check_password(password, encoded, setter=lambda raw: rehashed.append(hashers.make_password(raw)))
+	return valid, rehashed[0] if rehashed else None
+
+
+class HashingPool:
+	# Runs password hashing in a pool of worker processes so it doesn't hold
+	# request threads' CPU time. At most `max_pending` jobs may be queued or
+	# running (0 for no limit); beyond that callers are turned away with a
+	# 429 straight away rather than piling up behind the pool, or hash on
+	# their own thread with `inline_when_busy`. With no workers the hashing
+	# runs inline, still subject to the same limit.
+	def __init__(self, workers=None, max_pending=None):
+		self.workers = settings.PASSWORD_HASHING_WORKERS if workers is None else workers
+		self.max_pending = settings.PASSWORD_HASHING_MAX_PENDING if max_pending is None else max_pending
+		self.slots = threading.BoundedSemaphore(self.max_pending) if self.max_pending > 0 else None
+		self.lock = threading.Lock()
+		self.executor = None
+
+	def get_executor(self):
+		with self.lock:
+			if self.executor is None:
+				self.executor = ProcessPoolExecutor(max_workers=self.workers)
+			return self.executor
+
+	def run(self, func, *args, inline_when_busy=False):
+		if self.slots is None:
+			return self.call(func, *args)
+		if not self.slots.acquire(blocking=False):
+			if inline_when_busy:
+				return func(*args)
+			raise HashingBusy(wait=settings.PASSWORD_HASHING_RETRY_AFTER)
+		try:
+			return self.call(func, *args)
+		finally:
+			self.slots.release()
+
+	def call(self, func, *args):
+		if not self.workers:
+			return func(*args)
+		try:
+			return self.get_executor().submit(func, *args).result()
+		except BrokenProcessPool:
+			# A worker died (e.g. killed for memory); start a new pool.
+			self.shutdown(wait=False)
+			return self.get_executor().submit(func, *args).result()
+
+	def shutdown(self, wait=True):
+		with self.lock:
+			executor, self.executor = self.executor, None
+		if executor is not None:
+			executor.shutdown(wait=wait)
+
+	def make_password(self, password, inline_when_busy=False):
+		return self.run(_make_password, password, inline_when_busy=inline_when_busy)
+
+	def check_password(self, password, encoded, inline_when_busy=False):
+		return self.run(_check_password, password, encoded, inline_when_busy=inline_when_busy)
+
+
+_pool = None
+_pool_lock = threading.Lock()
+
+
+def get_pool():
+	global _pool
+	with _pool_lock:
+		if _pool is None:
+			_pool = HashingPool()
+		return _pool
+
+
+@receiver(setting_changed)
+def reset_pool(setting, **kwargs):
+	global _pool
+	if setting.startswith('PASSWORD_HASHING_') or setting == 'PASSWORD_HASHERS':
+		with _pool_lock:
+			pool, _pool = _pool, None
+		if pool is not None:
+			pool.shutdown(wait=False)
+
+
+def make_password(password, inline_when_busy=False):
+	return get_pool().make_password(password, inline_when_busy)
+
+
+def check_password(password, encoded, inline_when_busy=False):
+	return get_pool().check_password(password, encoded, inline_when_busy)
@@ -0,0 +1,132 @@
+import json
+import logging
+import os
+import random
+import threading
+import time
+import traceback
+from contextlib import ExitStack
+from functools import wraps
+
+from django.conf import settings
+from django.db import connections
+
+logger = logging.getLogger('flights.instrumentation')
+slow_query_logger = logging.getLogger('flights.instrumentation.slow_queries')
+
+_state = threading.local()
+
+
+def current_timings():
+	# The sampled request's {name: seconds} on this thread, else None.
+	return getattr(_state, 'timings', None)
+
+
+class timed:
+	# Adds the time spent in the block to `name` while a sampled request is
+	# running. Nested blocks of the same name only count once, so it can
+	# wrap recursive calls such as nested serializers. As a decorator it
+	# costs a single check outside sampled requests.
+	def __init__(self, name):
+		self.name = name
+		self.start = None
+
+	def __enter__(self):
+		timings = current_timings()
+		if timings is not None and self.name not in _state.active:
+			_state.active.add(self.name)
+			self.start = time.perf_counter()
+
+	def __exit__(self, exc_type, exc_value, traceback):
+		if self.start is not None:
+			timings = current_timings()
+			if timings is not None:
+				timings[self.name] = timings.get(self.name, 0) + time.perf_counter() - self.start
+				_state.active.discard(self.name)
+			self.start = None
+
+	def __call__(self, func):
+		@wraps(func)
+		def inner(*args, **kwargs):
+			if current_timings() is None:
+				return func(*args, **kwargs)
+			with timed(self.name):
+				return func(*args, **kwargs)
+		return inner
+
+
+def query_origin(limit=3):
+	# The innermost project frames that led to a query, skipping Django and
+	# third-party code.
+	project = os.path.join(settings.BASE_DIR, '')
+	frames = [
+		frame for frame in traceback.extract_stack()[:-1]
+		if frame.filename.startswith(project) and 'site-packages' not in frame.filename and frame.filename != __file__
+	]
+	return ['%s:%d in %s' % (os.path.relpath(frame.filename, project), frame.lineno, frame.name) for frame in frames[-limit:]]
+
+
+def time_query(execute, sql, params, many, context):
+	start = time.perf_counter()
+	try:
+		return execute(sql, params, many, context)
+	finally:
+		elapsed = time.perf_counter() - start
+		timings = current_timings()
+		if timings is not None:
+			timings['db'] = timings.get('db', 0) + elapsed
+			_state.queries += 1
+		threshold = settings.SLOW_QUERY_MS
+		if threshold is not None and elapsed * 1000 >= threshold:
+			slow_query_logger.warning(json.dumps({
+				'sql': sql,
+				'duration_ms': round(elapsed * 1000, 3),
+				'alias': context['connection'].alias,
+				'origin': query_origin(),
+			}))
+
+
+def server_timing(timings, queries):
+	metrics = ['db;dur=%.1f;desc="%d queries"' % (timings.get('db', 0) * 1000, queries)]
+	metrics += ['%s;dur=%.1f' % (name, timings[name] * 1000) for name in sorted(timings) if name not in ('db', 'app')]
+	metrics.append('app;dur=%.1f' % (timings['app'] * 1000))
+	return ', '.join(metrics)
+
+
+class InstrumentationMiddleware:
+	# Times INSTRUMENTATION_SAMPLE_RATE of all requests: SQL (count and
+	# time), serialization and authentication, see timed(). The totals go
+	# out as a Server-Timing header and a JSON log line. Unsampled requests
+	# only pay for a random number, plus a timer per query when the slow
+	# query log (SLOW_QUERY_MS) is on.
+	def __init__(self, get_response):
+		self.get_response = get_response
+
+	def __call__(self, request):
+		sampled = random.random() < settings.INSTRUMENTATION_SAMPLE_RATE
+		if not sampled and settings.SLOW_QUERY_MS is None:
+			return self.get_response(request)
+
+		timings = {} if sampled else None
+		_state.timings, _state.active, _state.queries = timings, set(), 0
+		start = time.perf_counter()
+		try:
+			with ExitStack() as stack:
+				for connection in connections.all():
+					stack.enter_context(connection.execute_wrapper(time_query))
+				response = self.get_response(request)
+		finally:
+			_state.timings = None
+		if not sampled:
+			return response
+
+		timings['app'] = time.perf_counter() - start
+		response['Server-Timing'] = server_timing(timings, _state.queries)
+		logger.info(json.dumps(dict(
+			{'%s_ms' % name: round(seconds * 1000, 3) for name, seconds in timings.items()},
+			method=request.method,
+			path=request.path,
+			status=response.status_code,
+			queries=_state.queries,
+		), sort_keys=True))
+		return response
@@ -0,0 +1,34 @@
+from datetime import date
+
+from django.core.management.base import BaseCommand, CommandError
+
+from flights.miles import accrue_miles, reconcile_miles
+
+
+class Command(BaseCommand):
+	help = 'Credit the miles of every flown booking that has not been credited yet.'
+
+	def add_arguments(self, parser):
+		parser.add_argument('--chunk-size', type=int, default=50000)
+		parser.add_argument('--date', help='Treat bookings before this date (YYYY-MM-DD) as flown. Defaults to today.')
+		parser.add_argument('--reconcile', action='store_true', help='Rebuild every profile balance from the ledger instead.')
+
+	def handle(self, *args, **options):
+		if options['reconcile']:
+			drifted = reconcile_miles()
+			self.stdout.write('Reconciled miles, %d profile(s) corrected.' % drifted)
+			return
+
+		try:
+			today = date.fromisoformat(options['date']) if options['date'] else None
+		except ValueError:
+			raise CommandError('Invalid --date %r, expected YYYY-MM-DD.' % options['date'])
+		if options['chunk_size'] < 1:
+			raise CommandError('--chunk-size must be positive.')
+
+		total = 0
+		for last_id, credited in accrue_miles(today, options['chunk_size']):
+			total += credited
+			if options['verbosity'] > 1:
+				self.stdout.write('  up to booking %d: %d credited' % (last_id, credited))
+		self.stdout.write('Credited %d booking(s).' % total)
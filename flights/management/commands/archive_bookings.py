@@ -0,0 +1,28 @@
+from datetime import date, timedelta
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+from flights.archive import archive_bookings
+
+
+class Command(BaseCommand):
+	help = 'Move past bookings older than BOOKING_ARCHIVE_AFTER_DAYS into the archive table. Run accrue_miles first: uncredited bookings stay.'
+
+	def add_arguments(self, parser):
+		parser.add_argument('--chunk-size', type=int, default=10000)
+		parser.add_argument('--days', type=int, help='Archive bookings older than this many days. Defaults to BOOKING_ARCHIVE_AFTER_DAYS.')
+
+	def handle(self, *args, **options):
+		days = options['days'] if options['days'] is not None else settings.BOOKING_ARCHIVE_AFTER_DAYS
+		if days < 1:
+			raise CommandError('--days must be positive.')
+		if options['chunk_size'] < 1:
+			raise CommandError('--chunk-size must be positive.')
+
+		total = 0
+		for last_id, archived in archive_bookings(date.today() - timedelta(days=days), options['chunk_size']):
+			total += archived
+			if options['verbosity'] > 1:
+				self.stdout.write('  up to booking %d: %d archived' % (last_id, archived))
+		self.stdout.write('Archived %d booking(s).' % total)
@@ -0,0 +1,48 @@
+import time
+
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand
+from django.test.utils import override_settings
+from django.urls import reverse
+from rest_framework.test import APIClient
+
+from flights.benchmarks import scratch_database, generate_flights
+from flights.models import Flight, Booking
+
+
+class Command(BaseCommand):
+	help = 'Compare booking throughput of book/<flight_id>/ against the bulk booking endpoint.'
+
+	def add_arguments(self, parser):
+		parser.add_argument('--bookings', type=int, default=1000)
+		parser.add_argument('--chunk', type=int, default=500)
+
+	def handle(self, *args, **options):
+		with scratch_database(), override_settings(ALLOWED_HOSTS=['testserver']):
+			generate_flights(100)
+			flight_ids = list(Flight.objects.values_list('id', flat=True))
+			user = User(username='bench')
+			user.set_password('bench-password-1')
+			user.save()
+
+			client = APIClient()
+			response = client.post(reverse('login'), {'username': 'bench', 'password': 'bench-password-1'})
+			client.credentials(HTTP_AUTHORIZATION='Bearer ' + response.data['access'])
+			items = [
+				{'flight_id': flight_ids[index % len(flight_ids)], 'date': '2030-01-%02d' % (index % 28 + 1), 'passengers': 1 + index % 4}
+				for index in range(options['bookings'])
+			]
+
+			start = time.perf_counter()
+			for item in items:
+				client.post(reverse('book-flight', args=[item['flight_id']]), {'date': item['date'], 'passengers': item['passengers']})
+			single = time.perf_counter() - start
+
+			start = time.perf_counter()
+			for offset in range(0, len(items), options['chunk']):
+				client.post(reverse('bulk-book-flights'), items[offset:offset + options['chunk']], format='json')
+			bulk = time.perf_counter() - start
+
+			assert Booking.objects.count() == 2 * len(items)
+			self.stdout.write('single  %8.1f bookings/s' % (len(items) / single))
+			self.stdout.write('bulk    %8.1f bookings/s (%d per request)' % (len(items) / bulk, options['chunk']))
@@ -0,0 +1,36 @@
+from django.core.management.base import BaseCommand
+from django.test import Client
+from django.test.utils import override_settings
+
+from flights.benchmarks import scratch_database, generate_flights, measure, format_summary
+from flights.cache import catalog_cache
+
+
+class Command(BaseCommand):
+	help = 'Measure flights-list latency on a cache miss, a cache hit and a 304 revalidation.'
+
+	def add_arguments(self, parser):
+		parser.add_argument('--rows', type=int, default=100000)
+		parser.add_argument('--repeat', type=int, default=200)
+		parser.add_argument('--seed', type=int, default=0)
+
+	def handle(self, *args, **options):
+		with scratch_database(), override_settings(ALLOWED_HOSTS=['testserver']):
+			self.stdout.write('Generating %d flights...' % options['rows'])
+			generate_flights(options['rows'], seed=options['seed'])
+
+			client = Client()
+			cache = catalog_cache()
+
+			def miss():
+				cache.clear()
+				client.get('/flights/')
+
+			etag = client.get('/flights/')['ETag']
+			cases = [
+				('miss', miss),
+				('hit', lambda: client.get('/flights/')),
+				('304', lambda: client.get('/flights/', HTTP_IF_NONE_MATCH=etag)),
+			]
+			for label, func in cases:
+				self.stdout.write(format_summary(label, measure(func, options['repeat'])))
@@ -0,0 +1,306 @@
+import json
+import logging
+import random
+import time
+from datetime import date, timedelta
+from urllib.parse import quote
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.test import Client
+from django.test.utils import CaptureQueriesContext, override_settings
+from django.urls import reverse
+from rest_framework_simplejwt.tokens import RefreshToken
+
+from flights.benchmarks import scratch_database, generate_dataset, summarize, format_summary, live_server, load, http_request
+from flights.models import Booking, TierThreshold
+
+# Relative slowdown (and throughput loss) tolerated before a route counts as
+# a regression against the baseline.
+TOLERANCE = 0.2
+
+METRICS_TOKEN = 'bench-metrics-token'
+
+
+class Command(BaseCommand):
+	help = 'Benchmark every route on a synthetic data set, in-process and over HTTP, optionally against a saved baseline.'
+
+	def add_arguments(self, parser):
+		parser.add_argument('--flights', type=int, default=2000)
+		parser.add_argument('--users', type=int, default=200)
+		parser.add_argument('--bookings-per-user', type=int, default=20)
+		parser.add_argument('--past-share', type=float, default=0.5, help='Share of bookings in the past.')
+		parser.add_argument('--seed', type=int, default=0)
+		parser.add_argument('--requests', type=int, default=100, help='Requests per route through the test client.')
+		parser.add_argument('--clients', type=int, default=8, help='Threads per route against the live server, 0 to skip.')
+		parser.add_argument('--duration', type=float, default=3, help='Seconds per route against the live server.')
+		parser.add_argument('--routes', nargs='*', help='Only these URL names.')
+		parser.add_argument('--output', help='Write the results here as JSON.')
+		parser.add_argument('--baseline', help='Compare against results saved with --output.')
+		parser.add_argument('--tolerance', type=float, default=TOLERANCE)
+
+	def handle(self, *args, **options):
+		baseline = None
+		if options['baseline']:
+			with open(options['baseline']) as f:
+				baseline = json.load(f)
+
+		with scratch_database(), override_settings(ALLOWED_HOSTS=['*'], METRICS_TOKEN=METRICS_TOKEN):
+			self.setup(options)
+			routes = self.routes()
+			unknown = set(options['routes'] or ()) - set(routes)
+			if unknown:
+				raise CommandError('Unknown route(s): %s.' % ', '.join(sorted(unknown)))
+			names = [name for name in routes if not options['routes'] or name in options['routes']]
+
+			results = {'client': {}, 'live': {}}
+			for name in names:
+				results['client'][name] = self.run_client(name, routes[name], options['requests'])
+				self.report('client', name, results['client'][name])
+			if options['clients']:
+				with live_server() as base_url:
+					# 4xx/5xx responses show up in the statuses instead.
+					logging.getLogger('django.request').setLevel(logging.CRITICAL)
+					for name in names:
+						results['live'][name] = self.run_live(name, routes[name], base_url, options['clients'], options['duration'])
+						self.report('live', name, results['live'][name])
+
+		output = {
+			'options': {key: options[key] for key in ('flights', 'users', 'bookings_per_user', 'past_share', 'seed', 'requests', 'clients', 'duration')},
+			'results': results,
+		}
+		if options['output']:
+			with open(options['output'], 'w') as f:
+				json.dump(output, f, indent=2, sort_keys=True)
+		if baseline is not None:
+			regressions = self.compare(baseline['results'], results, options['tolerance'])
+			if regressions:
+				raise CommandError('%d regression(s) against %s.' % (regressions, options['baseline']))
+
+	def setup(self, options):
+		self.dataset = generate_dataset(
+			options['flights'], options['users'], options['bookings_per_user'], options['past_share'], options['seed'],
+		)
+		self.seed = options['seed']
+		self.users = [user_id for _, user_id in self.dataset['users']]
+		self.tokens = {}
+		for username, user_id in self.dataset['users']:
+			refresh = RefreshToken()
+			refresh['user_id'] = user_id
+			self.tokens[user_id] = ('Bearer %s' % refresh.access_token, str(refresh))
+		admin = self.dataset['admin']
+		self.admin_headers = {'Authorization': 'Bearer %s' % RefreshToken.for_user(admin).access_token}
+		session = Client()
+		session.force_login(admin)
+		self.session_headers = {'Cookie': '%s=%s' % (settings.SESSION_COOKIE_NAME, session.cookies[settings.SESSION_COOKIE_NAME].value)}
+		self.future_bookings = {}
+		for user_id, booking_id in Booking.objects.filter(date__gt=date.today() + timedelta(days=3)).values_list('user_id', 'id'):
+			self.future_bookings.setdefault(user_id, []).append(booking_id)
+		self.tiers = list(TierThreshold.objects.values_list('name', flat=True))
+		self.booking_ids = list(Booking.objects.values_list('id', flat=True)[:1000])
+		self.disposable = []
+
+	def routes(self):
+		# URL name -> request(rng, client, n) returning (method, path, data,
+		# headers). Each request picks its user and parameters from `rng`,
+		# which is seeded from the route, client and request number.
+		def user(rng):
+			user_id = rng.choice(self.users)
+			return user_id, {'Authorization': self.tokens[user_id][0]}
+
+		def future_date(rng):
+			return (date.today() + timedelta(days=rng.randint(4, 365))).isoformat()
+
+		def flights_list(rng, client, n):
+			if rng.random() < 0.5:
+				word = rng.choice(self.dataset['names']).split()[0][:4].lower()
+				return 'GET', reverse('flights-list') + '?search=%s&page_size=20' % word, None, {}
+			return 'GET', reverse('flights-list') + '?page_size=20', None, {}
+
+		def filtered_flights(*filters):
+			# The filter combinations clients page through the catalog with;
+			# windows are random so few requests hit the catalog cache.
+			def time_window(rng):
+				width = rng.choice((30, 120, 360))
+				start = rng.randrange(24 * 60 - width)
+				end = start + width
+				return 'time__gte=%02d:%02d&time__lte=%02d:%02d' % (start // 60, start % 60, end // 60, end % 60)
+
+			def price_range(rng):
+				low = rng.randrange(50, 1500)
+				return 'price__gte=%d&price__lte=%d' % (low, low + rng.choice((20, 200, 500)))
+
+			params = {
+				'time': time_window,
+				'price': price_range,
+				'miles': lambda rng: 'miles__lte=%d' % rng.randrange(500, 9000),
+				'destinations': lambda rng: 'destination__in=%s' % quote(','.join(rng.sample(self.dataset['names'], 5))),
+				'ordering': lambda rng: 'ordering=%s' % rng.choice(('time', 'price', '-price', 'miles')),
+			}
+
+			def request(rng, client, n):
+				query = '&'.join(params[name](rng) for name in filters)
+				return 'GET', reverse('flights-list') + '?page_size=20&' + query, None, {}
+			return request
+
+		def own_booking(name):
+			def request(rng, client, n):
+				user_id, headers = user(rng)
+				while user_id not in self.future_bookings:
+					user_id, headers = user(rng)
+				booking_id = rng.choice(self.future_bookings[user_id])
+				data = {'passengers': rng.randint(1, 4)} if name == 'update-booking' else None
+				return ('PATCH' if data else 'GET'), reverse(name, args=[booking_id]), data, headers
+			return request
+
+		def cancel_booking(rng, client, n):
+			# Every cancellation needs a booking of its own, see prepare().
+			booking_id, user_id = self.disposable[n * self.clients + client]
+			return 'DELETE', reverse('cancel-booking', args=[booking_id]), None, {'Authorization': self.tokens[user_id][0]}
+
+		def book_flight(rng, client, n):
+			flight_id = rng.choice(self.dataset['flight_ids'])
+			return 'POST', reverse('book-flight', args=[flight_id]), {'date': future_date(rng), 'passengers': rng.randint(1, 4)}, user(rng)[1]
+
+		def bulk_book_flights(rng, client, n):
+			items = [
+				{'flight_id': rng.choice(self.dataset['flight_ids']), 'date': future_date(rng), 'passengers': rng.randint(1, 4)}
+				for _ in range(20)
+			]
+			return 'POST', reverse('bulk-book-flights'), items, user(rng)[1]
+
+		def login(rng, client, n):
+			username, _ = rng.choice(self.dataset['users'])
+			return 'POST', reverse('login'), {'username': username, 'password': self.dataset['password']}, {}
+
+		def token_refresh(rng, client, n):
+			user_id = rng.choice(self.users)
+			return 'POST', reverse('token-refresh'), {'refresh': self.tokens[user_id][1]}, {}
+
+		def register(rng, client, n):
+			data = {'username': 'new-%s-%d-%d' % (self.mode, client, n), 'password': self.dataset['password'], 'first_name': 'b', 'last_name': 'b'}
+			return 'POST', reverse('register'), data, {}
+
+		def admin_changelist(model):
+			# Every other request filtered, the way staff narrow lists down.
+			filters = {
+				'booking': lambda rng: 'date__gte=%s' % future_date(rng),
+				'flight': lambda rng: 'q=%s' % rng.choice(self.dataset['names']).split()[0],
+				'profile': lambda rng: 'tier=%s' % rng.choice(self.tiers),
+			}
+
+			def request(rng, client, n):
+				url = reverse('admin:flights_%s_changelist' % model)
+				if n % 2:
+					url += '?' + filters[model](rng)
+				return 'GET', url, None, self.session_headers
+			return request
+
+		return {
+			'flights-list': flights_list,
+			'flights-list?time': filtered_flights('time'),
+			'flights-list?price': filtered_flights('price', 'ordering'),
+			'flights-list?miles': filtered_flights('miles', 'ordering'),
+			'flights-list?time&price&miles': filtered_flights('time', 'price', 'miles'),
+			'flights-list?destination__in&time': filtered_flights('destinations', 'time', 'ordering'),
+			'bookings-list': lambda rng, client, n: ('GET', reverse('bookings-list'), None, user(rng)[1]),
+			'booking-details': own_booking('booking-details'),
+			'update-booking': own_booking('update-booking'),
+			'cancel-booking': cancel_booking,
+			'book-flight': book_flight,
+			'bulk-book-flights': bulk_book_flights,
+			'profile-details': lambda rng, client, n: ('GET', reverse('profile-details'), None, user(rng)[1]),
+			'past-bookings': lambda rng, client, n: ('GET', reverse('past-bookings'), None, user(rng)[1]),
+			'login': login,
+			'token-refresh': token_refresh,
+			'register': register,
+			'tier-list': lambda rng, client, n: ('GET', reverse('tier-list'), None, self.admin_headers),
+			'tier-members': lambda rng, client, n: ('GET', reverse('tier-members', args=[rng.choice(self.tiers)]), None, self.admin_headers),
+			'export-flights': lambda rng, client, n: ('GET', reverse('export-flights', args=[rng.choice(['csv', 'ndjson'])]), None, self.admin_headers),
+			'export-bookings': lambda rng, client, n: ('GET', reverse('export-bookings', args=[rng.choice(['csv', 'ndjson'])]), None, self.admin_headers),
+			'metrics': lambda rng, client, n: ('GET', reverse('metrics'), None, {'Authorization': 'Bearer %s' % METRICS_TOKEN}),
+			'admin:flights_booking_changelist': admin_changelist('booking'),
+			'admin:flights_booking_change': lambda rng, client, n: (
+				'GET', reverse('admin:flights_booking_change', args=[rng.choice(self.booking_ids)]), None, self.session_headers,
+			),
+			'admin:flights_flight_changelist': admin_changelist('flight'),
+			'admin:flights_profile_changelist': admin_changelist('profile'),
+		}
+
+	def prepare(self, name, count):
+		# Cancellations delete their booking, so they get fresh ones.
+		if name != 'cancel-booking':
+			return
+		rng = random.Random('disposable:%d' % self.seed)
+		start = Booking.objects.order_by('-id').values_list('id', flat=True).first() or 0
+		bookings = [
+			Booking(user_id=rng.choice(self.users), flight_id=rng.choice(self.dataset['flight_ids']), date=date.today() + timedelta(days=rng.randint(4, 365)), passengers=1)
+			for _ in range(count)
+		]
+		Booking.objects.bulk_create(bookings)
+		self.disposable = list(Booking.objects.filter(id__gt=start).order_by('id').values_list('id', 'user_id'))
+
+	def rng(self, name, client, n):
+		return random.Random('%s:%d:%d:%d' % (name, self.seed, client, n))
+
+	def run_client(self, name, route, requests):
+		self.mode, self.clients = 'client', 1
+		self.prepare(name, requests)
+		client = Client()
+		samples, queries, statuses = [], [], {}
+		for n in range(requests):
+			method, path, data, headers = route(self.rng(name, 0, n), 0, n)
+			extra = {'HTTP_%s' % key.upper(): value for key, value in headers.items()}
+			body = json.dumps(data) if data is not None else ''
+			with CaptureQueriesContext(connection) as context:
+				start = time.perf_counter()
+				response = client.generic(method, path, body, content_type='application/json', **extra)
+				if response.streaming:
+					b''.join(response.streaming_content)
+				samples.append(time.perf_counter() - start)
+			queries.append(len(context.captured_queries))
+			statuses[response.status_code] = statuses.get(response.status_code, 0) + 1
+		result = summarize(samples)
+		result.update(queries_mean=sum(queries) / len(queries), queries_max=max(queries), statuses=statuses)
+		return result
+
+	def run_live(self, name, route, base_url, clients, duration):
+		self.mode, self.clients = 'live', clients
+		limit = None
+		if name == 'cancel-booking':
+			limit = 2000 // clients
+			self.prepare(name, limit * clients)
+
+		def request(client, n):
+			method, path, data, headers = route(self.rng(name, client, n), client, n)
+			return name, http_request(method, base_url + path, data, headers)
+
+		summary, statuses = load(request, clients, duration, limit=limit)[name]
+		summary['statuses'] = statuses
+		return summary
+
+	def report(self, mode, name, result):
+		queries = '  %5.1f queries' % result['queries_mean'] if 'queries_mean' in result else ''
+		self.stdout.write('%s%s  %s' % (format_summary('%-6s %s' % (mode, name), result), queries, result['statuses']))
+
+	def compare(self, baseline, results, tolerance):
+		regressions = 0
+		for mode, routes in results.items():
+			for name, result in routes.items():
+				before = baseline.get(mode, {}).get(name)
+				if before is None:
+					continue
+				changes = []
+				for key, higher_is_worse in (('p50_ms', True), ('p99_ms', True), ('per_sec', False), ('queries_mean', True)):
+					if key not in result or key not in before or not before[key]:
+						continue
+					ratio = result[key] / before[key]
+					worse = ratio > 1 + tolerance if higher_is_worse else ratio < 1 / (1 + tolerance)
+					# Query counts are deterministic, any increase counts.
+					if key == 'queries_mean':
+						worse = result[key] > before[key]
+					changes.append('%s %+.0f%%%s' % (key, (ratio - 1) * 100, ' REGRESSION' if worse else ''))
+					regressions += worse
+				self.stdout.write('%-6s %-40s %s' % (mode, name, '  '.join(changes)))
+		return regressions
@@ -0,0 +1,58 @@
+import tempfile
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.test import Client
+from django.test.utils import override_settings
+from django.urls import reverse
+
+from flights import metrics
+from flights.benchmarks import scratch_database, generate_flights, summarize, format_summary
+
+
+class Command(BaseCommand):
+	help = 'Measure what the metrics middleware adds to a request, in memory and with per-process metrics files.'
+
+	def add_arguments(self, parser):
+		parser.add_argument('--iterations', type=int, default=100000)
+		parser.add_argument('--requests', type=int, default=2000)
+
+	def handle(self, *args, **options):
+		with tempfile.TemporaryDirectory() as directory:
+			for storage, metrics_dir in (('memory', None), ('mmap', directory)):
+				with override_settings(METRICS_DIR=metrics_dir):
+					start = time.perf_counter()
+					for _ in range(options['iterations']):
+						self.record()
+					elapsed = time.perf_counter() - start
+					self.stdout.write('%-8s recording one request  %6.2f us' % (storage, elapsed / options['iterations'] * 1000000))
+
+		# Whole requests for a cached catalog page, the cheapest route.
+		without = [name for name in settings.MIDDLEWARE if name != 'flights.metrics.MetricsMiddleware']
+		with tempfile.TemporaryDirectory() as directory, scratch_database(), override_settings(ALLOWED_HOSTS=['testserver'], METRICS_DIR=directory):
+			generate_flights(100)
+			url = reverse('flights-list')
+			clients = {}
+			for label, middleware in (('without', without), ('with', settings.MIDDLEWARE)):
+				# Clients load the middleware on their first request.
+				with override_settings(MIDDLEWARE=middleware):
+					clients[label] = Client()
+					clients[label].get(url)
+			# Interleaved, so both see the same warm-up and noise.
+			samples = {label: [] for label in clients}
+			for _ in range(options['requests']):
+				for label, client in clients.items():
+					start = time.perf_counter()
+					client.get(url)
+					samples[label].append(time.perf_counter() - start)
+			results = {label: summarize(label_samples) for label, label_samples in samples.items()}
+			for label, summary in results.items():
+				self.stdout.write(format_summary('%s metrics middleware' % label, summary))
+			self.stdout.write('overhead per request  %6.2f us (p50)' % ((results['with']['p50_ms'] - results['without']['p50_ms']) * 1000))
+
+	def record(self):
+		# What MetricsMiddleware does after each response.
+		metrics.REQUESTS.inc('flights-list', 'GET')
+		metrics.LATENCY.observe(0.003, 'flights-list')
+		metrics.QUERIES.observe(1, 'flights-list')
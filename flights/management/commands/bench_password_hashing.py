@@ -0,0 +1,43 @@
+import logging
+
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand
+from django.test.utils import override_settings
+
+from flights.benchmarks import scratch_database, live_server, load, http_request, format_summary
+
+
+class Command(BaseCommand):
+	help = 'Load test register/ and login/ with password hashing on the request thread and in the hashing pool.'
+
+	def add_arguments(self, parser):
+		parser.add_argument('--clients', type=int, default=16)
+		parser.add_argument('--duration', type=float, default=5)
+		parser.add_argument('--workers', type=int, default=None, help='Hashing pool size, defaults to PASSWORD_HASHING_WORKERS.')
+
+	def handle(self, *args, **options):
+		modes = [
+			('inline', {'PASSWORD_HASHING_WORKERS': 0, 'PASSWORD_HASHING_MAX_PENDING': 10 ** 6}),
+			('pool', {} if options['workers'] is None else {'PASSWORD_HASHING_WORKERS': options['workers'], 'PASSWORD_HASHING_MAX_PENDING': 4 * options['workers']}),
+		]
+		with scratch_database(), override_settings(ALLOWED_HOSTS=['*']), live_server() as base_url:
+			# Every 429 is logged as a warning otherwise. Set after the
+			# server's setup, which reconfigures logging.
+			logging.getLogger('django.request').setLevel(logging.ERROR)
+			user = User(username='bench')
+			user.set_password('bench-password-1')
+			user.save()
+
+			for mode, hashing_settings in modes:
+				with override_settings(**hashing_settings):
+					register = lambda client, n: ('register', http_request('POST', base_url + '/register/', {
+						'username': '%s-%d-%d' % (mode, client, n), 'password': 'bench-password-1', 'first_name': 'b', 'last_name': 'b',
+					}))
+					login = lambda client, n: ('login', http_request('POST', base_url + '/login/', {'username': 'bench', 'password': 'bench-password-1'}))
+					for name, request in (('register', register), ('login', login)):
+						summary, statuses = load(request, options['clients'], options['duration'], backoff=settings.PASSWORD_HASHING_RETRY_AFTER)[name]
+						succeeded = sum(count for code, count in statuses.items() if code < 300)
+						self.stdout.write('%s  %6.1f ok/s  %s' % (
+							format_summary('%-8s %s' % (mode, name), summary), succeeded / options['duration'], statuses,
+						))
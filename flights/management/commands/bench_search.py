@@ -0,0 +1,44 @@
+from django.core.management.base import BaseCommand
+from django.test.utils import override_settings
+from rest_framework.filters import SearchFilter, OrderingFilter
+from rest_framework.test import APIRequestFactory
+
+from flights.benchmarks import scratch_database, generate_flights, measure, format_summary
+from flights.views import FlightsList
+
+
+class LikeFlightsList(FlightsList):
+	filter_backends = [SearchFilter, OrderingFilter]
+
+
+class Command(BaseCommand):
+	help = 'Compare the trigram destination search against the LIKE-based SearchFilter on a synthetic catalog.'
+
+	def add_arguments(self, parser):
+		parser.add_argument('--rows', type=int, default=1000000)
+		parser.add_argument('--destinations', type=int, default=5000)
+		parser.add_argument('--repeat', type=int, default=50)
+		parser.add_argument('--seed', type=int, default=0)
+
+	def handle(self, *args, **options):
+		with scratch_database(), override_settings(ALLOWED_HOSTS=['testserver']):
+			self.stdout.write('Generating %d flights...' % options['rows'])
+			names = generate_flights(options['rows'], options['destinations'], options['seed'])
+
+			name = names[len(names) // 2]
+			word = name.split()[0].lower()
+			typo = word[:2] + ('x' if word[2] != 'x' else 'y') + word[3:]
+			terms = [
+				('prefix', word[:3]),
+				('token', word),
+				('typo', typo),
+				('miss', 'qqqqq'),
+			]
+
+			factory = APIRequestFactory()
+			paths = [('trigram', FlightsList.as_view()), ('like', LikeFlightsList.as_view())]
+			for kind, term in terms:
+				request = factory.get('/flights/', {'search': term})
+				for label, view in paths:
+					summary = measure(lambda: view(request).render(), options['repeat'])
+					self.stdout.write(format_summary('%s %s %r' % (label, kind, term), summary))
@@ -0,0 +1,46 @@
+import time
+
+from django.core.management.base import BaseCommand
+from rest_framework.renderers import JSONRenderer
+
+from flights.benchmarks import scratch_database, generate_dataset
+from flights.models import Flight, Booking
+from flights.renderers import FastJSONRenderer, orjson
+from flights.rows import RowReader
+from flights.serializers import FlightSerializer, BookingSerializer
+
+
+class Command(BaseCommand):
+	help = 'Rows per second of list serialization: ModelSerializer and JSONRenderer against values_list rows and FastJSONRenderer.'
+
+	def add_arguments(self, parser):
+		parser.add_argument('--sizes', type=int, nargs='+', default=[10000, 100000])
+		parser.add_argument('--repeat', type=int, default=3)
+
+	def handle(self, *args, **options):
+		largest = max(options['sizes'])
+		self.stdout.write('orjson %s' % ('installed' if orjson is not None else 'not installed, FastJSONRenderer falls back to json'))
+		with scratch_database():
+			generate_dataset(flights=largest, users=max(largest // 100, 1), bookings_per_user=100, past_share=0)
+			cases = [
+				('flights', Flight.objects.order_by('destination', 'id'), FlightSerializer),
+				('bookings', Booking.objects.select_related('flight').order_by('date', 'id'), BookingSerializer),
+			]
+			for name, queryset, serializer_class in cases:
+				reader = RowReader.for_serializer(serializer_class)
+				for size in options['sizes']:
+					def serializer_path():
+						return JSONRenderer().render(serializer_class(list(queryset[:size]), many=True).data)
+
+					def rows_path():
+						return FastJSONRenderer().render(reader.build_many(queryset.values_list(*reader.columns)[:size]))
+
+					assert serializer_path() == rows_path()
+					for label, func in (('ModelSerializer', serializer_path), ('values_list rows', rows_path)):
+						best = min(self.time(func) for _ in range(options['repeat']))
+						self.stdout.write('%-9s %7d rows  %-17s %10.0f rows/s  %8.1f ms' % (name, size, label, size / best, best * 1000))
+
+	def time(self, func):
+		start = time.perf_counter()
+		func()
+		return time.perf_counter() - start
@@ -0,0 +1,70 @@
+import logging
+import random
+
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand
+from django.db import connections
+from django.test.utils import override_settings
+from rest_framework_simplejwt.tokens import RefreshToken
+
+from flights.benchmarks import scratch_database, generate_flights, live_server, load, http_request, format_summary
+from flights.models import Flight
+from task_1 import settings_production
+
+
+class Command(BaseCommand):
+	help = 'Mixed booking writes and catalog reads from many threads, stock SQLite settings against the production profile.'
+
+	def add_arguments(self, parser):
+		parser.add_argument('--clients', type=int, default=32)
+		parser.add_argument('--duration', type=float, default=10)
+		parser.add_argument('--writes', type=float, default=0.2, help='Share of requests that are bookings.')
+		parser.add_argument('--flights', type=int, default=20000)
+		parser.add_argument('--seed', type=int, default=0)
+
+	def handle(self, *args, **options):
+		profiles = [
+			('stock', {}, 0),
+			('production', settings_production.SQLITE_PRAGMAS, settings_production.DATABASES['default']['CONN_MAX_AGE']),
+		]
+		# Catalog caching would hide the reads from the database.
+		caches = dict(settings.CACHES, **{settings.CATALOG_CACHE: {'BACKEND': 'django.core.cache.backends.dummy.DummyCache'}})
+		for name, pragmas, max_age in profiles:
+			with override_settings(ALLOWED_HOSTS=['*'], CACHES=caches, SQLITE_PRAGMAS=pragmas), scratch_database():
+				connection = connections['default']
+				connection.settings_dict['CONN_MAX_AGE'] = max_age
+				try:
+					self.run(name, options)
+				finally:
+					connection.settings_dict['CONN_MAX_AGE'] = 0
+
+	def run(self, name, options):
+		names = generate_flights(options['flights'], seed=options['seed'])
+		flight_ids = list(Flight.objects.values_list('id', flat=True))
+		tokens = []
+		for index in range(options['clients']):
+			user = User.objects.create(username='bench%d' % index)
+			tokens.append('Bearer %s' % RefreshToken.for_user(user).access_token)
+
+		def request(client, n):
+			rng = random.Random(options['seed'] * 1000003 + client * 7919 + n)
+			headers = {'Authorization': tokens[client]}
+			if rng.random() < options['writes']:
+				data = {'date': '2030-%02d-%02d' % (rng.randint(1, 12), rng.randint(1, 28)), 'passengers': rng.randint(1, 4)}
+				return 'book', http_request('POST', '%s/book/%d/' % (base_url, rng.choice(flight_ids)), data, headers)
+			word = rng.choice(names).split()[0][:4].lower()
+			return 'catalog', http_request('GET', '%s/flights/?search=%s&page_size=20' % (base_url, word))
+
+		with live_server() as base_url:
+			# Lock errors are 500s and would each print a traceback.
+			logging.getLogger('django.request').setLevel(logging.CRITICAL)
+			results = load(request, options['clients'], options['duration'])
+
+		for label in sorted(results):
+			summary, statuses = results[label]
+			self.stdout.write('%s  errors %5d  %s' % (
+				format_summary('%-10s %s' % (name, label), summary),
+				sum(count for code, count in statuses.items() if code >= 500),
+				statuses,
+			))
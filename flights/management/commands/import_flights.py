@@ -0,0 +1,57 @@
+import os
+import sys
+
+from django.core.management.base import BaseCommand, CommandError
+
+from flights.schedule import READERS, import_schedule
+
+
+class Command(BaseCommand):
+	help = (
+		'Create or update flights from a CSV or NDJSON schedule, matched on destination and time. '
+		'Takes the columns of export/flights.csv: destination, time, price, miles and optionally capacity.'
+	)
+
+	def add_arguments(self, parser):
+		parser.add_argument('path', help='Schedule file, or - for standard input.')
+		parser.add_argument('--format', choices=sorted(READERS), help='Defaults to the file\'s extension.')
+		# Each chunk's lookup binds up to two parameters per row, and SQLite
+		# allows 999.
+		parser.add_argument('--chunk-size', type=int, default=400)
+		parser.add_argument('--dry-run', action='store_true', help='Validate and count the changes without writing them.')
+		parser.add_argument('--progress', type=int, default=50000, help='Report progress every this many rows.')
+
+	def handle(self, *args, **options):
+		if options['chunk_size'] < 1:
+			raise CommandError('--chunk-size must be positive.')
+		schedule_format = options['format'] or os.path.splitext(options['path'])[1].lstrip('.').lower()
+		if schedule_format not in READERS:
+			raise CommandError('Cannot tell the format of %r, use --format.' % options['path'])
+
+		if options['path'] == '-':
+			return self.run(READERS[schedule_format](sys.stdin), options)
+		try:
+			lines = open(options['path'], encoding='utf-8', newline='')
+		except OSError as error:
+			raise CommandError('Cannot read %s: %s' % (options['path'], error.strerror))
+		with lines:
+			self.run(READERS[schedule_format](lines), options)
+
+	def run(self, rows, options):
+		totals = [0, 0, 0, 0]
+		reported = 0
+		for chunk in import_schedule(rows, options['chunk_size'], options['dry_run']):
+			created, updated, unchanged, invalid = chunk
+			for line_number, errors in invalid:
+				self.stderr.write('Line %d: %s' % (line_number, '; '.join('%s: %s' % (name, ' '.join(messages)) for name, messages in errors.items())))
+			for index, count in enumerate((created, updated, unchanged, len(invalid))):
+				totals[index] += count
+			if options['verbosity'] > 1:
+				self.stdout.write('  chunk: %d created, %d updated, %d unchanged, %d invalid' % (created, updated, unchanged, len(invalid)))
+			if options['progress'] > 0 and options['verbosity'] > 0 and sum(totals) // options['progress'] > reported:
+				reported = sum(totals) // options['progress']
+				self.stdout.write('  %d row(s) processed' % sum(totals))
+		self.stdout.write('%s %d and %s %d flight(s), %d unchanged, %d invalid row(s).' % (
+			'Would create' if options['dry_run'] else 'Created', totals[0],
+			'update' if options['dry_run'] else 'updated', totals[1], totals[2], totals[3],
+		))
@@ -0,0 +1,60 @@
+import os
+import sqlite3
+import tempfile
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.db import DEFAULT_DB_ALIAS, connections
+
+
+class Command(BaseCommand):
+	help = 'Copy the primary SQLite database to the local read replica with the SQLite backup API.'
+
+	def add_arguments(self, parser):
+		parser.add_argument('--path', default=settings.REPLICA_DATABASE_PATH)
+		parser.add_argument('--interval', type=float, help='Keep copying every INTERVAL seconds.')
+		parser.add_argument('--pages', type=int, default=1024, help='Pages copied per backup step.')
+
+	def handle(self, *args, **options):
+		connection = connections[DEFAULT_DB_ALIAS]
+		if connection.vendor != 'sqlite':
+			raise CommandError('replicate only supports SQLite databases.')
+		if connection.in_atomic_block:
+			# SQLite can't back up a database while the same connection is
+			# writing to it, and would retry forever.
+			raise CommandError('replicate cannot run inside a transaction.')
+
+		while True:
+			start = time.perf_counter()
+			self.snapshot(connection, options['path'], options['pages'])
+			if options['verbosity'] > 0:
+				self.stdout.write('Replicated to %s in %.1f ms.' % (options['path'], (time.perf_counter() - start) * 1000))
+			if not options['interval']:
+				break
+			time.sleep(options['interval'])
+
+	def snapshot(self, connection, path, pages):
+		# The backup copies a consistent snapshot a few pages at a time,
+		# restarting if the primary changes underneath, so writers are only
+		# blocked for one step at a time. It is written next to the replica
+		# and renamed over it: readers with the old file open keep a
+		# consistent view, and new connections open the new copy.
+		connection.ensure_connection()
+		directory = os.path.dirname(os.path.abspath(path))
+		handle, temporary = tempfile.mkstemp(dir=directory, suffix='.sqlite3')
+		os.close(handle)
+		try:
+			target = sqlite3.connect(temporary)
+			try:
+				connection.connection.backup(target, pages=pages)
+				# The copy inherits the primary's WAL mode. Readers would then
+				# keep -wal/-shm files beside the replica that don't belong
+				# to the next copy swapped in.
+				target.execute('PRAGMA journal_mode = DELETE')
+			finally:
+				target.close()
+			os.replace(temporary, path)
+		except BaseException:
+			os.remove(temporary)
+			raise
@@ -0,0 +1,26 @@
+from django.core.management.base import BaseCommand, CommandError
+from django.db.models import Max, Min
+
+from flights.models import Profile, TierThreshold
+
+
+class Command(BaseCommand):
+	help = 'Recompute every profile\'s loyalty tier, e.g. after the tier thresholds changed.'
+
+	def add_arguments(self, parser):
+		parser.add_argument('--chunk-size', type=int, default=50000)
+
+	def handle(self, *args, **options):
+		if options['chunk_size'] < 1:
+			raise CommandError('--chunk-size must be positive.')
+		if not TierThreshold.objects.filter(min_miles=0).exists():
+			self.stderr.write('Warning: no tier starts at 0 miles, profiles below the lowest threshold get no tier.')
+
+		# Primary key ranges keep each UPDATE, and the write lock it holds,
+		# short.
+		bounds = Profile.objects.aggregate(first=Min('id'), last=Max('id'))
+		updated = 0
+		if bounds['first'] is not None:
+			for first_id in range(bounds['first'], bounds['last'] + 1, options['chunk_size']):
+				updated += Profile.retier(Profile.objects.filter(id__gte=first_id, id__lt=first_id + options['chunk_size']))
+		self.stdout.write('Retiered %d profile(s).' % updated)
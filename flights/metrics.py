@@ -0,0 +1,289 @@
+import glob
+import hmac
+import json
+import mmap
+import os
+import struct
+import threading
+import time
+from bisect import bisect_left
+from collections import defaultdict
+from contextlib import ExitStack
+
+from django.conf import settings
+from django.core.signals import setting_changed
+from django.db import connections
+from django.dispatch import receiver
+from django.http import Http404, HttpResponse
+
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+_state = threading.local()
+
+
+class MmapStorage:
+	# Float values keyed by (metric, sample, labels, bucket), in an mmap of
+	# `path` (anonymous memory without one). Each process writes its own
+	# file and only ever appends keys, so readers in other processes can
+	# scan every file without locking: an entry is complete before the
+	# header's end offset is moved past it.
+	header = struct.Struct('<Q')
+	length = struct.Struct('<I')
+	value = struct.Struct('<d')
+	initial_size = 64 * 1024
+
+	def __init__(self, path=None):
+		self.path = path
+		self.pid = os.getpid()
+		self.lock = threading.Lock()
+		self.offsets = {}
+		if path is None:
+			self.file = None
+			self.map = mmap.mmap(-1, self.initial_size)
+		else:
+			self.file = open(path, 'a+b')
+			if os.path.getsize(path) < self.initial_size:
+				self.file.truncate(self.initial_size)
+			self.map = mmap.mmap(self.file.fileno(), 0)
+		self.used = self.header.unpack_from(self.map, 0)[0] or self.header.size
+		# A restarted process with a recycled pid continues its old file.
+		for key, offset in self.entries(self.map, self.used):
+			self.offsets[key] = offset
+
+	@classmethod
+	def entries(cls, buffer, used):
+		position = cls.header.size
+		while position < used:
+			size = cls.length.unpack_from(buffer, position)[0]
+			name, sample, labels, bucket = json.loads(bytes(buffer[position + 4:position + 4 + size]).decode('utf-8').rstrip(' '))
+			position += 4 + size
+			yield (name, sample, tuple(labels), bucket), position
+			position += cls.value.size
+
+	@classmethod
+	def read(cls, buffer):
+		used = cls.header.unpack_from(buffer, 0)[0]
+		for key, offset in cls.entries(buffer, used):
+			yield key, cls.value.unpack_from(buffer, offset)[0]
+
+	def items(self):
+		return self.read(self.map)
+
+	def allocate(self, key):
+		encoded = json.dumps(key).encode('utf-8')
+		# Pads the key with spaces so the value is 8-byte aligned.
+		encoded += b' ' * (-(len(encoded) + 4) % 8)
+		end = self.used + 4 + len(encoded) + self.value.size
+		if end > len(self.map):
+			size = len(self.map)
+			while size < end:
+				size *= 2
+			# Grows the file too.
+			self.map.resize(size)
+		self.length.pack_into(self.map, self.used, len(encoded))
+		self.map[self.used + 4:self.used + 4 + len(encoded)] = encoded
+		offset = self.used + 4 + len(encoded)
+		self.value.pack_into(self.map, offset, 0.0)
+		self.used = end
+		self.header.pack_into(self.map, 0, end)
+		self.offsets[key] = offset
+		return offset
+
+	def add(self, key, amount):
+		with self.lock:
+			offset = self.offsets.get(key)
+			if offset is None:
+				offset = self.allocate(key)
+			self.value.pack_into(self.map, offset, self.value.unpack_from(self.map, offset)[0] + amount)
+
+	def close(self):
+		self.map.close()
+		if self.file is not None:
+			self.file.close()
+
+
+_storage = None
+_storage_lock = threading.Lock()
+
+
+def get_storage():
+	# One storage per process: a forked worker gets a file of its own.
+	global _storage
+	storage = _storage
+	if storage is not None and storage.pid == os.getpid():
+		return storage
+	with _storage_lock:
+		if _storage is None or _storage.pid != os.getpid():
+			path = os.path.join(settings.METRICS_DIR, 'metrics_%d.db' % os.getpid()) if settings.METRICS_DIR else None
+			if path is not None:
+				os.makedirs(settings.METRICS_DIR, exist_ok=True)
+			_storage = MmapStorage(path)
+		return _storage
+
+
+@receiver(setting_changed)
+def reset_storage(setting, **kwargs):
+	global _storage
+	if setting == 'METRICS_DIR':
+		with _storage_lock:
+			storage, _storage = _storage, None
+		if storage is not None and storage.pid == os.getpid():
+			storage.close()
+
+
+REGISTRY = []
+
+
+class Metric:
+	type = None
+
+	def __init__(self, name, documentation, labelnames=()):
+		self.name = name
+		self.documentation = documentation
+		self.labelnames = tuple(labelnames)
+		REGISTRY.append(self)
+
+
+class Counter(Metric):
+	type = 'counter'
+
+	def inc(self, *labels, amount=1):
+		get_storage().add((self.name, '', labels, None), amount)
+
+	def samples(self, values):
+		for (sample, labels, bucket), value in sorted(values.items()):
+			yield self.name, labels, (), value
+
+
+class Histogram(Metric):
+	type = 'histogram'
+
+	def __init__(self, name, documentation, labelnames=(), buckets=()):
+		super().__init__(name, documentation, labelnames)
+		self.buckets = tuple(sorted(buckets)) + (float('inf'),)
+
+	def observe(self, value, *labels):
+		storage = get_storage()
+		storage.add((self.name, 'bucket', labels, bisect_left(self.buckets, value)), 1)
+		storage.add((self.name, 'sum', labels, None), value)
+
+	def samples(self, values):
+		by_labels = defaultdict(dict)
+		for (sample, labels, bucket), value in values.items():
+			by_labels[labels][sample, bucket] = value
+		for labels, counts in sorted(by_labels.items()):
+			total = 0
+			for index, bound in enumerate(self.buckets):
+				total += counts.get(('bucket', index), 0)
+				yield self.name + '_bucket', labels, (('le', format_value(bound)),), total
+			yield self.name + '_count', labels, (), total
+			yield self.name + '_sum', labels, (), counts.get(('sum', None), 0)
+
+
+def format_value(value):
+	if value == float('inf'):
+		return '+Inf'
+	return '%d' % value if float(value).is_integer() else repr(float(value))
+
+
+def escape(value):
+	return str(value).replace('\\', '\\\\').replace('\n', '\\n').replace('"', '\\"')
+
+
+def collect():
+	# Sums the samples of every process: all files in METRICS_DIR, or just
+	# this process without one.
+	totals = defaultdict(float)
+	if settings.METRICS_DIR:
+		get_storage()
+		for path in glob.glob(os.path.join(settings.METRICS_DIR, 'metrics_*.db')):
+			with open(path, 'rb') as f:
+				buffer = f.read()
+			for key, value in MmapStorage.read(buffer):
+				totals[key] += value
+	else:
+		for key, value in get_storage().items():
+			totals[key] += value
+	return totals
+
+
+def render():
+	values = defaultdict(dict)
+	for (name, sample, labels, bucket), value in collect().items():
+		values[name][sample, labels, bucket] = value
+	lines = []
+	for metric in REGISTRY:
+		lines.append('# HELP %s %s' % (metric.name, metric.documentation))
+		lines.append('# TYPE %s %s' % (metric.name, metric.type))
+		for name, labels, extra, value in metric.samples(values.get(metric.name, {})):
+			pairs = list(zip(metric.labelnames, labels)) + list(extra)
+			label_text = '{%s}' % ','.join('%s="%s"' % (key, escape(label)) for key, label in pairs) if pairs else ''
+			lines.append('%s%s %s' % (name, label_text, format_value(value)))
+	return '\n'.join(lines) + '\n'
+
+
+REQUESTS = Counter('flights_http_requests_total', 'Requests by view and method.', ['view', 'method'])
+ERRORS = Counter('flights_http_errors_total', 'Responses with a 4xx or 5xx status, by view.', ['view', 'status'])
+LATENCY = Histogram(
+	'flights_http_request_duration_seconds', 'Time spent answering requests, by view.', ['view'],
+	buckets=(0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10),
+)
+QUERIES = Histogram(
+	'flights_db_queries_per_request', 'SQL queries run per request, by view.', ['view'],
+	buckets=(0, 1, 2, 3, 5, 10, 20, 50, 100),
+)
+CACHE = Counter(
+	'flights_cache_requests_total', 'Cache lookups by cache and result. Hit ratio: hit / (hit + miss).', ['cache', 'result'],
+)
+
+
+# Methods counted under their own name. The method comes from the client,
+# and every label value is kept for good in the metrics files, so anything
+# else is counted as "other".
+METHODS = {'GET', 'HEAD', 'POST', 'PUT', 'PATCH', 'DELETE', 'OPTIONS', 'CONNECT', 'TRACE'}
+
+
+def count_query(execute, sql, params, many, context):
+	_state.queries += 1
+	return execute(sql, params, many, context)
+
+
+class MetricsMiddleware:
+	# Counts requests and errors and records latency and query counts per
+	# URL name (the view name for namespaced routes such as the admin).
+	def __init__(self, get_response):
+		self.get_response = get_response
+
+	def __call__(self, request):
+		_state.queries = 0
+		start = time.perf_counter()
+		# Wrapped per request like InstrumentationMiddleware's timer, so the
+		# wrappers nest and unwind in order even when a connection opens
+		# mid-request.
+		with ExitStack() as stack:
+			for connection in connections.all():
+				stack.enter_context(connection.execute_wrapper(count_query))
+			response = self.get_response(request)
+		elapsed = time.perf_counter() - start
+		match = request.resolver_match
+		view = match.view_name if match is not None else 'unmatched'
+		REQUESTS.inc(view, request.method if request.method in METHODS else 'other')
+		if response.status_code >= 400:
+			ERRORS.inc(view, str(response.status_code))
+		LATENCY.observe(elapsed, view)
+		QUERIES.observe(_state.queries, view)
+		return response
+
+
+def metrics(request):
+	# Traffic, errors and latencies per view are not for everyone: only a
+	# scraper holding METRICS_TOKEN gets them, and without a token set the
+	# endpoint doesn't exist.
+	if settings.METRICS_TOKEN is None:
+		raise Http404
+	expected = 'Bearer %s' % settings.METRICS_TOKEN
+	if not hmac.compare_digest(request.META.get('HTTP_AUTHORIZATION', '').encode('utf-8'), expected.encode('utf-8')):
+		response = HttpResponse('Invalid or missing metrics token.\n', status=401, content_type='text/plain; charset=utf-8')
+		response['WWW-Authenticate'] = 'Bearer realm="metrics"'
+		return response
+	return HttpResponse(render(), content_type=CONTENT_TYPE)
@@ -0,0 +1,17 @@
+# Generated by Django 2.2.2 on 2026-10-18 07:44
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('flights', '0007_profile'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='flight',
+            index=models.Index(fields=['destination', 'id'], name='flight_destination_id_idx'),
+        ),
+    ]
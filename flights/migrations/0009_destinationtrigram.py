@@ -0,0 +1,36 @@
+# Generated by Django 2.2.2 on 2026-10-18 07:45
+
+from django.db import migrations, models
+
+
+def index_destinations(apps, schema_editor):
+    from flights.search import trigrams
+
+    Flight = apps.get_model('flights', 'Flight')
+    DestinationTrigram = apps.get_model('flights', 'DestinationTrigram')
+    for destination in Flight.objects.values_list('destination', flat=True).distinct().iterator():
+        DestinationTrigram.objects.bulk_create(
+            [DestinationTrigram(destination=destination, trigram=gram) for gram in trigrams(destination)],
+            ignore_conflicts=True,
+        )
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('flights', '0008_flight_destination_id_idx'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='DestinationTrigram',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('destination', models.CharField(db_index=True, max_length=100)),
+                ('trigram', models.CharField(max_length=3)),
+            ],
+            options={
+                'unique_together': {('trigram', 'destination')},
+            },
+        ),
+        migrations.RunPython(index_destinations, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,23 @@
+# Generated by Django 2.2.2 on 2026-10-18 07:51
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('flights', '0009_destinationtrigram'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='profile',
+            name='past_bookings_count',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='profile',
+            name='past_bookings_counted_until',
+            field=models.DateField(blank=True, null=True),
+        ),
+    ]
@@ -0,0 +1,31 @@
+# Generated by Django 2.2.2 on 2026-10-18 08:00
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('flights', '0010_profile_past_bookings_count'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='flight',
+            name='capacity',
+            field=models.PositiveIntegerField(default=200),
+        ),
+        migrations.CreateModel(
+            name='SeatInventory',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('date', models.DateField()),
+                ('seats_left', models.PositiveIntegerField()),
+                ('flight', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='inventory', to='flights.Flight')),
+            ],
+            options={
+                'unique_together': {('flight', 'date')},
+            },
+        ),
+    ]
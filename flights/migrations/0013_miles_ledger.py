@@ -0,0 +1,44 @@
+# Generated by Django 2.2.2 on 2026-10-18 08:09
+
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+import django.utils.timezone
+
+
+def record_opening_balances(apps, schema_editor):
+    # Balances from before the ledger become one entry each, so that
+    # reconciling never wipes them.
+    Profile = apps.get_model('flights', 'Profile')
+    MilesLedger = apps.get_model('flights', 'MilesLedger')
+    MilesLedger.objects.bulk_create(
+        [MilesLedger(user_id=user_id, miles=miles) for user_id, miles in Profile.objects.filter(miles__gt=0).values_list('user_id', 'miles').iterator()],
+        batch_size=5000,
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ('flights', '0012_booking_date_indexes'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='MilesLedger',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('booking_id', models.PositiveIntegerField(blank=True, null=True, unique=True)),
+                ('miles', models.IntegerField()),
+                ('flown_on', models.DateField(blank=True, null=True)),
+                ('credited_at', models.DateTimeField(default=django.utils.timezone.now)),
+                ('user', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, db_index=False, related_name='miles_ledger', to=settings.AUTH_USER_MODEL)),
+            ],
+        ),
+        migrations.AddIndex(
+            model_name='milesledger',
+            index=models.Index(fields=['user', 'credited_at'], name='milesledger_user_credited_idx'),
+        ),
+        migrations.RunPython(record_opening_balances, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,52 @@
+# Generated by Django 2.2.2 on 2026-10-18 08:22
+
+from django.db import migrations, models
+from django.db.models import OuterRef, Subquery, Value
+from django.db.models.functions import Coalesce
+
+
+def seed_tiers(apps, schema_editor):
+    # The thresholds ProfileSerializer.get_tier used to hard-code.
+    Profile = apps.get_model('flights', 'Profile')
+    TierThreshold = apps.get_model('flights', 'TierThreshold')
+    TierThreshold.objects.bulk_create([
+        TierThreshold(name='Blue', min_miles=0),
+        TierThreshold(name='Silver', min_miles=10000),
+        TierThreshold(name='Gold', min_miles=60000),
+        TierThreshold(name='Platinum', min_miles=100000),
+    ])
+    Profile.objects.update(tier=Coalesce(
+        Subquery(TierThreshold.objects.filter(min_miles__lte=OuterRef('miles')).order_by('-min_miles').values('name')[:1]),
+        Value(''),
+    ))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('flights', '0013_miles_ledger'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='TierThreshold',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('name', models.CharField(max_length=20, unique=True)),
+                ('min_miles', models.PositiveIntegerField(unique=True)),
+            ],
+            options={
+                'ordering': ['min_miles'],
+            },
+        ),
+        migrations.AddField(
+            model_name='profile',
+            name='tier',
+            field=models.CharField(blank=True, editable=False, max_length=20),
+        ),
+        migrations.AddIndex(
+            model_name='profile',
+            index=models.Index(fields=['tier', 'id'], name='profile_tier_id_idx'),
+        ),
+        migrations.RunPython(seed_tiers, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,17 @@
+# Generated by Django 2.2.2 on 2026-10-18 09:04
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('flights', '0014_loyalty_tiers'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='flight',
+            index=models.Index(fields=['destination', 'time'], name='flight_destination_time_idx'),
+        ),
+    ]
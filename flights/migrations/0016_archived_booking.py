@@ -0,0 +1,32 @@
+# Generated by Django 2.2.2 on 2026-10-18 09:18
+
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+import django.utils.timezone
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ('flights', '0015_flight_destination_time_idx'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ArchivedBooking',
+            fields=[
+                ('id', models.IntegerField(primary_key=True, serialize=False)),
+                ('date', models.DateField()),
+                ('passengers', models.PositiveIntegerField()),
+                ('archived_at', models.DateTimeField(default=django.utils.timezone.now)),
+                ('flight', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='archived_bookings', to='flights.Flight')),
+                ('user', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='archived_bookings', to=settings.AUTH_USER_MODEL)),
+            ],
+        ),
+        migrations.AddIndex(
+            model_name='archivedbooking',
+            index=models.Index(fields=['user', 'date'], name='archivedbooking_user_date_idx'),
+        ),
+    ]
@@ -0,0 +1,21 @@
+# Generated by Django 2.2.2 on 2026-10-18 09:32
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('flights', '0017_booking_date_idx'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='flight',
+            index=models.Index(fields=['time', 'id'], name='flight_time_id_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='flight',
+            index=models.Index(fields=['price', 'id'], name='flight_price_id_idx'),
+        ),
+    ]
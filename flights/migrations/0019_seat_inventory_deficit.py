@@ -0,0 +1,18 @@
+# Generated by Django 2.2.2 on 2026-10-18 10:02
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('flights', '0018_flight_time_price_idx'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='seatinventory',
+            name='seats_left',
+            field=models.IntegerField(),
+        ),
+    ]
@@ -0,0 +1,17 @@
+# Generated by Django 2.2.2 on 2026-10-18 10:35
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('flights', '0019_seat_inventory_deficit'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='flight',
+            index=models.Index(fields=['miles', 'id'], name='flight_miles_id_idx'),
+        ),
+    ]
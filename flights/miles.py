@@ -0,0 +1,70 @@
+from datetime import date
+
+from django.db import connection, transaction
+from django.db.models import DateTimeField, F, Max, Min, OuterRef, Subquery, Sum, Value
+from django.db.models.functions import Coalesce
+from django.utils import timezone
+
+from .models import Booking, MilesLedger, Profile
+
+
+def ledger_totals(entries):
+	# Correlated per-user sum of `entries`, for use in Profile updates.
+	return Subquery(
+		entries.filter(user_id=OuterRef('user_id')).order_by().values('user_id').annotate(total=Sum('miles')).values('total')
+	)
+
+
+def credit_flown_bookings(first_id, last_id, today):
+	# Credits every flown booking with first_id <= id <= last_id that has no
+	# ledger entry yet, with one INSERT ... SELECT and one UPDATE of the
+	# affected profiles. Returns the number of bookings credited. Every chunk
+	# gets its own `credited_at`, which identifies its entries afterwards.
+	credited_at = timezone.now()
+	flown = (
+		Booking.objects
+		.filter(id__gte=first_id, id__lte=last_id, date__lt=today)
+		.exclude(id__in=MilesLedger.objects.filter(booking_id__gte=first_id, booking_id__lte=last_id).values('booking_id'))
+		.annotate(credited_at=Value(credited_at, output_field=DateTimeField()))
+		.order_by()
+		.values_list('user_id', 'id', 'flight__miles', 'date', 'credited_at')
+	)
+	select, params = flown.query.sql_with_params()
+	columns = ', '.join(connection.ops.quote_name(MilesLedger._meta.get_field(name).column) for name in ('user', 'booking_id', 'miles', 'flown_on', 'credited_at'))
+
+	with transaction.atomic():
+		with connection.cursor() as cursor:
+			cursor.execute('INSERT INTO %s (%s) %s' % (connection.ops.quote_name(MilesLedger._meta.db_table), columns, select), params)
+			credited = cursor.rowcount
+		if credited:
+			entries = MilesLedger.objects.filter(booking_id__gte=first_id, booking_id__lte=last_id, credited_at=credited_at)
+			profiles = Profile.objects.filter(user_id__in=entries.values('user_id'))
+			profiles.update(miles=F('miles') + ledger_totals(entries))
+			Profile.retier(profiles)
+	return credited
+
+
+def accrue_miles(today=None, chunk_size=50000):
+	# Walks the bookings table in primary key ranges of `chunk_size`, so each
+	# chunk is a short transaction over an index range. Bookings that already
+	# have a ledger entry are skipped, which makes reruns safe. Yields
+	# (last_id, credited) after each chunk.
+	today = today or date.today()
+	bounds = Booking.objects.aggregate(first=Min('id'), last=Max('id'))
+	if bounds['first'] is None:
+		return
+	for first_id in range(bounds['first'], bounds['last'] + 1, chunk_size):
+		last_id = min(first_id + chunk_size - 1, bounds['last'])
+		yield last_id, credit_flown_bookings(first_id, last_id, today)
+
+
+def reconcile_miles():
+	# Rebuilds every balance from the ledger in a single UPDATE. Returns the
+	# number of profiles whose balance was off.
+	totals = Coalesce(ledger_totals(MilesLedger.objects.all()), 0)
+	drifted = Profile.objects.annotate(ledger_miles=totals).exclude(miles=F('ledger_miles')).count()
+	if drifted:
+		with transaction.atomic():
+			Profile.objects.update(miles=totals)
+			Profile.retier()
+	return drifted
@@ -1,5 +1,15 @@
-from django.db import models
+from django.db import IntegrityError, connections, models, router, transaction
+from django.db.models import Count, F, Func, OuterRef, Q, Subquery, Sum, Value
+from django.db.models.functions import Cast, Coalesce
 from django.contrib.auth.models import User
+from django.utils import timezone
+from datetime import date, timedelta
+
+from .routers import use_primary
+
+# Bookings can only be changed or cancelled more than this many days before
+# the flight.
+CHANGE_NOTICE_DAYS = 3
 
 
 class Flight(models.Model):
@@ -7,24 +17,412 @@ class Flight(models.Model):
 	time = models.TimeField()
 	price = models.DecimalField(max_digits=10, decimal_places=3)
 	miles = models.PositiveIntegerField()
+	capacity = models.PositiveIntegerField(default=200)
+
+	class Meta:
+		indexes = [
+			models.Index(fields=['destination', 'id'], name='flight_destination_id_idx'),
+			# The natural key schedule imports match on.
+			models.Index(fields=['destination', 'time'], name='flight_destination_time_idx'),
+			# Time, price and miles ranges, and the orderings on them that
+			# the flights list pages through.
+			models.Index(fields=['time', 'id'], name='flight_time_id_idx'),
+			models.Index(fields=['price', 'id'], name='flight_price_id_idx'),
+			models.Index(fields=['miles', 'id'], name='flight_miles_id_idx'),
+		]
+
+	@classmethod
+	def from_db(cls, db, field_names, values):
+		instance = super().from_db(db, field_names, values)
+		instance._loaded_destination = instance.__dict__.get('destination')
+		instance._loaded_capacity = instance.__dict__.get('capacity')
+		return instance
 
 	def __str__(self):
 		return "to %s at %s" % (self.destination, str(self.time))
 
 
+class DestinationTrigram(models.Model):
+	destination = models.CharField(max_length=100, db_index=True)
+	trigram = models.CharField(max_length=3)
+
+	class Meta:
+		unique_together = [('trigram', 'destination')]
+
+
+class BookingQuerySet(models.QuerySet):
+	def with_totalprice(self):
+		# Rounded to the price's three decimal places in SQL, since SQLite
+		# multiplies in floating point. The cast gives the result NUMERIC
+		# affinity there, so it compares correctly with the decimal strings
+		# Django binds as parameters.
+		output_field = models.DecimalField(max_digits=20, decimal_places=3)
+		return self.annotate(totalprice=Cast(
+			Func(F('passengers') * F('flight__price'), Value(3), function='ROUND', output_field=output_field),
+			output_field=output_field,
+		))
+
+	def visible_to(self, user):
+		# The bookings IsBookingOwner lets `user` see.
+		return self if user.is_staff else self.filter(user_id=user.id)
+
+	def changeable(self):
+		# The bookings IsChangable allows to be changed or cancelled.
+		return self.filter(date__gt=date.today() + timedelta(days=CHANGE_NOTICE_DAYS))
+
+	def total_revenue(self):
+		return self.with_totalprice().aggregate(total=Sum('totalprice'))['total']
+
+	def book(self, user, flight_id, booking_date, passengers):
+		# Books a flight if it has the seats left, in one transaction: the
+		# seats are reserved first, then the booking is saved as already
+		# counted, so the Booking signals don't take them again. Returns
+		# None when the seats aren't there; raises Flight.DoesNotExist.
+		with transaction.atomic():
+			if not SeatInventory.reserve(flight_id, booking_date, passengers):
+				return None
+			booking = self.model(user=user, flight_id=flight_id, date=booking_date, passengers=passengers)
+			booking._counted_seats = booking.seats()
+			booking.save()
+			return booking
+
+	def cancel(self):
+		# Deletes the bookings in a fixed number of queries however many
+		# there are, doing what the Booking signals do one at a time: the
+		# seats go back and past bookings counts drop. Returns the number of
+		# bookings cancelled.
+		bookings = self.model.objects.filter(pk__in=self.order_by().values('pk'))
+		with transaction.atomic():
+			SeatInventory.adjust(bookings, -1)
+			Profile.adjust_past_bookings_counts(bookings, F('date'), -1)
+			return bookings.delete_rows()
+
+	def delete_rows(self):
+		# A single DELETE that sends no signals, unlike QuerySet.delete(),
+		# which loads every row to send post_delete for it. Nothing points
+		# at Booking, so there are no cascades to follow either.
+		using = router.db_for_write(self.model)
+		sql, params = self.order_by().values('pk').query.get_compiler(using).as_sql()
+		connection = connections[using]
+		with connection.cursor() as cursor:
+			cursor.execute('DELETE FROM %s WHERE %s IN (%s)' % (
+				connection.ops.quote_name(self.model._meta.db_table),
+				connection.ops.quote_name(self.model._meta.pk.column),
+				sql,
+			), params)
+			return cursor.rowcount
+
+	def redate(self, new_date):
+		# Moves the bookings to `new_date` in a fixed number of queries, with
+		# the seat inventory and past bookings counts following. Like editing
+		# a booking in the admin, this doesn't check the seats left: a flight
+		# can end up overbooked, with a deficit of seats left. Returns the
+		# number of bookings moved.
+		bookings = self.model.objects.filter(pk__in=self.order_by().values('pk'))
+		with transaction.atomic():
+			SeatInventory.adjust(bookings, -1)
+			SeatInventory.adjust(bookings, 1, new_date)
+			Profile.adjust_past_bookings_counts(bookings, F('date'), -1)
+			Profile.adjust_past_bookings_counts(bookings, Value(new_date, output_field=models.DateField()), 1)
+			return bookings.update(date=new_date)
+
+
 class Booking(models.Model):
 	flight = models.ForeignKey(Flight, on_delete=models.CASCADE, related_name="bookings")
 	date = models.DateField()
 	user = models.ForeignKey(User, on_delete=models.CASCADE,  related_name="bookings")
 	passengers = models.PositiveIntegerField()
 
+	objects = BookingQuerySet.as_manager()
+
+	class Meta:
+		# A user's bookings are listed by date (upcoming, past); seats are
+		# counted per flight and date. SQLite appends the rowid to every
+		# index, so both also cover the trailing `id` of the orderings.
+		indexes = [
+			models.Index(fields=['user', 'date'], name='booking_user_date_idx'),
+			models.Index(fields=['flight', 'date'], name='booking_flight_date_idx'),
+			# For the admin's date filter.
+			models.Index(fields=['date'], name='booking_date_idx'),
+		]
+
+	@classmethod
+	def from_db(cls, db, field_names, values):
+		instance = super().from_db(db, field_names, values)
+		instance._loaded_user_id = instance.__dict__.get('user_id')
+		instance._loaded_date = instance.__dict__.get('date')
+		# What the seat inventory has counted for this booking; see the
+		# Booking signals. Unknown when a field was deferred.
+		seats = tuple(instance.__dict__.get(name) for name in ('flight_id', 'date', 'passengers'))
+		instance._counted_seats = None if None in seats else seats
+		return instance
+
+	def seats(self):
+		return (self.flight_id, self.date, self.passengers)
+
+	def __str__(self):
+		return "%s: %s" % (self.user.username, str(self.flight))
+
+
+class ArchivedBooking(models.Model):
+	# Past bookings moved out of Booking by `manage.py archive_bookings` (see
+	# flights.archive), under their Booking ids. Only bookings whose miles
+	# were credited and which are in their user's past bookings count get
+	# here, so neither needs to look at this table.
+	# A plain integer, so that SQLite makes it the rowid its indexes end in.
+	id = models.IntegerField(primary_key=True)
+	flight = models.ForeignKey(Flight, on_delete=models.CASCADE, related_name="archived_bookings")
+	date = models.DateField()
+	user = models.ForeignKey(User, on_delete=models.CASCADE, related_name="archived_bookings")
+	passengers = models.PositiveIntegerField()
+	archived_at = models.DateTimeField(default=timezone.now)
+
+	objects = BookingQuerySet.as_manager()
+
+	class Meta:
+		indexes = [
+			models.Index(fields=['user', 'date'], name='archivedbooking_user_date_idx'),
+		]
+
 	def __str__(self):
 		return "%s: %s" % (self.user.username, str(self.flight))
 
 
+class SeatInventory(models.Model):
+	flight = models.ForeignKey(Flight, on_delete=models.CASCADE, related_name="inventory")
+	date = models.DateField()
+	# Negative when a flight is overbooked, by as many seats: the admin and
+	# capacity changes can do that.
+	seats_left = models.IntegerField()
+
+	class Meta:
+		unique_together = [('flight', 'date')]
+
+	@classmethod
+	def reserve(cls, flight_id, booking_date, seats):
+		# A single conditional UPDATE, so concurrent bookings only contend on
+		# the row of the flight and date they book. Returns False when there
+		# aren't enough seats left.
+		if seats <= 0:
+			return True
+		if cls._take(flight_id, booking_date, seats):
+			return True
+		if cls.objects.filter(flight_id=flight_id, date=booking_date).exists():
+			return False
+		cls._create(flight_id, booking_date)
+		return bool(cls._take(flight_id, booking_date, seats))
+
+	@classmethod
+	def release(cls, flight_id, booking_date, seats):
+		# Without a row there is nothing to give back: it will be created from
+		# the bookings that remain.
+		if seats > 0:
+			cls.objects.filter(flight_id=flight_id, date=booking_date).update(seats_left=F('seats_left') + seats)
+
+	@classmethod
+	def take(cls, flight_id, booking_date, seats):
+		# Unlike reserve(), takes the seats even if that overbooks the flight.
+		if seats > 0:
+			cls.objects.filter(flight_id=flight_id, date=booking_date).update(seats_left=F('seats_left') - seats)
+
+	@classmethod
+	def resize(cls, flight_ids, change):
+		# Follows a change of capacity of the flights by `change` seats.
+		if change:
+			cls.objects.filter(flight_id__in=flight_ids).update(seats_left=F('seats_left') + change)
+
+	@classmethod
+	def adjust(cls, bookings, sign, booking_date=None):
+		# Takes (sign 1) or gives back (sign -1) the seats of `bookings` on
+		# their own dates, or all on `booking_date`, in one UPDATE. Seats
+		# left go negative if that overbooks a flight. Flights and dates
+		# without a row are left alone: the row is created from the bookings
+		# when needed.
+		if booking_date is None:
+			booked = bookings.filter(flight_id=OuterRef('flight_id'), date=OuterRef('date'))
+			rows = cls.objects.filter(flight_id__in=bookings.values('flight_id'), date__in=bookings.values('date'))
+		else:
+			booked = bookings.filter(flight_id=OuterRef('flight_id'))
+			rows = cls.objects.filter(flight_id__in=bookings.values('flight_id'), date=booking_date)
+		seats = Coalesce(Subquery(booked.order_by().values('flight_id').annotate(total=Sum('passengers')).values('total')), Value(0))
+		return rows.update(seats_left=F('seats_left') - sign * seats)
+
+	@classmethod
+	def _take(cls, flight_id, booking_date, seats):
+		return cls.objects.filter(flight_id=flight_id, date=booking_date, seats_left__gte=seats).update(
+			seats_left=F('seats_left') - seats,
+		)
+
+	@classmethod
+	def _create(cls, flight_id, booking_date):
+		# Rows are created on the first reservation for a flight and date, from
+		# the capacity minus whatever is already booked. Locking the flight
+		# keeps other reservations from booking between the count and the
+		# insert. SQLite ignores select_for_update(), but it has a single
+		# writer: the caller's transaction already holds the write lock from
+		# _take(). Losing the race to another request creating the same row
+		# is fine.
+		with transaction.atomic():
+			capacity = Flight.objects.select_for_update().filter(id=flight_id).values_list('capacity', flat=True).first()
+			if capacity is None:
+				raise Flight.DoesNotExist("Flight %s does not exist." % flight_id)
+			booked = Booking.objects.filter(flight_id=flight_id, date=booking_date).aggregate(total=Sum('passengers'))['total'] or 0
+			try:
+				with transaction.atomic():
+					cls.objects.create(flight_id=flight_id, date=booking_date, seats_left=capacity - booked)
+			except IntegrityError:
+				pass
+
+	def __str__(self):
+		return "%s on %s: %d seats left" % (self.flight, self.date, self.seats_left)
+
+
+class MilesLedger(models.Model):
+	# Append-only record of every miles credit. Profile.miles is the sum of a
+	# user's entries; see flights.miles. `booking_id` is a plain column
+	# rather than a foreign key so that credits outlive their bookings.
+	user = models.ForeignKey(User, on_delete=models.CASCADE, related_name="miles_ledger", db_index=False)
+	booking_id = models.PositiveIntegerField(unique=True, null=True, blank=True)
+	miles = models.IntegerField()
+	flown_on = models.DateField(null=True, blank=True)
+	credited_at = models.DateTimeField(default=timezone.now)
+
+	class Meta:
+		# Accrual adds up the entries each chunk credited per user.
+		indexes = [
+			models.Index(fields=['user', 'credited_at'], name='milesledger_user_credited_idx'),
+		]
+
+	def __str__(self):
+		return "%s: %+d miles" % (self.user, self.miles)
+
+
+class TierThreshold(models.Model):
+	# Loyalty tiers: a profile is in the tier with the highest `min_miles` it
+	# has reached. After changing these, run `manage.py retier`.
+	name = models.CharField(max_length=20, unique=True)
+	min_miles = models.PositiveIntegerField(unique=True)
+
+	class Meta:
+		ordering = ['min_miles']
+
+	@classmethod
+	def tier_for(cls, miles):
+		return cls.objects.filter(min_miles__lte=miles).order_by('-min_miles').values_list('name', flat=True).first() or ''
+
+	@classmethod
+	def tier_expression(cls, miles_field='miles'):
+		# tier_for() as an SQL expression, for updating many rows at once.
+		return Coalesce(
+			Subquery(cls.objects.filter(min_miles__lte=OuterRef(miles_field)).order_by('-min_miles').values('name')[:1]),
+			Value(''),
+		)
+
+	def __str__(self):
+		return "%s (%d+ miles)" % (self.name, self.min_miles)
+
+
 class Profile(models.Model):
 	user = models.OneToOneField(User, on_delete=models.CASCADE)
 	miles = models.PositiveIntegerField(default=0)
+	past_bookings_count = models.PositiveIntegerField(default=0)
+	past_bookings_counted_until = models.DateField(null=True, blank=True)
+	# Kept in step with `miles` by save(), the miles accrual and `retier`.
+	tier = models.CharField(max_length=20, blank=True, editable=False)
+
+	class Meta:
+		indexes = [
+			models.Index(fields=['tier', 'id'], name='profile_tier_id_idx'),
+		]
+
+	@classmethod
+	def from_db(cls, db, field_names, values):
+		instance = super().from_db(db, field_names, values)
+		instance._loaded_miles = instance.__dict__.get('miles')
+		return instance
+
+	def save(self, *args, **kwargs):
+		if self._state.adding or self.miles != getattr(self, '_loaded_miles', None):
+			self.tier = TierThreshold.tier_for(self.miles)
+			self._loaded_miles = self.miles
+			if kwargs.get('update_fields') is not None:
+				kwargs['update_fields'] = set(kwargs['update_fields']) | {'tier'}
+		super().save(*args, **kwargs)
+
+	@classmethod
+	def retier(cls, profiles=None):
+		# One set-based UPDATE; every row looks its tier up in the
+		# TierThreshold index.
+		profiles = cls.objects.all() if profiles is None else profiles
+		return profiles.update(tier=TierThreshold.tier_expression())
+
+	def refresh_past_bookings_count(self, today=None):
+		# Bookings turn into past bookings as days go by. The stored count
+		# covers bookings dated before `past_bookings_counted_until`, so only
+		# the days since the last refresh have to be counted.
+		today = today or date.today()
+		counted_until = self.past_bookings_counted_until
+		if counted_until is not None and counted_until >= today:
+			return
+
+		# Counted on the primary: a lagging replica would miss the latest
+		# bookings, and the stored count never looks at those days again.
+		with use_primary():
+			bookings = Booking.objects.filter(user_id=self.user_id, date__lt=today)
+			if counted_until is not None:
+				bookings = bookings.filter(date__gte=counted_until)
+			newly_past = bookings.count()
+
+			updated = Profile.objects.filter(pk=self.pk, past_bookings_counted_until=counted_until).update(
+				past_bookings_count=F('past_bookings_count') + newly_past,
+				past_bookings_counted_until=today,
+			)
+			if updated:
+				self.past_bookings_count += newly_past
+				self.past_bookings_counted_until = today
+			else:
+				self.refresh_from_db(fields=['past_bookings_count', 'past_bookings_counted_until'])
+
+	@classmethod
+	def refresh_past_bookings_counts(cls, profiles, today=None):
+		# refresh_past_bookings_count() for many profiles in one UPDATE.
+		today = today or date.today()
+		since = Coalesce(OuterRef('past_bookings_counted_until'), Value(date.min), output_field=models.DateField())
+		newly_past = (
+			Booking.objects
+			.filter(user_id=OuterRef('user_id'), date__lt=today, date__gte=since)
+			.order_by().values('user_id').annotate(count=Count('id')).values('count')
+		)
+		return profiles.filter(Q(past_bookings_counted_until__isnull=True) | Q(past_bookings_counted_until__lt=today)).update(
+			past_bookings_count=F('past_bookings_count') + Coalesce(Subquery(newly_past), Value(0)),
+			past_bookings_counted_until=today,
+		)
+
+	@classmethod
+	def adjust_past_bookings_counts(cls, bookings, date_expression, sign):
+		# adjust_past_bookings_count() for every booking of `bookings` in one
+		# UPDATE, each dated `date_expression` (F('date') or a Value).
+		# Counts only cover days before today, see
+		# refresh_past_bookings_count().
+		counted = (
+			bookings
+			.annotate(counted_date=date_expression)
+			.filter(user_id=OuterRef('user_id'), counted_date__lt=OuterRef('past_bookings_counted_until'))
+			.order_by().values('user_id').annotate(count=Count('id')).values('count')
+		)
+		return cls.objects.filter(user_id__in=bookings.values('user_id'), past_bookings_counted_until__isnull=False).update(
+			past_bookings_count=F('past_bookings_count') + sign * Coalesce(Subquery(counted), Value(0)),
+		)
+
+	@staticmethod
+	def adjust_past_bookings_count(user_id, booking_date, delta):
+		# Counts only ever cover days before today, so bookings from today on
+		# can't be in one and need no query.
+		if Booking._meta.get_field('date').to_python(booking_date) >= date.today():
+			return
+		Profile.objects.filter(user_id=user_id, past_bookings_counted_until__gt=booking_date).update(
+			past_bookings_count=F('past_bookings_count') + delta,
+		)
 
 	def __str__(self):
 		return str(self.user)
\ No newline at end of file
@@ -0,0 +1,140 @@
+import json
+from base64 import urlsafe_b64decode, urlsafe_b64encode
+from operator import attrgetter
+
+from django.core.exceptions import ValidationError
+from django.db.models import Q
+from rest_framework.exceptions import NotFound
+from rest_framework.pagination import CursorPagination, _reverse_ordering
+from rest_framework.utils.urls import replace_query_param
+
+from .filters import resolve_field
+
+
+class KeysetPagination(CursorPagination):
+	# Cursor pagination over the whole ordering tuple (primary key appended as
+	# a tie-breaker) rather than an offset, so every page is one index range
+	# scan however deep it is. The ordering is whatever the filter backends
+	# left on the queryset, falling back to `ordering`.
+	ordering = ('id',)
+	page_size = 100
+	page_size_query_param = 'page_size'
+	max_page_size = 1000
+
+	def paginate_queryset(self, queryset, request, view=None):
+		self.page_size = self.get_page_size(request)
+		if not self.page_size:
+			return None
+
+		self.base_url = request.build_absolute_uri()
+		self.ordering = self.get_ordering(request, queryset, view)
+		self.fields = [resolve_field(queryset, name.lstrip('-')) for name in self.ordering]
+		self.cursor = self.decode_cursor(request)
+		reverse, position = self.cursor or (False, None)
+
+		results = self.fetch(queryset, position, reverse, view)
+		has_more = len(results) > self.page_size
+		self.page = results[:self.page_size]
+
+		if reverse:
+			self.page.reverse()
+			self.has_next = position is not None
+			self.has_previous = has_more
+		else:
+			self.has_next = has_more
+			self.has_previous = position is not None
+
+		self.display_page_controls = self.has_next or self.has_previous
+		return self.page
+
+	def fetch(self, queryset, position, reverse, view):
+		# The page's rows and one more, to tell whether there are more.
+		if position is not None:
+			queryset = queryset.filter(self.get_keyset_filter(position, reverse))
+		if reverse:
+			queryset = queryset.order_by(*_reverse_ordering(self.ordering))
+		else:
+			queryset = queryset.order_by(*self.ordering)
+		return list(queryset[:self.page_size + 1])
+
+	def get_ordering(self, request, queryset, view):
+		ordering = tuple(queryset.query.order_by) or tuple(self.ordering)
+		assert all(isinstance(name, str) and name != '?' for name in ordering), (
+			'Keyset pagination requires an ordering made of field names, got %r.' % (ordering,)
+		)
+		pk_name = queryset.model._meta.pk.name
+		if not any(name.lstrip('-') in ('pk', pk_name) for name in ordering):
+			ordering += (('-' if ordering[-1].startswith('-') else '') + pk_name,)
+		return ordering
+
+	def get_keyset_filter(self, position, reverse):
+		# Rows strictly after the cursor: (a > x) OR (a = x AND b > y) OR ...
+		# The leading column is also bounded on its own so the database can
+		# turn the predicate into an index range scan.
+		keyset = Q()
+		equal = {}
+		for name, value in zip(self.ordering, position):
+			field = name.lstrip('-')
+			descending = name.startswith('-') != reverse
+			keyset |= Q(**equal) & Q(**{'%s__%s' % (field, 'lt' if descending else 'gt'): value})
+			equal[field] = value
+
+		first = self.ordering[0]
+		descending = first.startswith('-') != reverse
+		bound = Q(**{'%s__%s' % (first.lstrip('-'), 'lte' if descending else 'gte'): position[0]})
+		return bound & keyset
+
+	def get_position(self, instance):
+		if isinstance(instance, dict):
+			return [instance[name.lstrip('-')] for name in self.ordering]
+		return [getattr(instance, name.lstrip('-')) for name in self.ordering]
+
+	def get_next_link(self):
+		if not self.has_next:
+			return None
+		position = self.get_position(self.page[-1]) if self.page else self.cursor[1]
+		return self.encode_cursor((False, position))
+
+	def get_previous_link(self):
+		if not self.has_previous:
+			return None
+		position = self.get_position(self.page[0]) if self.page else self.cursor[1]
+		return self.encode_cursor((True, position))
+
+	def decode_cursor(self, request):
+		encoded = request.query_params.get(self.cursor_query_param)
+		if encoded is None:
+			return None
+
+		try:
+			cursor = json.loads(urlsafe_b64decode(encoded.encode('ascii')).decode('utf-8'))
+			reverse, values = bool(cursor['r']), cursor['p']
+			if len(values) != len(self.fields):
+				raise ValueError
+			position = [field.to_python(value) for field, value in zip(self.fields, values)]
+		except (TypeError, ValueError, KeyError, ValidationError):
+			raise NotFound(self.invalid_cursor_message)
+
+		return reverse, position
+
+	def encode_cursor(self, cursor):
+		reverse, position = cursor
+		payload = json.dumps({'r': int(reverse), 'p': [str(value) for value in position]}, separators=(',', ':'))
+		encoded = urlsafe_b64encode(payload.encode('utf-8')).decode('ascii')
+		return replace_query_param(self.base_url, self.cursor_query_param, encoded)
+
+
+class MergedKeysetPagination(KeysetPagination):
+	# Pages through the view's queryset and those of its
+	# get_merged_querysets() as one sequence, for rows split over tables
+	# with the same fields. Each page is fetched from every queryset with the
+	# same keyset filter and merged in the ordering, so it costs one index
+	# range scan per table. Primary keys must be unique across the tables.
+	def fetch(self, queryset, position, reverse, view):
+		rows = []
+		for part in [queryset] + list(view.get_merged_querysets()):
+			rows.extend(super().fetch(part, position, reverse, view))
+		# Stable sorts from the last ordering field to the first.
+		for name in reversed(self.ordering):
+			rows.sort(key=attrgetter(name.lstrip('-')), reverse=name.startswith('-') != reverse)
+		return rows[:self.page_size + 1]
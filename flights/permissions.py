@@ -1,12 +1,14 @@
 from rest_framework.permissions import BasePermission
 from datetime import date
 
+from .models import CHANGE_NOTICE_DAYS
+
 
 class IsBookingOwner(BasePermission):
 	message = "You must be the owner of this booking"
 
 	def has_object_permission(self, request, view, obj):
-		if request.user.is_staff or (obj.user == request.user):
+		if request.user.is_staff or (obj.user_id == request.user.id):
 			return True
 		else:
 			return False
@@ -17,7 +19,7 @@ class IsChangable(BasePermission):
 
 	def has_object_permission(self, request, view, obj):
 		days_left = (obj.date - date.today()).days
-		if  days_left > 3:
+		if  days_left > CHANGE_NOTICE_DAYS:
 			return True
 		else:
 			return False
\ No newline at end of file
@@ -0,0 +1,73 @@
+import random
+import threading
+from contextlib import contextmanager
+
+from django.conf import settings
+from django.db import DEFAULT_DB_ALIAS, connections
+from rest_framework.permissions import SAFE_METHODS
+
+_state = threading.local()
+
+
+def is_pinned():
+	return getattr(_state, 'pinned', False)
+
+
+def pin_to_primary():
+	# Reads go to the primary for the rest of the request.
+	_state.pinned = True
+
+
+def reset():
+	_state.pinned = False
+
+
+@contextmanager
+def use_primary():
+	pinned = is_pinned()
+	_state.pinned = True
+	try:
+		yield
+	finally:
+		_state.pinned = pinned
+
+
+class PrimaryReplicaRouter:
+	# Writes go to the primary (`default`), reads to a random database from
+	# DATABASE_REPLICAS. Reads stay on the primary once the request has
+	# written anything, inside transactions on the primary, and for requests
+	# with unsafe methods (see ReplicaPinMiddleware), so a request always
+	# sees its own writes and never decides a write on replica data.
+	def db_for_read(self, model, **hints):
+		replicas = settings.DATABASE_REPLICAS
+		if not replicas or is_pinned() or connections[DEFAULT_DB_ALIAS].in_atomic_block:
+			return DEFAULT_DB_ALIAS
+		return random.choice(replicas)
+
+	def db_for_write(self, model, **hints):
+		pin_to_primary()
+		return DEFAULT_DB_ALIAS
+
+	def allow_relation(self, obj1, obj2, **hints):
+		databases = {DEFAULT_DB_ALIAS, *settings.DATABASE_REPLICAS}
+		if obj1._state.db in databases and obj2._state.db in databases:
+			return True
+		return None
+
+	def allow_migrate(self, db, app_label, model_name=None, **hints):
+		# Replicas are copies of the primary, see `manage.py replicate`.
+		return db not in settings.DATABASE_REPLICAS
+
+
+class ReplicaPinMiddleware:
+	def __init__(self, get_response):
+		self.get_response = get_response
+
+	def __call__(self, request):
+		reset()
+		if request.method not in SAFE_METHODS:
+			pin_to_primary()
+		try:
+			return self.get_response(request)
+		finally:
+			reset()
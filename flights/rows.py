@@ -0,0 +1,162 @@
+import decimal
+import heapq
+from itertools import chain, islice
+from operator import itemgetter, methodcaller
+
+from django.core.exceptions import ImproperlyConfigured
+from rest_framework import serializers
+from rest_framework.response import Response
+from rest_framework.settings import ISO_8601, api_settings
+
+from .instrumentation import timed
+
+# Fields whose to_representation() returns database values unchanged.
+PLAIN_FIELDS = (serializers.IntegerField, serializers.CharField, serializers.SlugRelatedField, serializers.PrimaryKeyRelatedField)
+
+
+class RowReader:
+	# Builds a read-only serializer's output straight from values_list()
+	# rows: one column per field, and a generated function that makes the
+	# output dict in field order, converting only the fields that need it
+	# (decimals, dates, times) the way the fields themselves do. Serializers
+	# with nested serializers, method fields or `source='*'` aren't
+	# supported.
+	_cache = {}
+
+	def __init__(self, serializer_class):
+		self.names = []
+		self.columns = []
+		namespace = {}
+		items = []
+		for name, field in serializer_class().fields.items():
+			if field.write_only:
+				continue
+			index = len(self.columns)
+			self.names.append(name)
+			self.columns.append(self.column(serializer_class, name, field))
+			convert = self.converter(field)
+			if convert is None:
+				items.append('%r: row[%d]' % (name, index))
+			else:
+				namespace['convert%d' % index] = convert
+				items.append('%r: None if row[%d] is None else convert%d(row[%d])' % (name, index, index, index))
+		exec('def build(row):\n\treturn {%s}' % ', '.join(items), namespace)
+		self.build = namespace['build']
+
+	@classmethod
+	def for_serializer(cls, serializer_class):
+		reader = cls._cache.get(serializer_class)
+		if reader is None:
+			reader = cls._cache[serializer_class] = cls(serializer_class)
+		return reader
+
+	def column(self, serializer_class, name, field):
+		if isinstance(field, (serializers.BaseSerializer, serializers.SerializerMethodField, serializers.ManyRelatedField)) or field.source == '*':
+			raise ImproperlyConfigured('%s.%s cannot be read from a values_list() row.' % (serializer_class.__name__, name))
+		attrs = list(field.source_attrs)
+		if isinstance(field, serializers.SlugRelatedField):
+			attrs.append(field.slug_field)
+		return '__'.join(attrs)
+
+	def converter(self, field):
+		if isinstance(field, PLAIN_FIELDS):
+			return None
+		if isinstance(field, (serializers.DateField, serializers.TimeField)) and not isinstance(field, serializers.DateTimeField):
+			default = api_settings.DATE_FORMAT if isinstance(field, serializers.DateField) else api_settings.TIME_FORMAT
+			output_format = getattr(field, 'format', default)
+			if output_format is None:
+				return None
+			if output_format.lower() == ISO_8601:
+				return methodcaller('isoformat')
+		if type(field) is serializers.DecimalField and field.decimal_places is not None and not field.localize:
+			return self.decimal_converter(field)
+		return field.to_representation
+
+	def decimal_converter(self, field):
+		# DecimalField.to_representation() with the quantizing exponent and
+		# context worked out once instead of for every value.
+		coerce_to_string = getattr(field, 'coerce_to_string', api_settings.COERCE_DECIMAL_TO_STRING)
+		exponent = decimal.Decimal('.1') ** field.decimal_places
+		context = decimal.getcontext().copy()
+		if field.max_digits is not None:
+			context.prec = field.max_digits
+		rounding = field.rounding
+
+		def convert(value):
+			if not isinstance(value, decimal.Decimal):
+				return field.to_representation(value)
+			quantized = value.quantize(exponent, rounding=rounding, context=context)
+			return '{0:f}'.format(quantized) if coerce_to_string else quantized
+		return convert
+
+	@timed('serialize')
+	def build_many(self, rows):
+		build = self.build
+		return [build(row) for row in rows]
+
+
+class ValuesListMixin:
+	# list() through RowReader: fetches only the serializer's columns (and
+	# the ordering's, for the paginator's cursors) as tuples instead of
+	# model instances. The output is the same as the serializer's.
+	def list(self, request, *args, **kwargs):
+		queryset = self.filter_queryset(self.get_queryset())
+		reader = RowReader.for_serializer(self.get_serializer_class())
+		columns = list(reader.columns)
+		pk_name = queryset.model._meta.pk.name
+		for name in [name.lstrip('-') for name in queryset.query.order_by] + [pk_name]:
+			if name not in columns:
+				columns.append(name)
+		rows = queryset.values_list(*columns, named=True)
+
+		page = self.paginate_queryset(rows)
+		if page is not None:
+			return self.get_paginated_response(reader.build_many(page))
+		return Response(reader.build_many(rows))
+
+
+def keyset_columns(queryset, columns):
+	# `columns` with the primary key appended if it's missing, and its index.
+	pk_name = queryset.model._meta.pk.name
+	columns = list(columns)
+	if pk_name not in columns:
+		columns.append(pk_name)
+	return columns, columns.index(pk_name)
+
+
+def keyset_chunks(queryset, columns, chunk_size):
+	# values_list() rows of `queryset` in primary key order, `chunk_size` at
+	# a time. Each chunk is its own short query starting after the last key
+	# seen, so no transaction or cursor stays open between chunks and only
+	# one chunk is ever in memory.
+	pk_name = queryset.model._meta.pk.name
+	columns, pk_index = keyset_columns(queryset, columns)
+	queryset = queryset.order_by(pk_name).values_list(*columns)
+	last = None
+	while True:
+		chunk = queryset if last is None else queryset.filter(**{'%s__gt' % pk_name: last})
+		rows = list(chunk[:chunk_size])
+		if not rows:
+			return
+		yield rows
+		if len(rows) < chunk_size:
+			return
+		last = rows[-1][pk_index]
+
+
+def merged_keyset_chunks(querysets, columns, chunk_size):
+	# keyset_chunks() of several querysets with the same columns, as one
+	# primary key order, for rows split over tables. Holds a chunk of each.
+	if len(querysets) == 1:
+		yield from keyset_chunks(querysets[0], columns, chunk_size)
+		return
+	pk_index = keyset_columns(querysets[0], columns)[1]
+	rows = heapq.merge(
+		*[chain.from_iterable(keyset_chunks(queryset, columns, chunk_size)) for queryset in querysets],
+		key=itemgetter(pk_index),
+	)
+	while True:
+		chunk = list(islice(rows, chunk_size))
+		if not chunk:
+			return
+		yield chunk
@@ -0,0 +1,116 @@
+import csv
+import json
+from collections import defaultdict
+
+from django.db import transaction
+from rest_framework.exceptions import ValidationError
+
+from .cache import bump_catalog_version
+from .models import Flight, SeatInventory
+from .search import index_destinations
+from .serializers import FlightExportSerializer
+
+# Flight columns an import may set; the natural key is (destination, time).
+UPDATE_FIELDS = ['price', 'miles', 'capacity']
+
+
+def read_csv(lines):
+	for line_number, row in enumerate(csv.DictReader(lines), start=2):
+		yield line_number, row
+
+
+def read_ndjson(lines):
+	for line_number, line in enumerate(lines, start=1):
+		if not line.strip():
+			continue
+		try:
+			row = json.loads(line)
+		except ValueError as error:
+			row = error
+		yield line_number, row
+
+
+READERS = {'csv': read_csv, 'ndjson': read_ndjson}
+
+
+def validated_chunks(rows, chunk_size):
+	# Validates (line_number, row) pairs with the flight export's serializer,
+	# so exports can be imported again. Yields (valid, invalid) per chunk of
+	# `chunk_size` rows: validated data keyed by (destination, time), later
+	# rows replacing earlier ones, and (line_number, errors) pairs.
+	serializer = FlightExportSerializer()
+	valid, invalid = {}, []
+	for line_number, row in rows:
+		if not isinstance(row, dict):
+			invalid.append((line_number, {'non_field_errors': ['Not a JSON object.']}))
+		else:
+			try:
+				data = serializer.run_validation(row)
+			except ValidationError as error:
+				invalid.append((line_number, error.detail))
+			else:
+				valid[data['destination'], data['time']] = data
+		if len(valid) + len(invalid) >= chunk_size:
+			yield valid, invalid
+			valid, invalid = {}, []
+	if valid or invalid:
+		yield valid, invalid
+
+
+def upsert_flights(rows, dry_run=False):
+	# Inserts the flights of `rows` ({(destination, time): data}) that don't
+	# exist yet and updates the ones whose price, miles or capacity differ,
+	# in one transaction. bulk_create() and bulk_update() skip the Flight
+	# signals, so new destinations are added to the search index and the
+	# seat inventory follows capacity changes here, one UPDATE per distinct
+	# change. Returns (created, updated, unchanged).
+	destinations = {destination for destination, flight_time in rows}
+	times = {flight_time for destination, flight_time in rows}
+	existing = (
+		Flight.objects
+		.filter(destination__in=destinations, time__in=times)
+		.values_list('destination', 'time', 'id', *UPDATE_FIELDS)
+	)
+	updated, unchanged = [], 0
+	found = set()
+	resized = defaultdict(list)
+	for destination, flight_time, flight_id, *current in existing:
+		data = rows.get((destination, flight_time))
+		if data is None:
+			continue
+		found.add((destination, flight_time))
+		values = dict(zip(UPDATE_FIELDS, current))
+		new_values = {name: data.get(name, values[name]) for name in UPDATE_FIELDS}
+		if new_values == values:
+			unchanged += 1
+		else:
+			updated.append(Flight(id=flight_id, destination=destination, time=flight_time, **new_values))
+			if new_values['capacity'] != values['capacity']:
+				resized[new_values['capacity'] - values['capacity']].append(flight_id)
+	created = [Flight(**data) for key, data in rows.items() if key not in found]
+
+	if not dry_run:
+		with transaction.atomic():
+			Flight.objects.bulk_create(created)
+			Flight.objects.bulk_update(updated, UPDATE_FIELDS)
+			for change, flight_ids in resized.items():
+				SeatInventory.resize(flight_ids, change)
+			if created:
+				index_destinations({flight.destination for flight in created})
+	return len(created), len(updated), unchanged
+
+
+def import_schedule(rows, chunk_size=400, dry_run=False):
+	# Upserts validated (line_number, row) pairs one chunk at a time, each
+	# chunk in its own short transaction, and bumps the catalog version once
+	# at the end. Yields (created, updated, unchanged, invalid) per chunk,
+	# where `invalid` lists (line_number, errors).
+	changed = False
+	try:
+		for valid, invalid in validated_chunks(rows, chunk_size):
+			created, updated, unchanged = upsert_flights(valid, dry_run) if valid else (0, 0, 0)
+			changed = changed or bool(created or updated)
+			yield created, updated, unchanged, invalid
+	finally:
+		if changed and not dry_run:
+			bump_catalog_version()
@@ -0,0 +1,180 @@
+import json
+import math
+import re
+
+from django.db import connections
+from django.db.models import Case, CharField, Count, Expression, IntegerField, Value, When
+from rest_framework.filters import SearchFilter
+from rest_framework.settings import api_settings
+
+from .models import Flight, DestinationTrigram
+
+WORD_RE = re.compile(r'\w+')
+
+
+def trigrams(text, prefix=False):
+	# Words are padded the way pg_trgm does it ("  word "), so word starts
+	# weigh more than inner substrings. With `prefix` the last word is left
+	# open at the end because the user is still typing it.
+	words = WORD_RE.findall(text.lower())
+	grams = set()
+	for index, word in enumerate(words):
+		padded = '  ' + word
+		if not (prefix and index == len(words) - 1):
+			padded += ' '
+		grams.update(padded[i:i + 3] for i in range(len(padded) - 2))
+	return grams
+
+
+def index_destination(destination):
+	DestinationTrigram.objects.bulk_create(
+		[DestinationTrigram(destination=destination, trigram=gram) for gram in trigrams(destination)],
+		ignore_conflicts=True,
+	)
+
+
+def index_destinations(destinations):
+	# Batch version of index_destination() that skips destinations already in
+	# the index.
+	known = set(DestinationTrigram.objects.filter(destination__in=destinations).values_list('destination', flat=True).distinct())
+	DestinationTrigram.objects.bulk_create(
+		[DestinationTrigram(destination=destination, trigram=gram) for destination in destinations if destination not in known for gram in trigrams(destination)],
+		ignore_conflicts=True,
+	)
+
+
+def unindex_destination(destination):
+	if not Flight.objects.filter(destination=destination).exists():
+		DestinationTrigram.objects.filter(destination=destination).delete()
+
+
+def rebuild_index(batch_size=5000):
+	DestinationTrigram.objects.all().delete()
+	destinations = Flight.objects.order_by('destination').values_list('destination', flat=True).distinct()
+	batch = []
+	for destination in destinations.iterator():
+		batch.extend(DestinationTrigram(destination=destination, trigram=gram) for gram in trigrams(destination))
+		if len(batch) >= batch_size:
+			DestinationTrigram.objects.bulk_create(batch, ignore_conflicts=True)
+			batch = []
+	DestinationTrigram.objects.bulk_create(batch, ignore_conflicts=True)
+
+
+# Past this many destinations a list goes to SQLite as one JSON parameter,
+# clear of its limit on parameters per query.
+MAX_LISTED_DESTINATIONS = 400
+
+
+def containing_destinations(words):
+	# The destinations containing every one of `words` (SearchFilter's
+	# icontains), found through the trigram index rather than by scanning
+	# every name. Each run of word characters in a word lies inside a word
+	# of the destination, so it has all the inner trigrams of a run of
+	# three or more, and a run of two starts one of its trigrams (words are
+	# padded with a space at the end). A single character can end a word
+	# and so narrows nothing; terms with nothing longer match no
+	# destinations here. Candidates are checked for the whole words after.
+	words = [word.lower() for word in words]
+	runs = {run for word in words for run in WORD_RE.findall(word) if len(run) >= 2}
+	if not runs:
+		return set()
+	inner = {run[i:i + 3] for run in runs if len(run) >= 3 for i in range(len(run) - 2)}
+	candidates = None
+	if inner:
+		candidates = set(
+			DestinationTrigram.objects
+			.filter(trigram__in=inner)
+			.values('destination')
+			.annotate(count=Count('id'))
+			.filter(count=len(inner))
+			.values_list('destination', flat=True)
+		)
+	for run in sorted(run for run in runs if len(run) == 2):
+		if candidates is not None and not candidates:
+			break
+		starting = DestinationTrigram.objects.filter(trigram__gte=run, trigram__lt=run[0] + chr(ord(run[1]) + 1))
+		starting = set(starting.values_list('destination', flat=True).distinct())
+		candidates = starting if candidates is None else candidates & starting
+	return {destination for destination in candidates if all(word in destination.lower() for word in words)}
+
+
+def match_destinations(term, min_similarity=0.5):
+	# Every destination that contains each word of `term` (what SearchFilter's
+	# icontains matched) or shares enough trigrams with it to pass as a
+	# prefix, token or typo, as (destination, score) pairs, best first. The
+	# score counts the term's trigrams a destination has; destinations
+	# containing the term score one more than any such count, so they come
+	# first and keep the list's own order among themselves. Both lookups
+	# read the trigram table's indexes, not the flights.
+	words = term.split()
+	if not words:
+		return []
+	grams = trigrams(term, prefix=True)
+	scores = {}
+	if grams:
+		# Short queries must match every trigram, longer ones tolerate typos.
+		required = max(math.ceil(len(grams) * min_similarity), min(len(grams), 2))
+		scores.update(
+			DestinationTrigram.objects
+			.filter(trigram__in=grams)
+			.values('destination')
+			.annotate(score=Count('id'))
+			.filter(score__gte=required)
+			.values_list('destination', 'score')
+		)
+	scores.update((destination, len(grams) + 1) for destination in containing_destinations(words))
+	return sorted(scores.items(), key=lambda match: (-match[1], match[0]))
+
+
+class JSONList(Expression):
+	# A list of strings as one JSON parameter, read back by SQLite's
+	# json_each(); the right-hand side of an __in lookup.
+	def __init__(self, values):
+		super().__init__(output_field=CharField())
+		self.values = values
+
+	def as_sql(self, compiler, connection):
+		return 'SELECT value FROM json_each(%s)', [json.dumps(self.values)]
+
+
+def listed(destinations, using='default', size=None):
+	# `destinations` as the right-hand side of a destination__in lookup.
+	# `size` is the number of destinations listed in the whole query, when
+	# there are other lists.
+	if (size or len(destinations)) <= MAX_LISTED_DESTINATIONS or connections[using].vendor != 'sqlite':
+		return destinations
+	return JSONList(destinations)
+
+
+class DestinationSearchFilter(SearchFilter):
+	# Drop-in replacement for SearchFilter on the flight catalog that looks
+	# destinations up in the trigram index instead of a `LIKE '%term%'` scan
+	# over the flights. It still finds every destination containing the
+	# terms, and typos and word prefixes besides. Results are ranked by
+	# trigram overlap unless an explicit ordering was requested, so this has
+	# to run after OrderingFilter.
+	min_similarity = 0.5
+
+	def filter_queryset(self, request, queryset, view):
+		term = ' '.join(self.get_search_terms(request))
+		if not term:
+			return queryset
+
+		matches = match_destinations(term, self.min_similarity)
+		queryset = queryset.filter(destination__in=listed([destination for destination, score in matches], queryset.db))
+		# When every match scored the same (the usual case for prefixes) the
+		# rank adds nothing, and leaving it out of the ORDER BY lets the
+		# (destination, id) index return rows already sorted.
+		by_score = {}
+		for destination, score in matches:
+			by_score.setdefault(score, []).append(destination)
+		if len(by_score) < 2:
+			return queryset
+		queryset = queryset.annotate(search_rank=Case(
+			*[When(destination__in=listed(destinations, queryset.db, len(matches)), then=Value(score)) for score, destinations in by_score.items()],
+			default=Value(0),
+			output_field=IntegerField(),
+		))
+		if api_settings.ORDERING_PARAM not in request.query_params:
+			queryset = queryset.order_by('-search_rank', *queryset.query.order_by)
+		return queryset
@@ -1,16 +1,26 @@
 from rest_framework import serializers
+from rest_framework.reverse import reverse
 from django.contrib.auth.models import User
 from datetime import date
-from .models import Flight, Booking, Profile
+from .models import Flight, Booking, Profile, TierThreshold
+from . import hashing
+from .instrumentation import timed
 
 
-class FlightSerializer(serializers.ModelSerializer):
+class ModelSerializer(serializers.ModelSerializer):
+	# Counted as serializer time by flights.instrumentation.
+	@timed('serialize')
+	def to_representation(self, instance):
+		return super().to_representation(instance)
+
+
+class FlightSerializer(ModelSerializer):
 	class Meta:
 		model = Flight
 		fields = ['destination', 'time', 'price', 'id']
 
 
-class BookingSerializer(serializers.ModelSerializer):
+class BookingSerializer(ModelSerializer):
 	flight=serializers.SlugRelatedField(slug_field='destination', read_only=True)
 	class Meta:
 		model = Booking
@@ -20,29 +30,35 @@ class BookingSerializer(serializers.ModelSerializer):
 
 
 
-class BookingDetailsSerializer(serializers.ModelSerializer):
+class BookingDetailsSerializer(ModelSerializer):
 	flight=FlightSerializer()
-	totalprice= serializers.SerializerMethodField()
+	# Annotated by BookingQuerySet.with_totalprice().
+	totalprice= serializers.DecimalField(max_digits=None, decimal_places=3, coerce_to_string=False, read_only=True)
 	class Meta:
 		model = Booking
 		fields = ['totalprice','flight', 'date', 'passengers', 'id']
-	def get_totalprice(self, obj):
-		return obj.passengers * obj.flight.price
 
 
-class AdminUpdateBookingSerializer(serializers.ModelSerializer):
+class AdminUpdateBookingSerializer(ModelSerializer):
 	class Meta:
 		model = Booking
 		fields = ['date', 'passengers']
 
 
-class UpdateBookingSerializer(serializers.ModelSerializer):
+class BulkBookingSerializer(ModelSerializer):
+	flight_id = serializers.IntegerField()
+	class Meta:
+		model = Booking
+		fields = ['flight_id', 'date', 'passengers']
+
+
+class UpdateBookingSerializer(ModelSerializer):
 	class Meta:
 		model = Booking
 		fields = ['passengers']
 
 
-class RegisterSerializer(serializers.ModelSerializer):
+class RegisterSerializer(ModelSerializer):
 	password = serializers.CharField(write_only=True)
 	class Meta:
 		model = User
@@ -54,38 +70,63 @@ class RegisterSerializer(serializers.ModelSerializer):
 		first_name = validated_data['first_name']
 		last_name = validated_data['last_name']
 		new_user = User(username=username, first_name=first_name, last_name=last_name)
-		new_user.set_password(password)
+		new_user.password = hashing.make_password(password)
 		new_user.save()
 		return validated_data
 
-class UserSerializer(serializers.ModelSerializer):
+class UserSerializer(ModelSerializer):
 	class Meta:
 		model=User
 		fields= ['first_name', 'last_name',]
 
-class ProfileSerializer(serializers.ModelSerializer):
+class ProfileSerializer(ModelSerializer):
 	user= UserSerializer()
 	past_bookings=serializers.SerializerMethodField()
-	tier = serializers.SerializerMethodField()
+	past_bookings_url = serializers.SerializerMethodField()
+	recent_past_bookings = 5
 	class Meta:
 		model = Profile
-		fields = ['user', 'miles', 'past_bookings', 'tier']
+		fields = ['user', 'miles', 'past_bookings', 'past_bookings_count', 'past_bookings_url', 'tier']
 
 	def get_past_bookings(self, obj):
 		user_obj= obj.user
-		# booking_list= user.bookings.all()
-		# booking_list = Booking.objects.filter(user=obj.user, date__lt=date.today())
-		booking_list= user_obj.bookings.filter(date__lt=date.today())
+		booking_list= list(user_obj.bookings.filter(date__lt=date.today()).select_related('flight').order_by('-date', '-id')[:self.recent_past_bookings])
+		# Bookings only reach the archive once their miles are credited, so
+		# the bookings table can still hold older ones: both are needed.
+		booking_list+= user_obj.archived_bookings.select_related('flight').order_by('-date', '-id')[:self.recent_past_bookings]
+		booking_list.sort(key=lambda booking: (booking.date, booking.id), reverse=True)
+		booking_list= booking_list[:self.recent_past_bookings]
 		return BookingSerializer(booking_list, many=True).data
 
-	def get_tier(self, obj):
-		miles = obj.miles
-		if miles >= 100000:
-			return "Platinum"
-		elif miles >= 60000:
-			return "Gold"
-		elif miles >= 10000:
-			return "Silver"
-		else: 
-			return "Blue"
-	
\ No newline at end of file
+	def get_past_bookings_url(self, obj):
+		return reverse('past-bookings', request=self.context.get('request'))
+
+
+class TierSerializer(ModelSerializer):
+	members = serializers.IntegerField(read_only=True)
+	class Meta:
+		model = TierThreshold
+		fields = ['name', 'min_miles', 'members']
+
+
+class TierMemberSerializer(ModelSerializer):
+	username = serializers.CharField(source='user.username', read_only=True)
+	class Meta:
+		model = Profile
+		fields = ['id', 'username', 'miles', 'tier']
+
+
+class FlightExportSerializer(ModelSerializer):
+	class Meta:
+		model = Flight
+		fields = ['id', 'destination', 'time', 'price', 'miles', 'capacity']
+
+
+class BookingExportSerializer(ModelSerializer):
+	# Annotated by BookingExport.get_queryset().
+	destination = serializers.CharField(read_only=True)
+	price = serializers.DecimalField(source='flight.price', max_digits=10, decimal_places=3, read_only=True)
+	totalprice = serializers.DecimalField(max_digits=None, decimal_places=3, read_only=True)
+	class Meta:
+		model = Booking
+		fields = ['id', 'user', 'flight', 'destination', 'date', 'passengers', 'price', 'totalprice']
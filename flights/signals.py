@@ -0,0 +1,104 @@
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.db.backends.signals import connection_created
+from django.db.models.signals import post_save, post_delete
+from django.dispatch import receiver
+from rest_framework_simplejwt.settings import api_settings as jwt_settings
+
+from .models import Flight, Booking, Profile, SeatInventory
+from . import search
+from .cache import bump_catalog_version
+from .authentication import user_cache, user_cache_key
+
+
+@receiver(post_save, sender=Flight)
+def index_flight(sender, instance, update_fields=None, **kwargs):
+	if update_fields is not None and 'destination' not in update_fields:
+		return
+	loaded = getattr(instance, '_loaded_destination', None)
+	if loaded == instance.destination:
+		return
+	search.index_destination(instance.destination)
+	if loaded is not None:
+		search.unindex_destination(loaded)
+	instance._loaded_destination = instance.destination
+
+
+@receiver(post_save, sender=Flight)
+def resize_inventory(sender, instance, update_fields=None, **kwargs):
+	if update_fields is not None and 'capacity' not in update_fields:
+		return
+	loaded = getattr(instance, '_loaded_capacity', None)
+	if loaded is not None:
+		SeatInventory.resize([instance.id], instance.capacity - loaded)
+	instance._loaded_capacity = instance.capacity
+
+
+@receiver(post_delete, sender=Flight)
+def unindex_flight(sender, instance, **kwargs):
+	search.unindex_destination(instance.destination)
+
+
+@receiver(post_save, sender=Booking)
+def count_past_booking(sender, instance, created, **kwargs):
+	loaded = (getattr(instance, '_loaded_user_id', None), getattr(instance, '_loaded_date', None))
+	current = (instance.user_id, instance.date)
+	if loaded == current:
+		return
+	if not created and loaded[0] is not None:
+		Profile.adjust_past_bookings_count(loaded[0], loaded[1], -1)
+	Profile.adjust_past_bookings_count(instance.user_id, instance.date, 1)
+	instance._loaded_user_id, instance._loaded_date = current
+
+
+@receiver(post_delete, sender=Booking)
+def uncount_past_booking(sender, instance, **kwargs):
+	Profile.adjust_past_bookings_count(instance.user_id, instance.date, -1)
+
+
+# The API views reserve seats themselves, checking what is left, and mark
+# the bookings they save as counted. These keep the inventory in step with
+# every other change: the admin, cascading deletes, the shell.
+@receiver(post_save, sender=Booking)
+def count_seats(sender, instance, created, **kwargs):
+	counted = getattr(instance, '_counted_seats', None)
+	current = instance.seats()
+	if counted == current or (counted is None and not created):
+		return
+	if counted is not None:
+		SeatInventory.release(*counted)
+	SeatInventory.take(*current)
+	instance._counted_seats = current
+
+
+@receiver(post_delete, sender=Booking)
+def uncount_seats(sender, instance, **kwargs):
+	SeatInventory.release(*(getattr(instance, '_counted_seats', None) or instance.seats()))
+
+
+@receiver(post_save, sender=Flight)
+@receiver(post_delete, sender=Flight)
+def invalidate_catalog(sender, **kwargs):
+	bump_catalog_version()
+
+
+@receiver(post_save, sender=User)
+@receiver(post_delete, sender=User)
+def forget_authenticated_user(sender, instance, **kwargs):
+	user_cache().delete(user_cache_key(getattr(instance, jwt_settings.USER_ID_FIELD)))
+
+
+# Pragmas that only matter to connections that write.
+WRITER_PRAGMAS = {'journal_mode', 'synchronous'}
+
+
+@receiver(connection_created)
+def configure_sqlite(sender, connection, **kwargs):
+	# Applies SQLITE_PRAGMAS (see task_1/settings_production.py) to every new
+	# SQLite connection, in order; read replicas only get the read-side ones.
+	if connection.vendor != 'sqlite':
+		return
+	for name, value in getattr(settings, 'SQLITE_PRAGMAS', {}).items():
+		if name in WRITER_PRAGMAS and connection.alias in settings.DATABASE_REPLICAS:
+			continue
+		connection.connection.execute('PRAGMA %s = %s' % (name, value))
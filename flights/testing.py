@@ -0,0 +1,71 @@
+import re
+from contextlib import ContextDecorator
+
+from django.db import connections
+from django.test.utils import CaptureQueriesContext
+
+
+class max_queries(ContextDecorator):
+	# Like TestCase.assertNumQueries, but as an upper bound and usable as a
+	# decorator: fails when the wrapped block runs more than `budget` queries.
+	def __init__(self, budget, using='default'):
+		self.budget = budget
+		self.using = using
+
+	def __enter__(self):
+		self.captured = CaptureQueriesContext(connections[self.using])
+		return self.captured.__enter__()
+
+	def __exit__(self, exc_type, exc_value, traceback):
+		self.captured.__exit__(exc_type, exc_value, traceback)
+		if exc_type is None and len(self.captured) > self.budget:
+			raise AssertionError('%d queries executed, the budget is %d:\n%s' % (
+				len(self.captured),
+				self.budget,
+				'\n'.join('%d. %s' % (index, query['sql']) for index, query in enumerate(self.captured.captured_queries, 1)),
+			))
+
+
+FULL_SCAN_RE = re.compile(r'^SCAN (?:TABLE )?(\w+)(?: AS \w+)?$')
+
+
+def query_plan(sql, using='default'):
+	with connections[using].cursor() as cursor:
+		cursor.execute('EXPLAIN QUERY PLAN ' + sql)
+		return [row[-1] for row in cursor.fetchall()]
+
+
+class indexed_queries(ContextDecorator):
+	# Fails when a query run in the wrapped block reads a whole table or sorts
+	# its rows in a temporary B-tree, going by SQLite's EXPLAIN QUERY PLAN.
+	# Scanning a table in index order (SCAN ... USING INDEX) is fine. Tables
+	# small enough to scan can be listed in `allow`.
+	statements = ('SELECT', 'UPDATE', 'DELETE')
+
+	def __init__(self, using='default', allow=()):
+		self.using = using
+		self.allow = set(allow)
+
+	def __enter__(self):
+		self.captured = CaptureQueriesContext(connections[self.using])
+		return self.captured.__enter__()
+
+	def __exit__(self, exc_type, exc_value, traceback):
+		self.captured.__exit__(exc_type, exc_value, traceback)
+		if exc_type is not None:
+			return
+		problems = []
+		for query in self.captured.captured_queries:
+			if query['sql'].split(None, 1)[0].upper() not in self.statements:
+				continue
+			plan = query_plan(query['sql'], self.using)
+			if any(self.is_problem(line) for line in plan):
+				problems.append('%s\n    %s' % (query['sql'], '\n    '.join(plan)))
+		if problems:
+			raise AssertionError('Queries without a usable index:\n%s' % '\n'.join(problems))
+
+	def is_problem(self, line):
+		if 'USE TEMP B-TREE' in line:
+			return True
+		match = FULL_SCAN_RE.match(line)
+		return match is not None and match.group(1) not in self.allow
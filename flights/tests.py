@@ -1,11 +1,53 @@
-from django.test import TestCase
+from django.conf import settings
+from django.core.cache.backends.filebased import FileBasedCache
+from django.test import TestCase, TransactionTestCase, SimpleTestCase, RequestFactory, override_settings
+from django.contrib.auth.hashers import PBKDF2PasswordHasher
 from django.urls import reverse
+from django.core.management import call_command
+from django.core.management.base import CommandError
+from django.contrib.auth import authenticate
 from django.contrib.auth.models import User
-from rest_framework.test import APITestCase
+from django.db import connection, connections, transaction, NotSupportedError, OperationalError
+from django.db.models import Sum
+from django.test.utils import CaptureQueriesContext
+from rest_framework.test import APITestCase, APIClient, APIRequestFactory, force_authenticate
+from rest_framework.generics import ListAPIView
+from rest_framework.renderers import JSONRenderer
 from rest_framework import status
-from datetime import date, timedelta
-
-from .models import Flight, Booking, Profile
+from django.core.exceptions import ImproperlyConfigured
+from django.utils import timezone
+from django.utils.translation import gettext_lazy
+from datetime import date, datetime, timedelta, time as dtime
+from unittest import mock, skipUnless
+from decimal import Decimal
+from io import StringIO
+import csv
+import json
+import multiprocessing
+import os
+import random
+import sqlite3
+import tempfile
+import threading
+import time
+
+from .models import Flight, Booking, ArchivedBooking, Profile, DestinationTrigram, SeatInventory, MilesLedger, TierThreshold
+from .search import rebuild_index, containing_destinations
+from .testing import max_queries, indexed_queries, query_plan
+from .hashing import HashingPool, HashingBusy, get_pool
+from .routers import PrimaryReplicaRouter, ReplicaPinMiddleware
+from .signals import configure_sqlite
+from .benchmarks import generate_dataset, scratch_database
+from .management.commands.bench_endpoints import Command as BenchEndpoints
+from . import routers
+from .cache import catalog_cache, catalog_version, bump_catalog_version, CATALOG_VERSION_KEY
+from .rows import RowReader, keyset_chunks
+from .renderers import FastJSONRenderer
+from .serializers import BookingDetailsSerializer
+from .views import FlightsList, BookingsList, BulkBookFlights
+from . import metrics
+from . import admin
+from task_1.urls import urlpatterns
 
 
 class FlightListTest(APITestCase):
@@ -22,12 +64,257 @@ class FlightListTest(APITestCase):
 
 	def test_list(self):
 		response = self.client.get(reverse('flights-list'))
-		flights = Flight.objects.all()
-		self.assertEqual(len(response.data), flights.count())
+		flights = Flight.objects.order_by('destination', 'id')
+		self.assertEqual(len(response.data['results']), flights.count())
 		flight = flights[0]
-		self.assertEqual(dict(response.data[0]), {"id" : flight.id, "destination" : flight.destination, "time": str(flight.time), "price": str(flight.price)})
+		self.assertEqual(dict(response.data['results'][0]), {"id" : flight.id, "destination" : flight.destination, "time": str(flight.time), "price": str(flight.price)})
 		flight = flights[1]
-		self.assertEqual(dict(response.data[1]), {"id" : flight.id, "destination" : flight.destination, "time": str(flight.time), "price": str(flight.price)})
+		self.assertEqual(dict(response.data['results'][1]), {"id" : flight.id, "destination" : flight.destination, "time": str(flight.time), "price": str(flight.price)})
+
+
+class FlightFilterTest(APITestCase):
+	def setUp(self):
+		destinations = ['Wakanda', 'La la land', 'Atlantis, North']
+		for index in range(24):
+			Flight.objects.create(destination=destinations[index % 3], time='%02d:30' % index, price=100 + index * 10, miles=500 * index)
+
+	def ids(self, query):
+		response = self.client.get(reverse('flights-list') + '?' + query)
+		self.assertEqual(response.status_code, status.HTTP_200_OK, response.data)
+		return [flight['id'] for flight in response.data['results']]
+
+	def expected(self, ordering=('destination', 'id'), **filters):
+		return list(Flight.objects.filter(**filters).order_by(*ordering).values_list('id', flat=True))
+
+	def test_ranges(self):
+		self.assertEqual(self.ids('time__gte=08:00&time__lte=12:00'), self.expected(time__gte='08:00', time__lte='12:00'))
+		self.assertEqual(self.ids('price__gte=150.5&price__lte=200'), self.expected(price__gte=150.5, price__lte=200))
+		self.assertEqual(self.ids('miles__lte=2000'), self.expected(miles__lte=2000))
+		self.assertEqual(
+			self.ids('time__gte=06:00&price__lte=300&miles__gte=4000&ordering=-price'),
+			self.expected(('-price', '-id'), time__gte='06:00', price__lte=300, miles__gte=4000),
+		)
+
+	def test_destinations(self):
+		self.assertEqual(self.ids('destination=Wakanda'), self.expected(destination='Wakanda'))
+		self.assertEqual(self.ids('destination__in=Wakanda,Atlantis'), self.expected(destination='Wakanda'))
+		self.assertEqual(
+			self.ids('destination__in=Wakanda, La la land&time__lte=12:00&ordering=time'),
+			self.expected(('time', 'id'), destination__in=['Wakanda', 'La la land'], time__lte='12:00'),
+		)
+
+	def test_pages_through_filtered_ordering(self):
+		expected = self.expected(('price', 'id'), time__gte='03:00', price__lte=300)
+		url = reverse('flights-list') + '?time__gte=03:00&price__lte=300&ordering=price&page_size=4'
+		ids = []
+		while url:
+			response = self.client.get(url)
+			ids.extend(flight['id'] for flight in response.data['results'])
+			url = response.data['next']
+		self.assertEqual(ids, expected)
+
+	def test_validation(self):
+		for query, param in [
+			('time__gte=8am', 'time__gte'),
+			('price__lte=cheap', 'price__lte'),
+			('miles__gte=2000&miles__lte=1000', 'miles__gte'),
+			('time__gte=12:00&time__lte=08:00', 'time__gte'),
+			('destination__in=,', 'destination__in'),
+			('destination__in=' + ','.join('City %d' % index for index in range(101)), 'destination__in'),
+		]:
+			response = self.client.get(reverse('flights-list') + '?' + query)
+			self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST, query)
+			self.assertIn(param, response.data)
+
+
+class KeysetPaginationTest(APITestCase):
+	def setUp(self):
+		for index, destination in enumerate(['Wakanda', 'La la land', 'Wakanda', 'Atlantis', 'La la land']):
+			Flight.objects.create(destination=destination, time='10:00', price=100 + index, miles=1000)
+
+	def walk(self, url):
+		ids = []
+		while url:
+			response = self.client.get(url)
+			self.assertEqual(response.status_code, status.HTTP_200_OK)
+			ids.extend(flight['id'] for flight in response.data['results'])
+			url = response.data['next']
+		return ids
+
+	def test_pages_follow_destination_then_id(self):
+		ids = self.walk(reverse('flights-list') + '?page_size=2')
+		self.assertEqual(ids, list(Flight.objects.order_by('destination', 'id').values_list('id', flat=True)))
+
+	def test_previous_link(self):
+		response = self.client.get(reverse('flights-list') + '?page_size=2')
+		self.assertIsNone(response.data['previous'])
+		first_page = response.data['results']
+		response = self.client.get(response.data['next'])
+		response = self.client.get(response.data['previous'])
+		self.assertEqual(response.data['results'], first_page)
+
+	def test_ordering_filter(self):
+		ids = self.walk(reverse('flights-list') + '?page_size=2&ordering=-price')
+		self.assertEqual(ids, list(Flight.objects.order_by('-price').values_list('id', flat=True)))
+
+	def test_search_filter(self):
+		ids = self.walk(reverse('flights-list') + '?page_size=1&search=la')
+		self.assertEqual(ids, list(Flight.objects.filter(destination__icontains='la').order_by('destination', 'id').values_list('id', flat=True)))
+
+	def test_invalid_cursor(self):
+		response = self.client.get(reverse('flights-list') + '?cursor=garbage')
+		self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
+
+
+class DestinationSearchTest(APITestCase):
+	def setUp(self):
+		for destination in ['Wakanda', 'La la land', 'Lalaland', 'Atlantis', 'Wakanda']:
+			Flight.objects.create(destination=destination, time='10:00', price=100, miles=1000)
+
+	def search(self, term):
+		response = self.client.get(reverse('flights-list'), {'search': term})
+		self.assertEqual(response.status_code, status.HTTP_200_OK)
+		return [flight['destination'] for flight in response.data['results']]
+
+	def test_prefix(self):
+		self.assertEqual(self.search('wak'), ['Wakanda', 'Wakanda'])
+
+	def test_token(self):
+		self.assertEqual(self.search('land'), ['La la land', 'Lalaland'])
+
+	def test_typo(self):
+		self.assertEqual(self.search('Wakamda'), ['Wakanda', 'Wakanda'])
+		self.assertEqual(self.search('atlamtis'), ['Atlantis'])
+
+	def test_ranked(self):
+		self.assertEqual(self.search('lalaland'), ['Lalaland', 'La la land'])
+
+	def test_ranked_pages(self):
+		destinations = []
+		url = reverse('flights-list') + '?page_size=1&search=lalaland'
+		while url:
+			response = self.client.get(url)
+			destinations.extend(flight['destination'] for flight in response.data['results'])
+			url = response.data['next']
+		self.assertEqual(destinations, ['Lalaland', 'La la land'])
+
+	def test_substring(self):
+		self.assertEqual(self.search('anti'), ['Atlantis'])
+		self.assertEqual(self.search('a la'), ['Atlantis', 'La la land', 'Lalaland'])
+
+	@skipUnless(connection.vendor == 'sqlite', 'EXPLAIN QUERY PLAN is SQLite syntax.')
+	def test_substring_reads_the_index(self):
+		# Not even a scan in index order, as LIKE '%...%' would need.
+		with CaptureQueriesContext(connection) as queries:
+			self.assertEqual(containing_destinations(['anti']), {'Atlantis'})
+			self.assertEqual(containing_destinations(['a', 'la']), {'Atlantis', 'La la land', 'Lalaland'})
+		for query in queries.captured_queries:
+			self.assertEqual([line for line in query_plan(query['sql']) if line.startswith('SCAN')], [], query['sql'])
+
+	def test_every_match_returned(self):
+		for index in range(30):
+			Flight.objects.create(destination='Sa%s' % chr(ord('a') + index % 26) * (index // 26 + 1), time='10:00', price=100, miles=1000)
+		expected = list(Flight.objects.filter(destination__istartswith='sa').order_by('destination', 'id').values_list('destination', flat=True))
+		self.assertEqual(len(expected), 30)
+		response = self.client.get(reverse('flights-list'), {'search': 'sa', 'page_size': 1000})
+		self.assertEqual([flight['destination'] for flight in response.data['results']], expected)
+		with mock.patch('flights.search.MAX_LISTED_DESTINATIONS', 1):
+			catalog_cache().clear()
+			self.assertEqual(self.search('sa'), expected)
+			catalog_cache().clear()
+			self.assertEqual(self.search('lalaland'), ['Lalaland', 'La la land'])
+
+	def test_no_match(self):
+		self.assertEqual(self.search('zzz'), [])
+
+	def test_index_follows_saves_and_deletes(self):
+		flight = Flight.objects.get(destination='Atlantis')
+		flight.destination = 'Narnia'
+		flight.save()
+		self.assertEqual(self.search('narn'), ['Narnia'])
+		self.assertEqual(self.search('atlan'), [])
+		self.assertFalse(DestinationTrigram.objects.filter(destination='Atlantis').exists())
+
+		Flight.objects.filter(destination='Wakanda').first().delete()
+		self.assertEqual(self.search('wakanda'), ['Wakanda'])
+		Flight.objects.filter(destination='Wakanda').delete()
+		self.assertFalse(DestinationTrigram.objects.filter(destination='Wakanda').exists())
+
+	def test_rebuild_index(self):
+		DestinationTrigram.objects.all().delete()
+		rebuild_index()
+		self.assertEqual(self.search('wak'), ['Wakanda', 'Wakanda'])
+
+
+class CatalogCacheTest(APITestCase):
+	def setUp(self):
+		catalog_cache().clear()
+		self.flight = Flight.objects.create(destination='Wakanda', time='10:00', price=230, miles=4000)
+		Flight.objects.create(destination='La la land', time='00:00', price=1010, miles=1010)
+
+	def test_hit_skips_database(self):
+		first = self.client.get(reverse('flights-list'))
+		with max_queries(0):
+			second = self.client.get(reverse('flights-list'))
+		self.assertEqual(first.data, second.data)
+		self.assertEqual(first['ETag'], second['ETag'])
+
+	def test_not_modified(self):
+		etag = self.client.get(reverse('flights-list'))['ETag']
+		with max_queries(0):
+			response = self.client.get(reverse('flights-list'), HTTP_IF_NONE_MATCH=etag)
+		self.assertEqual(response.status_code, status.HTTP_304_NOT_MODIFIED)
+		self.assertEqual(response['ETag'], etag)
+
+	def test_keyed_by_query(self):
+		everything = self.client.get(reverse('flights-list'))
+		searched = self.client.get(reverse('flights-list'), {'search': 'wakanda'})
+		self.assertNotEqual(everything['ETag'], searched['ETag'])
+		self.assertEqual([flight['destination'] for flight in searched.data['results']], ['Wakanda'])
+		self.assertEqual(len(self.client.get(reverse('flights-list')).data['results']), 2)
+
+	def test_flight_changes_invalidate(self):
+		etag = self.client.get(reverse('flights-list'))['ETag']
+		self.flight.price = 250
+		self.flight.save()
+		response = self.client.get(reverse('flights-list'), HTTP_IF_NONE_MATCH=etag)
+		self.assertEqual(response.status_code, status.HTTP_200_OK)
+		self.assertNotEqual(response['ETag'], etag)
+		self.assertIn('250.000', [flight['price'] for flight in response.data['results']])
+
+		self.flight.delete()
+		response = self.client.get(reverse('flights-list'))
+		self.assertEqual(len(response.data['results']), 1)
+
+	def test_version_survives_eviction(self):
+		# Three bumps and an eviction within two milliseconds: a reseeded
+		# version must still be past every version handed out before. The
+		# flights made in setUp already seeded one from the real clock.
+		catalog_cache().clear()
+		versions = []
+		with mock.patch('flights.cache.time.time', return_value=1000.0):
+			versions.append(catalog_version())
+			for bump in range(3):
+				bump_catalog_version()
+				versions.append(catalog_version())
+		self.assertEqual(len(set(versions)), 4)
+		catalog_cache().delete(CATALOG_VERSION_KEY)
+		with mock.patch('flights.cache.time.time', return_value=1000.002):
+			self.assertGreater(catalog_version(), max(versions))
+
+	def test_shared_between_workers(self):
+		# As configured by settings_production: a bump made by another
+		# worker, through its own cache instance, retires this one's pages.
+		with tempfile.TemporaryDirectory() as directory:
+			shared = {'BACKEND': 'django.core.cache.backends.filebased.FileBasedCache', 'LOCATION': directory}
+			with override_settings(CACHES=dict(settings.CACHES, catalog=shared)):
+				etag = self.client.get(reverse('flights-list'))['ETag']
+				other_worker = FileBasedCache(directory, {})
+				with mock.patch('flights.cache.catalog_cache', return_value=other_worker):
+					bump_catalog_version()
+				response = self.client.get(reverse('flights-list'), HTTP_IF_NONE_MATCH=etag)
+				self.assertEqual(response.status_code, status.HTTP_200_OK)
+				self.assertNotEqual(response['ETag'], etag)
 
 
 class BookingListTest(APITestCase):
@@ -68,11 +355,11 @@ class BookingListTest(APITestCase):
 		response = self.client.get(reverse('bookings-list'))
 
 		user = User.objects.get(username="laila")
-		bookings = Booking.objects.filter(user=user, date__gt=date.today())
-		self.assertEqual(len(response.data), bookings.count())
+		bookings = Booking.objects.filter(user=user, date__gt=date.today()).order_by('date', 'id')
+		self.assertEqual(len(response.data['results']), bookings.count())
 
 		for index, booking in enumerate(bookings):
-			self.assertEqual(dict(response.data[index]), {"id" : booking.id, "flight" : booking.flight.destination, "date": str(booking.date)})
+			self.assertEqual(dict(response.data['results'][index]), {"id" : booking.id, "flight" : booking.flight.destination, "date": str(booking.date)})
 
 
 
@@ -278,6 +565,58 @@ class BookingDelete(APITestCase):
 		self.assertEqual(Booking.objects.filter(id=3).count(), 0)
 
 
+class BookingLookupTest(APITestCase):
+	def setUp(self):
+		self.user = User.objects.create(username='laila')
+		self.other = User.objects.create(username='laila2')
+		self.admin = User.objects.create(username='admin', is_staff=True)
+		flight = Flight.objects.create(destination='Wakanda', time='10:00', price=230, miles=4000)
+		self.own = Booking.objects.create(flight=flight, date=date.today()+timedelta(days=10), user=self.user, passengers=2)
+		self.near = Booking.objects.create(flight=flight, date=date.today()+timedelta(days=2), user=self.user, passengers=2)
+		self.others = Booking.objects.create(flight=flight, date=date.today()+timedelta(days=10), user=self.other, passengers=2)
+
+	def request(self, user, method, name, booking_id, count, data=None):
+		self.client.force_authenticate(user)
+		with self.assertNumQueries(count):
+			return getattr(self.client, method)(reverse(name, args=[booking_id]), data)
+
+	def test_own_booking_is_one_query(self):
+		response = self.request(self.user, 'get', 'booking-details', self.own.id, 1)
+		self.assertEqual(response.status_code, status.HTTP_200_OK)
+		self.assertEqual(response.data['id'], self.own.id)
+
+	def test_other_users_booking_is_forbidden(self):
+		response = self.request(self.user, 'get', 'booking-details', self.others.id, 2)
+		self.assertEqual(response.status_code, status.HTTP_403_FORBIDDEN)
+		self.assertEqual(response.data['detail'], "You must be the owner of this booking")
+		response = self.request(self.user, 'delete', 'cancel-booking', self.others.id, 2)
+		self.assertEqual(response.status_code, status.HTTP_403_FORBIDDEN)
+		self.assertEqual(response.data['detail'], "You must be the owner of this booking")
+
+	def test_missing_booking_is_not_found(self):
+		response = self.request(self.user, 'get', 'booking-details', 999, 2)
+		self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
+		response = self.request(self.admin, 'put', 'update-booking', 999, 2, {"passengers": 3})
+		self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
+
+	def test_near_booking_cannot_change(self):
+		response = self.request(self.user, 'put', 'update-booking', self.near.id, 2, {"passengers": 3})
+		self.assertEqual(response.status_code, status.HTTP_403_FORBIDDEN)
+		self.assertEqual(response.data['detail'], "Booking cannot be cancelled or modified")
+		response = self.request(self.admin, 'delete', 'cancel-booking', self.near.id, 2)
+		self.assertEqual(response.status_code, status.HTTP_403_FORBIDDEN)
+		self.assertEqual(response.data['detail'], "Booking cannot be cancelled or modified")
+		self.assertTrue(Booking.objects.filter(id=self.near.id).exists())
+
+	def test_staff_sees_every_booking(self):
+		response = self.request(self.admin, 'get', 'booking-details', self.others.id, 1)
+		self.assertEqual(response.status_code, status.HTTP_200_OK)
+		self.client.force_authenticate(self.admin)
+		response = self.client.delete(reverse('cancel-booking', args=[self.others.id]))
+		self.assertEqual(response.status_code, status.HTTP_204_NO_CONTENT)
+		self.assertFalse(Booking.objects.filter(id=self.others.id).exists())
+
+
 class Login(APITestCase):
 	def setUp(self):
 		flight1 = {'destination': 'Wakanda', 'time': '10:00', 'price': 230, 'miles': 4000}
@@ -447,3 +786,1435 @@ class ProfileDetails(APITestCase):
 
 
 
+
+
+class BookingTotalPriceTest(APITestCase):
+	def setUp(self):
+		self.user_data = {"username" : "laila", "password" : "1234567890-="}
+		self.user = User(username=self.user_data["username"])
+		self.user.set_password(self.user_data["password"])
+		self.user.save()
+
+		cheap = Flight.objects.create(destination='Wakanda', time='10:00', price='0.100', miles=4000)
+		pricey = Flight.objects.create(destination='La la land', time='00:00', price='1010.125', miles=1010)
+		self.bookings = [
+			Booking.objects.create(flight=cheap, date=date.today()+timedelta(days=5), user=self.user, passengers=3),
+			Booking.objects.create(flight=pricey, date=date.today()+timedelta(days=6), user=self.user, passengers=1),
+			Booking.objects.create(flight=pricey, date=date.today()+timedelta(days=7), user=self.user, passengers=4),
+		]
+
+		response = self.client.post(reverse('login'), self.user_data)
+		self.client.credentials(HTTP_AUTHORIZATION='Bearer ' + response.data['access'])
+
+	def test_annotation_matches_decimal_arithmetic(self):
+		for booking in Booking.objects.with_totalprice():
+			self.assertEqual(booking.totalprice, booking.passengers * booking.flight.price)
+
+	def test_details_totalprice(self):
+		booking = self.bookings[0]
+		response = self.client.get(reverse('booking-details', args=[booking.id]))
+		self.assertEqual(response.data['totalprice'], Decimal('0.300'))
+		self.assertEqual(str(response.data['totalprice']), '0.300')
+
+	def test_ordering(self):
+		response = self.client.get(reverse('bookings-list'), {'ordering': '-totalprice'})
+		self.assertEqual([booking['id'] for booking in response.data['results']], [self.bookings[2].id, self.bookings[1].id, self.bookings[0].id])
+
+	def test_ordering_pages(self):
+		ids = []
+		url = reverse('bookings-list') + '?ordering=totalprice&page_size=1'
+		while url:
+			response = self.client.get(url)
+			ids.extend(booking['id'] for booking in response.data['results'])
+			url = response.data['next']
+		self.assertEqual(ids, [booking.id for booking in self.bookings])
+
+	def test_filter(self):
+		response = self.client.get(reverse('bookings-list'), {'totalprice__gte': '1010.125', 'totalprice__lte': '2000'})
+		self.assertEqual([booking['id'] for booking in response.data['results']], [self.bookings[1].id])
+
+	def test_invalid_filter(self):
+		response = self.client.get(reverse('bookings-list'), {'totalprice__gte': 'lots'})
+		self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+	def test_total_revenue(self):
+		self.assertEqual(Booking.objects.total_revenue(), Decimal('0.300') + Decimal('1010.125') * 5)
+
+
+class PastBookingsTest(APITestCase):
+	def setUp(self):
+		self.user_data = {"username" : "laila", "password" : "1234567890-="}
+		self.user = User(username=self.user_data["username"])
+		self.user.set_password(self.user_data["password"])
+		self.user.save()
+		self.profile = Profile.objects.create(user=self.user)
+
+		self.flight = Flight.objects.create(destination='Wakanda', time='10:00', price=230, miles=4000)
+		for days in range(1, 9):
+			Booking.objects.create(flight=self.flight, date=date.today()-timedelta(days=days), user=self.user, passengers=2)
+		Booking.objects.create(flight=self.flight, date=date.today()+timedelta(days=5), user=self.user, passengers=2)
+
+		response = self.client.post(reverse('login'), self.user_data)
+		self.client.credentials(HTTP_AUTHORIZATION='Bearer ' + response.data['access'])
+
+	def past_count(self):
+		return self.client.get(reverse("profile-details")).data['past_bookings_count']
+
+	def test_profile_embeds_recent_slice(self):
+		response = self.client.get(reverse("profile-details"))
+		recent = Booking.objects.filter(user=self.user, date__lt=date.today()).order_by('-date', '-id')[:5]
+		self.assertEqual([booking['id'] for booking in response.data['past_bookings']], [booking.id for booking in recent])
+		self.assertEqual(response.data['past_bookings_count'], 8)
+		self.assertTrue(response.data['past_bookings_url'].endswith(reverse('past-bookings')))
+
+	def test_sub_resource_pages_through_all_past_bookings(self):
+		ids = []
+		url = reverse('past-bookings') + '?page_size=3'
+		while url:
+			response = self.client.get(url)
+			ids.extend(booking['id'] for booking in response.data['results'])
+			url = response.data['next']
+		past = Booking.objects.filter(user=self.user, date__lt=date.today()).order_by('-date', '-id')
+		self.assertEqual(ids, [booking.id for booking in past])
+
+	def test_count_follows_booking_changes(self):
+		self.assertEqual(self.past_count(), 8)
+		booking = Booking.objects.create(flight=self.flight, date=date.today()-timedelta(days=30), user=self.user, passengers=1)
+		self.assertEqual(self.past_count(), 9)
+		booking.date = date.today()+timedelta(days=30)
+		booking.save()
+		self.assertEqual(self.past_count(), 8)
+		Booking.objects.filter(user=self.user, date__lt=date.today()).first().delete()
+		self.assertEqual(self.past_count(), 7)
+
+	def test_count_catches_up_with_time(self):
+		self.assertEqual(self.past_count(), 8)
+		Profile.objects.filter(pk=self.profile.pk).update(past_bookings_counted_until=date.today()-timedelta(days=3))
+		Profile.objects.filter(pk=self.profile.pk).update(past_bookings_count=5)
+		self.assertEqual(self.past_count(), 8)
+		self.profile.refresh_from_db()
+		self.assertEqual(self.profile.past_bookings_counted_until, date.today())
+
+
+
+class LaggingReplicaTest(TransactionTestCase):
+	def setUp(self):
+		self.user = User.objects.create_user(username='laila', password='1234567890-=')
+		Profile.objects.create(user=self.user)
+		self.flight = Flight.objects.create(destination='Wakanda', time='10:00', price=230, miles=4000)
+		for days in range(1, 9):
+			Booking.objects.create(flight=self.flight, date=date.today()-timedelta(days=days), user=self.user, passengers=2)
+		self.client = APIClient()
+		self.client.force_authenticate(self.user)
+		routers.reset()
+		self.addCleanup(routers.reset)
+
+	def snapshot_replica(self):
+		directory = tempfile.TemporaryDirectory()
+		self.addCleanup(directory.cleanup)
+		path = os.path.join(directory.name, 'replica.sqlite3')
+		connection.ensure_connection()
+		target = sqlite3.connect(path)
+		connection.connection.backup(target)
+		target.close()
+		connections.databases['replica'] = {'ENGINE': 'django.db.backends.sqlite3', 'NAME': path}
+		self.addCleanup(connections.databases.pop, 'replica')
+		self.addCleanup(lambda: connections['replica'].close())
+
+	@override_settings(DATABASE_REPLICAS=['replica'])
+	def test_past_bookings_counted_on_primary(self):
+		self.snapshot_replica()
+		for days in range(10, 12):
+			Booking.objects.create(flight=self.flight, date=date.today()-timedelta(days=days), user=self.user, passengers=2)
+		self.assertEqual(Booking.objects.using('replica').count(), 8)
+		self.assertEqual(self.client.get(reverse('profile-details')).data['past_bookings_count'], 10)
+		self.assertEqual(Profile.objects.using('default').get(user=self.user).past_bookings_count, 10)
+
+class BulkBookingTest(APITestCase):
+	def setUp(self):
+		self.user_data = {"username" : "laila", "password" : "1234567890-="}
+		self.user = User(username=self.user_data["username"])
+		self.user.set_password(self.user_data["password"])
+		self.user.save()
+		self.flight1 = Flight.objects.create(destination='Wakanda', time='10:00', price=230, miles=4000)
+		self.flight2 = Flight.objects.create(destination='La la land', time='00:00', price=1010, miles=1010)
+		response = self.client.post(reverse('login'), self.user_data)
+		self.client.credentials(HTTP_AUTHORIZATION='Bearer ' + response.data['access'])
+
+	def post(self, data):
+		return self.client.post(reverse('bulk-book-flights'), data, format='json')
+
+	def test_all_created(self):
+		data = [{"flight_id": self.flight1.id, "date": "2030-05-05", "passengers": 2}, {"flight_id": self.flight2.id, "date": "2030-06-06", "passengers": 1}]
+		response = self.post(data)
+		self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+		self.assertEqual(response.data['created'], 2)
+		for item, result in zip(data, response.data['results']):
+			booking = Booking.objects.get(id=result['id'])
+			self.assertEqual((booking.user, booking.flight_id, str(booking.date), booking.passengers), (self.user, item['flight_id'], item['date'], item['passengers']))
+
+	def test_partial_failure(self):
+		data = [
+			{"flight_id": self.flight1.id, "date": "2030-05-05", "passengers": 2},
+			{"flight_id": 999, "date": "2030-05-05", "passengers": 2},
+			{"flight_id": self.flight2.id, "date": "not a date", "passengers": 2},
+			{"flight_id": self.flight2.id, "date": "2030-05-05", "passengers": 3},
+		]
+		response = self.post(data)
+		self.assertEqual(response.status_code, status.HTTP_207_MULTI_STATUS)
+		self.assertEqual((response.data['created'], response.data['failed']), (2, 2))
+		self.assertEqual([result['status'] for result in response.data['results']], ['created', 'failed', 'failed', 'created'])
+		self.assertIn('flight_id', response.data['results'][1]['errors'])
+		self.assertIn('date', response.data['results'][2]['errors'])
+		self.assertEqual(sorted(Booking.objects.values_list('passengers', flat=True)), [2, 3])
+
+	def test_all_failed(self):
+		response = self.post([{"flight_id": 999, "date": "2030-05-05", "passengers": 2}])
+		self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+		self.assertEqual(Booking.objects.count(), 0)
+
+	def test_not_a_list(self):
+		response = self.post({"flight_id": self.flight1.id, "date": "2030-05-05", "passengers": 2})
+		self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+	def test_past_bookings_counted(self):
+		profile = Profile.objects.create(user=self.user)
+		profile.refresh_past_bookings_count()
+		with mock.patch.object(BulkBookFlights, 'count_batch_size', 3):
+			self.post([{"flight_id": self.flight1.id, "date": "2019-05-05", "passengers": 2}] * 3 + [{"flight_id": self.flight2.id, "date": "2019-06-06", "passengers": 1}])
+		profile.refresh_from_db()
+		self.assertEqual(profile.past_bookings_count, 4)
+
+	def test_ids_need_sqlite_or_returned_ids(self):
+		with mock.patch.object(connection, 'vendor', 'mysql'):
+			with self.assertRaises(NotSupportedError):
+				self.post([{"flight_id": self.flight1.id, "date": "2030-05-05", "passengers": 2}])
+		self.assertEqual(Booking.objects.count(), 0)
+
+	def test_url_unauthorized(self):
+		self.client.credentials()
+		response = self.post([])
+		self.assertEqual(response.status_code, status.HTTP_401_UNAUTHORIZED)
+
+
+@skipUnless(connection.vendor == 'sqlite', 'SQLite locking')
+class ConcurrentBulkBookingTest(TransactionTestCase):
+	# Two bulk bookings at once, each thread with its own connection to a
+	# database file: the in-memory test database uses shared-cache locks,
+	# which never wait.
+	rounds = 10
+
+	def setUp(self):
+		# Sets the in-memory test database aside rather than closing it.
+		self.addCleanup(setattr, connection, 'connection', connection.connection)
+		connection.connection = None
+		database = scratch_database()
+		database.__enter__()
+		self.addCleanup(database.__exit__, None, None, None)
+		settings_override = override_settings(SQLITE_PRAGMAS={'journal_mode': 'WAL', 'busy_timeout': 5000})
+		settings_override.enable()
+		self.addCleanup(settings_override.disable)
+		connection.close()
+		self.users = [User.objects.create(username='user%d' % index) for index in range(2)]
+		self.flights = [Flight.objects.create(destination='Wakanda', time='%02d:00' % index, price=230, miles=4000) for index in range(3)]
+
+	def book(self, user, barrier, statuses):
+		client = APIClient()
+		client.force_authenticate(user)
+		try:
+			for day in range(1, self.rounds + 1):
+				data = [{"flight_id": flight.id, "date": "2030-05-%02d" % day, "passengers": 1} for flight in self.flights]
+				barrier.wait(5)
+				statuses.append(client.post(reverse('bulk-book-flights'), data, format='json').status_code)
+		finally:
+			connection.close()
+
+	def test_both_go_through(self):
+		barrier, statuses = threading.Barrier(2), []
+		workers = [threading.Thread(target=self.book, args=(user, barrier, statuses)) for user in self.users]
+		for thread in workers:
+			thread.start()
+		for thread in workers:
+			thread.join()
+		self.assertEqual(statuses, [status.HTTP_201_CREATED] * 2 * self.rounds)
+		self.assertEqual(Booking.objects.count(), 2 * 3 * self.rounds)
+		self.assertEqual(set(SeatInventory.objects.values_list('seats_left', flat=True)), {198})
+
+
+class SeatInventoryTest(APITestCase):
+	def setUp(self):
+		self.user_data = {"username" : "laila", "password" : "1234567890-="}
+		self.user = User(username=self.user_data["username"])
+		self.user.set_password(self.user_data["password"])
+		self.user.save()
+		self.flight = Flight.objects.create(destination='Wakanda', time='10:00', price=230, miles=4000, capacity=10)
+		response = self.client.post(reverse('login'), self.user_data)
+		self.client.credentials(HTTP_AUTHORIZATION='Bearer ' + response.data['access'])
+
+	def book(self, passengers, booking_date='2030-05-05'):
+		return self.client.post(reverse('book-flight', args=[self.flight.id]), {"date": booking_date, "passengers": passengers})
+
+	def seats_left(self, booking_date='2030-05-05'):
+		return SeatInventory.objects.get(flight=self.flight, date=booking_date).seats_left
+
+	def test_book_reserves_seats(self):
+		self.assertEqual(self.book(4).status_code, status.HTTP_201_CREATED)
+		self.assertEqual(self.seats_left(), 6)
+
+	def test_overbooking_rejected(self):
+		self.book(8)
+		response = self.book(3)
+		self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+		self.assertIn('passengers', response.data)
+		self.assertEqual(Booking.objects.count(), 1)
+		self.assertEqual(self.seats_left(), 2)
+
+	def test_existing_bookings_counted(self):
+		Booking.objects.create(flight=self.flight, date='2030-05-05', user=self.user, passengers=7)
+		self.assertEqual(self.book(4).status_code, status.HTTP_400_BAD_REQUEST)
+		self.assertEqual(self.book(3).status_code, status.HTTP_201_CREATED)
+		self.assertEqual(self.seats_left(), 0)
+
+	def test_unknown_flight(self):
+		response = self.client.post(reverse('book-flight', args=[999]), {"date": "2030-05-05", "passengers": 1})
+		self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
+
+	def test_update_passengers(self):
+		self.book(4)
+		booking_id = Booking.objects.get().id
+		url = reverse('update-booking', args=[booking_id])
+		self.assertEqual(self.client.put(url, {"passengers": 9}).status_code, status.HTTP_200_OK)
+		self.assertEqual(self.seats_left(), 1)
+		self.assertEqual(self.client.put(url, {"passengers": 11}).status_code, status.HTTP_400_BAD_REQUEST)
+		self.assertEqual(Booking.objects.get(id=booking_id).passengers, 9)
+		self.assertEqual(self.client.put(url, {"passengers": 2}).status_code, status.HTTP_200_OK)
+		self.assertEqual(self.seats_left(), 8)
+
+	def test_update_date(self):
+		self.user.is_staff = True
+		self.user.save()
+		self.book(4)
+		booking = Booking.objects.get()
+		response = self.client.put(reverse('update-booking', args=[booking.id]), {"date": "2030-06-06", "passengers": 5})
+		self.assertEqual(response.status_code, status.HTTP_200_OK)
+		self.assertEqual((self.seats_left(), self.seats_left('2030-06-06')), (10, 5))
+
+	def test_cancel_releases_seats(self):
+		self.book(4)
+		response = self.client.delete(reverse('cancel-booking', args=[Booking.objects.get().id]))
+		self.assertEqual(response.status_code, status.HTTP_204_NO_CONTENT)
+		self.assertEqual(self.seats_left(), 10)
+
+	def test_bulk_books_what_fits(self):
+		data = [{"flight_id": self.flight.id, "date": "2030-05-05", "passengers": passengers} for passengers in [4, 5, 3, 1]]
+		response = self.client.post(reverse('bulk-book-flights'), data, format='json')
+		self.assertEqual(response.status_code, status.HTTP_207_MULTI_STATUS)
+		self.assertEqual([result['status'] for result in response.data['results']], ['created', 'created', 'failed', 'created'])
+		self.assertIn('passengers', response.data['results'][2]['errors'])
+		self.assertEqual(sorted(Booking.objects.values_list('passengers', flat=True)), [1, 4, 5])
+		self.assertEqual(self.seats_left(), 0)
+
+	def test_other_changes_followed(self):
+		self.book(4)
+		booking = Booking.objects.get()
+		booking.passengers = 12
+		booking.save()
+		self.assertEqual(self.seats_left(), -2)
+		booking.date = '2030-06-06'
+		booking.save()
+		self.assertEqual(self.seats_left(), 10)
+		booking.delete()
+		self.book(3)
+		self.user.delete()
+		self.assertEqual(self.seats_left(), 10)
+
+	def test_capacity_change(self):
+		self.book(4)
+		self.flight.capacity = 5
+		self.flight.save()
+		self.assertEqual(self.seats_left(), 1)
+		flight = Flight.objects.get()
+		flight.capacity = 3
+		flight.save()
+		self.assertEqual(self.seats_left(), -1)
+		self.assertEqual(self.book(1).status_code, status.HTTP_400_BAD_REQUEST)
+
+
+class SeatInventoryStressTest(TransactionTestCase):
+	# Many threads, each with its own database connection, booking the same
+	# flight and date at once.
+	threads = 8
+	attempts = 25
+
+	def setUp(self):
+		self.user = User.objects.create(username='laila')
+		self.flight = Flight.objects.create(destination='Wakanda', time='10:00', price=230, miles=4000, capacity=100)
+
+	def book(self, passengers):
+		# What BookFlight does. SQLite reports lock contention as an error
+		# instead of waiting, so retry the whole transaction like a client
+		# would.
+		while True:
+			try:
+				return Booking.objects.book(self.user, self.flight.id, '2030-05-05', passengers) is not None
+			except OperationalError:
+				time.sleep(random.random() / 1000)
+
+	def worker(self, booked, errors):
+		rng = random.Random()
+		try:
+			for attempt in range(self.attempts):
+				passengers = rng.randint(1, 3)
+				if self.book(passengers):
+					booked.append(passengers)
+		except Exception as error:
+			errors.append(error)
+		finally:
+			connection.close()
+
+	def test_no_oversell_or_lost_update(self):
+		booked, errors = [], []
+		workers = [threading.Thread(target=self.worker, args=(booked, errors)) for i in range(self.threads)]
+		for thread in workers:
+			thread.start()
+		for thread in workers:
+			thread.join()
+
+		self.assertEqual(errors, [])
+		seats_left = SeatInventory.objects.get(flight=self.flight, date='2030-05-05').seats_left
+		booked_in_db = Booking.objects.filter(flight=self.flight).aggregate(total=Sum('passengers'))['total']
+		# Demand is well over capacity, so the flight must end up (nearly)
+		# full, and every seat sold must be accounted for exactly once.
+		self.assertLess(seats_left, 3)
+		self.assertGreaterEqual(seats_left, 0)
+		self.assertEqual(sum(booked), booked_in_db)
+		self.assertEqual(booked_in_db + seats_left, self.flight.capacity)
+
+
+class MilesAccrualTest(TestCase):
+	def setUp(self):
+		self.user1 = User.objects.create(username='laila')
+		self.user2 = User.objects.create(username='laila2')
+		self.profile1 = Profile.objects.create(user=self.user1)
+		self.profile2 = Profile.objects.create(user=self.user2)
+		self.flight1 = Flight.objects.create(destination='Wakanda', time='10:00', price=230, miles=4000)
+		self.flight2 = Flight.objects.create(destination='La la land', time='00:00', price=1010, miles=1010)
+		past = date.today() - timedelta(days=3)
+		Booking.objects.create(flight=self.flight1, date=past, user=self.user1, passengers=2)
+		Booking.objects.create(flight=self.flight2, date=past, user=self.user1, passengers=1)
+		Booking.objects.create(flight=self.flight2, date=past, user=self.user2, passengers=1)
+		Booking.objects.create(flight=self.flight1, date=date.today(), user=self.user2, passengers=1)
+
+	def accrue(self, *args):
+		call_command('accrue_miles', '--chunk-size', '2', *args, stdout=StringIO())
+
+	def balances(self):
+		return [Profile.objects.get(id=profile.id).miles for profile in (self.profile1, self.profile2)]
+
+	def test_credits_flown_bookings(self):
+		self.accrue()
+		self.assertEqual(self.balances(), [5010, 1010])
+		self.assertEqual(MilesLedger.objects.count(), 3)
+		self.assertFalse(MilesLedger.objects.filter(flown_on=date.today()).exists())
+
+	def test_rerun_credits_nothing_twice(self):
+		self.accrue()
+		self.accrue()
+		self.assertEqual(self.balances(), [5010, 1010])
+		self.accrue('--date', str(date.today() + timedelta(days=1)))
+		self.assertEqual(self.balances(), [5010, 5010])
+		self.assertEqual(MilesLedger.objects.count(), 4)
+
+	def test_credits_outlive_bookings(self):
+		self.accrue()
+		Booking.objects.filter(user=self.user1).delete()
+		self.accrue('--reconcile')
+		self.assertEqual(self.balances(), [5010, 1010])
+
+	def test_reconcile(self):
+		self.accrue()
+		Profile.objects.filter(id=self.profile1.id).update(miles=0)
+		MilesLedger.objects.create(user=self.user2, miles=-10)
+		out = StringIO()
+		call_command('accrue_miles', '--reconcile', stdout=out)
+		self.assertIn('2 profile(s) corrected', out.getvalue())
+		self.assertEqual(self.balances(), [5010, 1000])
+
+	def test_invalid_date(self):
+		with self.assertRaises(CommandError):
+			self.accrue('--date', 'yesterday')
+
+
+class ArchiveTest(APITestCase):
+	def setUp(self):
+		self.user = User.objects.create(username='laila', is_staff=True)
+		self.profile = Profile.objects.create(user=self.user)
+		self.client.force_authenticate(self.user)
+		self.flight = Flight.objects.create(destination='Wakanda', time='10:00', price=230, miles=4000)
+		today = date.today()
+		for days in (400, 400, 200, 10, -5):
+			Booking.objects.create(flight=self.flight, date=today - timedelta(days=days), user=self.user, passengers=1)
+		# No profile, so no past bookings count to be in.
+		Booking.objects.create(flight=self.flight, date=today - timedelta(days=300), user=User.objects.create(username='bee'), passengers=1)
+		call_command('accrue_miles', stdout=StringIO())
+		self.uncredited = Booking.objects.create(flight=self.flight, date=today - timedelta(days=500), user=self.user, passengers=1)
+		self.past = list(Booking.objects.filter(user=self.user, date__lt=today).order_by('-date', '-id').values_list('id', flat=True))
+
+	def archive(self):
+		out = StringIO()
+		call_command('archive_bookings', '--days', '30', '--chunk-size', '2', stdout=out)
+		return out.getvalue()
+
+	def test_archives_credited_and_counted_bookings(self):
+		self.assertIn('Archived 3 booking(s).', self.archive())
+		self.assertEqual(sorted(ArchivedBooking.objects.values_list('id', flat=True)), sorted(self.past[1:4]))
+		self.assertFalse(Booking.objects.filter(id__in=self.past[1:4]).exists())
+		self.assertEqual(Booking.objects.count(), 4)
+		self.assertIn('Archived 0 booking(s).', self.archive())
+
+	def test_reads_span_both_tables(self):
+		self.archive()
+		response = self.client.get(reverse('profile-details'))
+		self.assertEqual([booking['id'] for booking in response.data['past_bookings']], self.past)
+		self.assertEqual(response.data['past_bookings_count'], 5)
+
+		ids = []
+		url = reverse('past-bookings') + '?page_size=2'
+		while url:
+			response = self.client.get(url)
+			ids.extend(booking['id'] for booking in response.data['results'])
+			url = response.data['next']
+		self.assertEqual(ids, self.past)
+
+		response = self.client.get(reverse('export-bookings', args=['csv']))
+		rows = list(csv.reader(b''.join(response.streaming_content).decode('utf-8').splitlines()))
+		self.assertEqual([int(row[0]) for row in rows[1:]], sorted(Booking.objects.values_list('id', flat=True).union(ArchivedBooking.objects.values_list('id', flat=True))))
+
+	def test_miles_are_not_credited_again(self):
+		self.archive()
+		call_command('accrue_miles', stdout=StringIO())
+		self.assertEqual(Profile.objects.get(id=self.profile.id).miles, 5 * 4000)
+		self.assertEqual(MilesLedger.objects.filter(user=self.user).count(), 5)
+
+
+class LoyaltyTierTest(APITestCase):
+	def setUp(self):
+		self.user_data = {"username" : "laila", "password" : "1234567890-="}
+		self.user = User(username=self.user_data["username"], is_staff=True)
+		self.user.set_password(self.user_data["password"])
+		self.user.save()
+		self.profiles = [
+			Profile.objects.create(user=User.objects.create(username='member%d' % index), miles=miles)
+			for index, miles in enumerate([0, 9999, 10000, 59999, 60000, 150000, 70000])
+		]
+		response = self.client.post(reverse('login'), self.user_data)
+		self.client.credentials(HTTP_AUTHORIZATION='Bearer ' + response.data['access'])
+
+	def tiers(self):
+		return [Profile.objects.get(id=profile.id).tier for profile in self.profiles]
+
+	def test_tier_stored(self):
+		self.assertEqual(self.tiers(), ['Blue', 'Blue', 'Silver', 'Silver', 'Gold', 'Platinum', 'Gold'])
+
+	def test_tier_follows_miles(self):
+		profile = Profile.objects.get(id=self.profiles[0].id)
+		profile.miles = 60000
+		profile.save(update_fields=['miles'])
+		self.assertEqual(Profile.objects.get(id=profile.id).tier, 'Gold')
+
+	def test_tier_follows_accrual(self):
+		flight = Flight.objects.create(destination='Wakanda', time='10:00', price=230, miles=4000)
+		Booking.objects.create(flight=flight, date=date.today() - timedelta(days=1), user=self.profiles[1].user, passengers=1)
+		call_command('accrue_miles', stdout=StringIO())
+		self.assertEqual(Profile.objects.get(id=self.profiles[1].id).tier, 'Silver')
+
+	def test_retier(self):
+		TierThreshold.objects.filter(name='Gold').update(min_miles=65000)
+		TierThreshold.objects.create(name='Bronze', min_miles=5000)
+		call_command('retier', '--chunk-size', '3', stdout=StringIO())
+		self.assertEqual(self.tiers(), ['Blue', 'Bronze', 'Silver', 'Silver', 'Silver', 'Platinum', 'Gold'])
+
+	def test_tier_list(self):
+		response = self.client.get(reverse('tier-list'))
+		self.assertEqual(response.status_code, status.HTTP_200_OK)
+		self.assertEqual([(tier['name'], tier['min_miles'], tier['members']) for tier in response.data], [
+			('Blue', 0, 2), ('Silver', 10000, 2), ('Gold', 60000, 2), ('Platinum', 100000, 1),
+		])
+
+	def test_tier_members(self):
+		response = self.client.get(reverse('tier-members', args=['Gold']), {'page_size': 1})
+		self.assertEqual(response.status_code, status.HTTP_200_OK)
+		self.assertEqual([member['username'] for member in response.data['results']], ['member4'])
+		response = self.client.get(response.data['next'])
+		self.assertEqual([(member['username'], member['miles']) for member in response.data['results']], [('member6', 70000)])
+		self.assertIsNone(response.data['next'])
+
+	def test_unknown_tier(self):
+		response = self.client.get(reverse('tier-members', args=['Tin']))
+		self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
+
+	def test_staff_only(self):
+		self.user.is_staff = False
+		self.user.save()
+		self.assertEqual(self.client.get(reverse('tier-list')).status_code, status.HTTP_403_FORBIDDEN)
+		self.assertEqual(self.client.get(reverse('tier-members', args=['Gold'])).status_code, status.HTTP_403_FORBIDDEN)
+
+
+class PasswordHashingTest(APITestCase):
+	def setUp(self):
+		self.user_data = {"username" : "laila", "password" : "1234567890-="}
+		self.user = User(username=self.user_data["username"])
+		self.user.set_password(self.user_data["password"])
+		self.user.save()
+
+	def register(self):
+		data = {"username": "laila2", "password": "1234567890-=", "first_name": "laila", "last_name":  "bee"}
+		return self.client.post(reverse('register'), data)
+
+	def test_register(self):
+		self.assertEqual(self.register().status_code, status.HTTP_201_CREATED)
+		self.assertTrue(User.objects.get(username='laila2').check_password('1234567890-='))
+
+	def test_login(self):
+		self.assertEqual(self.client.post(reverse('login'), self.user_data).status_code, status.HTTP_200_OK)
+		response = self.client.post(reverse('login'), {"username": "laila", "password": "wrong"})
+		self.assertEqual(response.status_code, status.HTTP_401_UNAUTHORIZED)
+		response = self.client.post(reverse('login'), {"username": "nobody", "password": "wrong"})
+		self.assertEqual(response.status_code, status.HTTP_401_UNAUTHORIZED)
+
+	def test_rehash_on_login(self):
+		self.user.password = PBKDF2PasswordHasher().encode(self.user_data["password"], 'saltsalt', iterations=1000)
+		self.user.save()
+		self.assertEqual(self.client.post(reverse('login'), self.user_data).status_code, status.HTTP_200_OK)
+		self.user.refresh_from_db()
+		self.assertEqual(self.user.password.split('$')[1], str(PBKDF2PasswordHasher.iterations))
+		self.assertTrue(self.user.check_password(self.user_data["password"]))
+
+	@override_settings(PASSWORD_HASHING_WORKERS=0)
+	def test_inline(self):
+		self.assertEqual(self.client.post(reverse('login'), self.user_data).status_code, status.HTTP_200_OK)
+		self.assertEqual(self.register().status_code, status.HTTP_201_CREATED)
+
+	def saturate(self):
+		slots = get_pool().slots
+		slots.acquire()
+		self.addCleanup(slots.release)
+
+	@override_settings(PASSWORD_HASHING_MAX_PENDING=1)
+	def test_saturated(self):
+		self.saturate()
+		response = self.client.post(reverse('login'), self.user_data)
+		self.assertEqual(response.status_code, status.HTTP_429_TOO_MANY_REQUESTS)
+		self.assertEqual(response['Retry-After'], '1')
+		self.assertEqual(self.register().status_code, status.HTTP_429_TOO_MANY_REQUESTS)
+		self.assertFalse(User.objects.filter(username='laila2').exists())
+
+	@override_settings(PASSWORD_HASHING_MAX_PENDING=1)
+	def test_saturated_outside_the_api(self):
+		self.saturate()
+		self.assertEqual(authenticate(username='laila', password=self.user_data["password"]), self.user)
+		self.assertIsNone(authenticate(username='nobody', password='wrong'))
+
+	def test_unbounded(self):
+		self.assertEqual(HashingPool(workers=0, max_pending=0).run(len, 'free'), 4)
+
+	def test_queue_depth(self):
+		pool = HashingPool(workers=0, max_pending=1)
+		started, release = threading.Event(), threading.Event()
+		worker = threading.Thread(target=pool.run, args=(lambda: started.set() or release.wait(5),))
+		worker.start()
+		started.wait(5)
+		with self.assertRaises(HashingBusy):
+			pool.run(len, 'busy')
+		release.set()
+		worker.join()
+		self.assertEqual(pool.run(len, 'free'), 4)
+
+
+@override_settings(DATABASE_REPLICAS=['replica'])
+class ReplicaRoutingTest(SimpleTestCase):
+	def setUp(self):
+		self.router = PrimaryReplicaRouter()
+		routers.reset()
+
+	def tearDown(self):
+		routers.reset()
+
+	def test_reads_go_to_replica(self):
+		self.assertEqual(self.router.db_for_read(Flight), 'replica')
+
+	def test_reads_follow_writes(self):
+		self.assertEqual(self.router.db_for_write(Booking), 'default')
+		self.assertEqual(self.router.db_for_read(Flight), 'default')
+
+	@override_settings(DATABASE_REPLICAS=[])
+	def test_no_replicas(self):
+		self.assertEqual(self.router.db_for_read(Flight), 'default')
+
+	def test_use_primary(self):
+		with routers.use_primary():
+			self.assertEqual(self.router.db_for_read(Flight), 'default')
+		self.assertEqual(self.router.db_for_read(Flight), 'replica')
+
+	def test_middleware(self):
+		seen = []
+		middleware = ReplicaPinMiddleware(lambda request: seen.append(self.router.db_for_read(Flight)))
+		middleware(RequestFactory().get('/flights/'))
+		middleware(RequestFactory().post('/book/1/'))
+		routers.pin_to_primary()
+		middleware(RequestFactory().get('/flights/'))
+		self.assertEqual(seen, ['replica', 'default', 'replica'])
+		self.assertFalse(routers.is_pinned())
+
+	def test_no_migrations_on_replicas(self):
+		self.assertFalse(self.router.allow_migrate('replica', 'flights'))
+		self.assertTrue(self.router.allow_migrate('default', 'flights'))
+
+
+class ReplicateTest(TransactionTestCase):
+	def test_snapshot(self):
+		Flight.objects.create(destination='Wakanda', time='10:00', price=230, miles=4000)
+		with tempfile.TemporaryDirectory() as directory:
+			path = os.path.join(directory, 'replica.sqlite3')
+			call_command('replicate', '--path', path, verbosity=0)
+			Flight.objects.create(destination='La la land', time='00:00', price=1010, miles=1010)
+			replica = sqlite3.connect(path)
+			self.assertEqual(replica.execute('SELECT destination FROM flights_flight').fetchall(), [('Wakanda',)])
+			replica.close()
+			call_command('replicate', '--path', path, verbosity=0)
+			replica = sqlite3.connect(path)
+			self.assertEqual(replica.execute('SELECT COUNT(*) FROM flights_flight').fetchone(), (2,))
+			replica.close()
+			self.assertEqual(os.listdir(directory), ['replica.sqlite3'])
+
+
+@skipUnless(connection.vendor == 'sqlite', 'SQLite pragmas')
+class SqlitePragmasTest(TestCase):
+	def pragma(self, database, name):
+		return database.execute('PRAGMA %s' % name).fetchone()[0]
+
+	def test_pragmas_applied(self):
+		connection.ensure_connection()
+		cache_size = self.pragma(connection.connection, 'cache_size')
+		with override_settings(SQLITE_PRAGMAS={'cache_size': -1234, 'busy_timeout': 250}):
+			configure_sqlite(sender=connection.__class__, connection=connection)
+		try:
+			self.assertEqual(self.pragma(connection.connection, 'cache_size'), -1234)
+			self.assertEqual(self.pragma(connection.connection, 'busy_timeout'), 250)
+		finally:
+			connection.connection.execute('PRAGMA cache_size = %d' % cache_size)
+
+	@override_settings(DATABASE_REPLICAS=['replica'], SQLITE_PRAGMAS={'journal_mode': 'WAL', 'cache_size': -1234})
+	def test_replicas_skip_writer_pragmas(self):
+		with tempfile.TemporaryDirectory() as directory:
+			database = sqlite3.connect(os.path.join(directory, 'replica.sqlite3'))
+			replica = type('Replica', (), {'vendor': 'sqlite', 'alias': 'replica', 'connection': database})
+			configure_sqlite(sender=None, connection=replica)
+			self.assertEqual(self.pragma(database, 'journal_mode'), 'delete')
+			self.assertEqual(self.pragma(database, 'cache_size'), -1234)
+			database.close()
+
+
+class BenchmarkDatasetTest(TestCase):
+	def snapshot(self):
+		return list(Booking.objects.order_by('id').values_list('user__username', 'flight__destination', 'date', 'passengers'))
+
+	def test_deterministic(self):
+		snapshots = []
+		for _ in range(2):
+			with transaction.atomic():
+				dataset = generate_dataset(flights=50, users=10, bookings_per_user=6, past_share=0.5, seed=3)
+				snapshots.append(self.snapshot())
+				self.assertEqual(len(dataset['users']), 10)
+				self.assertEqual(Profile.objects.count(), 11)
+				past = Booking.objects.filter(date__lt=date.today())
+				self.assertEqual(MilesLedger.objects.count(), past.count())
+				self.assertTrue(0 < past.count() < 60)
+				self.assertFalse(Booking.objects.filter(date__gte=date.today(), date__lte=date.today() + timedelta(days=3)).exists())
+				transaction.set_rollback(True)
+		self.assertEqual(len(snapshots[0]), 60)
+		self.assertEqual(snapshots[0], snapshots[1])
+
+	def test_every_route_is_benchmarked(self):
+		names = {pattern.name for pattern in urlpatterns if getattr(pattern, 'name', None)}
+		self.assertLessEqual(names, set(BenchEndpoints().routes()))
+
+
+class InstrumentationTest(APITestCase):
+	def setUp(self):
+		self.user_data = {"username" : "laila", "password" : "1234567890-="}
+		self.user = User(username=self.user_data["username"])
+		self.user.set_password(self.user_data["password"])
+		self.user.save()
+		flight = Flight.objects.create(destination='Wakanda', time='10:00', price=230, miles=4000)
+		Booking.objects.create(user=self.user, flight=flight, date='2030-05-05', passengers=2)
+		response = self.client.post(reverse('login'), self.user_data)
+		self.client.credentials(HTTP_AUTHORIZATION='Bearer ' + response.data['access'])
+
+	@override_settings(INSTRUMENTATION_SAMPLE_RATE=1)
+	def test_server_timing(self):
+		with self.assertLogs('flights.instrumentation', 'INFO') as logs:
+			response = self.client.get(reverse('bookings-list'))
+		metrics = dict(metric.split(';', 1)[0:2] for metric in response['Server-Timing'].split(', '))
+		self.assertEqual(set(metrics), {'db', 'auth', 'serialize', 'app'})
+		self.assertIn('desc="', metrics['db'])
+		line = json.loads(logs.records[0].getMessage())
+		self.assertEqual((line['method'], line['path'], line['status']), ('GET', reverse('bookings-list'), 200))
+		self.assertGreaterEqual(line['queries'], 1)
+		self.assertGreaterEqual(line['app_ms'], line['serialize_ms'])
+
+	@override_settings(INSTRUMENTATION_SAMPLE_RATE=0)
+	def test_not_sampled(self):
+		response = self.client.get(reverse('bookings-list'))
+		self.assertFalse(response.has_header('Server-Timing'))
+
+	@override_settings(INSTRUMENTATION_SAMPLE_RATE=0, SLOW_QUERY_MS=0)
+	def test_slow_query_log(self):
+		with self.assertLogs('flights.instrumentation.slow_queries', 'WARNING') as logs:
+			self.client.get(reverse('bookings-list'))
+		entries = [json.loads(record.getMessage()) for record in logs.records]
+		booking_query = next(entry for entry in entries if 'flights_booking' in entry['sql'])
+		self.assertTrue(any(origin.startswith('flights/views.py') or origin.startswith('flights/pagination.py') for origin in booking_query['origin']))
+
+
+class MetricsTest(APITestCase):
+	def setUp(self):
+		directory = tempfile.TemporaryDirectory()
+		self.addCleanup(directory.cleanup)
+		self.directory = directory.name
+		settings_override = override_settings(METRICS_DIR=self.directory, METRICS_TOKEN='scrape-token')
+		settings_override.enable()
+		self.addCleanup(settings_override.disable)
+		Flight.objects.create(destination='Wakanda', time='10:00', price=230, miles=4000)
+		catalog_cache().clear()
+
+	def samples(self):
+		response = self.client.get(reverse('metrics'), HTTP_AUTHORIZATION='Bearer scrape-token')
+		self.assertEqual(response['Content-Type'], metrics.CONTENT_TYPE)
+		return dict(line.rsplit(' ', 1) for line in response.content.decode('utf-8').splitlines() if not line.startswith('#'))
+
+	def test_requests_by_view(self):
+		self.client.get(reverse('flights-list'))
+		self.client.get(reverse('flights-list'))
+		self.client.get(reverse('profile-details'))
+		samples = self.samples()
+		self.assertEqual(samples['flights_http_requests_total{view="flights-list",method="GET"}'], '2')
+		self.assertEqual(samples['flights_http_errors_total{view="profile-details",status="401"}'], '1')
+		self.assertEqual(samples['flights_http_request_duration_seconds_count{view="flights-list"}'], '2')
+		self.assertEqual(samples['flights_http_request_duration_seconds_bucket{view="flights-list",le="+Inf"}'], '2')
+		self.assertEqual(samples['flights_db_queries_per_request_bucket{view="flights-list",le="0"}'], '1')
+		self.assertEqual(samples['flights_db_queries_per_request_bucket{view="flights-list",le="1"}'], '2')
+		self.assertEqual(samples['flights_cache_requests_total{cache="catalog",result="miss"}'], '1')
+		self.assertEqual(samples['flights_cache_requests_total{cache="catalog",result="hit"}'], '1')
+
+	def test_unknown_methods_share_a_label(self):
+		for method in ['FROBNICATE', 'X' * 1000]:
+			self.client.generic(method, reverse('flights-list'))
+		samples = self.samples()
+		self.assertEqual(samples['flights_http_requests_total{view="flights-list",method="other"}'], '2')
+		self.assertEqual([name for name in samples if 'flights-list' in name and 'method=' in name], ['flights_http_requests_total{view="flights-list",method="other"}'])
+
+	def test_token_required(self):
+		self.assertEqual(self.client.get(reverse('metrics')).status_code, status.HTTP_401_UNAUTHORIZED)
+		response = self.client.get(reverse('metrics'), HTTP_AUTHORIZATION='Bearer scrape-tokem')
+		self.assertEqual(response.status_code, status.HTTP_401_UNAUTHORIZED)
+		self.assertNotIn(b'flights_http_requests_total', response.content)
+		with override_settings(METRICS_TOKEN=None):
+			response = self.client.get(reverse('metrics'), HTTP_AUTHORIZATION='Bearer scrape-token')
+			self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
+
+	def test_processes_are_summed(self):
+		metrics.CACHE.inc('test', 'hit')
+		child = multiprocessing.get_context('fork').Process(target=metrics.CACHE.inc, args=('test', 'hit'), kwargs={'amount': 2})
+		child.start()
+		child.join()
+		self.assertEqual(len(os.listdir(self.directory)), 2)
+		self.assertEqual(self.samples()['flights_cache_requests_total{cache="test",result="hit"}'], '3')
+
+	def test_storage_grows(self):
+		storage = metrics.MmapStorage(os.path.join(self.directory, 'metrics_0.db'))
+		for index in range(5000):
+			storage.add(('flights_test', '', ('label-%d' % index,), None), index)
+		storage.close()
+		reopened = metrics.MmapStorage(os.path.join(self.directory, 'metrics_0.db'))
+		self.assertEqual(len(reopened.offsets), 5000)
+		self.assertEqual(dict(reopened.items())['flights_test', '', ('label-4999',), None], 4999)
+		reopened.close()
+
+
+class QueryWrapperTest(TransactionTestCase):
+	# Workers open their connection inside a request, and again on every
+	# request with CONN_MAX_AGE = 0.
+	def setUp(self):
+		directory = tempfile.TemporaryDirectory()
+		self.addCleanup(directory.cleanup)
+		settings_override = override_settings(METRICS_DIR=directory.name, INSTRUMENTATION_SAMPLE_RATE=1)
+		settings_override.enable()
+		self.addCleanup(settings_override.disable)
+		user = User.objects.create(username='laila')
+		flight = Flight.objects.create(destination='Wakanda', time='10:00', price=230, miles=4000)
+		Booking.objects.create(user=user, flight=flight, date=date.today() + timedelta(days=10), passengers=2)
+		self.client = APIClient()
+		self.client.force_authenticate(user)
+
+	def disconnect(self):
+		# Forgets the connection without closing it, which would destroy the
+		# in-memory test database; the next query opens a new one.
+		self.addCleanup(connection.connection.close)
+		connection.connection = None
+
+	def test_connection_opened_mid_request(self):
+		for _ in range(3):
+			self.disconnect()
+			with self.assertLogs('flights.instrumentation', 'INFO'):
+				response = self.client.get(reverse('bookings-list'))
+			self.assertIn('desc="1 queries"', response['Server-Timing'])
+			self.assertEqual(connection.execute_wrappers, [])
+		samples = dict(line.rsplit(' ', 1) for line in metrics.render().splitlines() if not line.startswith('#'))
+		self.assertEqual(samples['flights_db_queries_per_request_bucket{view="bookings-list",le="0"}'], '0')
+		self.assertEqual(samples['flights_db_queries_per_request_bucket{view="bookings-list",le="1"}'], '3')
+
+
+class ValuesListTest(APITestCase):
+	def setUp(self):
+		self.user = User.objects.create(username='laila')
+		self.client.force_authenticate(self.user)
+		destinations = ['Wakanda', 'La la land', 'Ünïcode\u2028City']
+		for index in range(12):
+			flight = Flight.objects.create(destination=destinations[index % 3], time='%02d:%02d' % (index, index * 5), price=Decimal('%d.%d5' % (100 + index * 37, index)), miles=100 * index)
+			Booking.objects.create(user=self.user, flight=flight, date=date.today() + timedelta(days=index), passengers=index % 4 + 1)
+		catalog_cache().clear()
+
+	def reference(self, view, path):
+		# The same list view without the values_list fast path, rendered
+		# by DRF's own JSONRenderer.
+		attributes = {
+			name: getattr(view, name) for name in (
+				'serializer_class', 'filter_backends', 'ordering', 'pagination_class', 'permission_classes',
+				'search_fields', 'ordering_fields', 'filter_lookups',
+			) if hasattr(view, name)
+		}
+		if 'get_queryset' in view.__dict__:
+			attributes['get_queryset'] = view.__dict__['get_queryset']
+		else:
+			attributes['queryset'] = view.queryset
+		reference = type('Reference', (ListAPIView,), dict(attributes, renderer_classes=[JSONRenderer]))
+		request = APIRequestFactory().get(path)
+		force_authenticate(request, self.user)
+		return reference.as_view()(request).render().content
+
+	def assertSameOutput(self, view, path):
+		response = self.client.get(path)
+		self.assertEqual(response.status_code, status.HTTP_200_OK)
+		self.assertEqual(response.content, self.reference(view, path))
+		return json.loads(response.content.decode('utf-8'))
+
+	def test_flights_list(self):
+		self.assertSameOutput(FlightsList, reverse('flights-list'))
+		self.assertSameOutput(FlightsList, reverse('flights-list') + '?ordering=-price')
+		self.assertSameOutput(FlightsList, reverse('flights-list') + '?search=wakan')
+		self.assertSameOutput(FlightsList, reverse('flights-list') + '?price__gte=200&time__lte=08:00&ordering=time')
+		page = self.assertSameOutput(FlightsList, reverse('flights-list') + '?page_size=5&ordering=time')
+		self.assertSameOutput(FlightsList, page['next'].replace('http://testserver', ''))
+
+	def test_bookings_list(self):
+		self.assertSameOutput(BookingsList, reverse('bookings-list'))
+		page = self.assertSameOutput(BookingsList, reverse('bookings-list') + '?page_size=4&ordering=-totalprice')
+		self.assertSameOutput(BookingsList, page['next'].replace('http://testserver', ''))
+
+	def test_unsupported_serializer(self):
+		with self.assertRaises(ImproperlyConfigured):
+			RowReader(BookingDetailsSerializer)
+
+	def test_renderer(self):
+		data = {
+			'date': date(2030, 5, 5), 'time': dtime(10, 30, 0, 1500), 'moment': datetime(2030, 5, 5, 10, 30, tzinfo=timezone.utc),
+			'price': Decimal('12.50'), 'text': 'line\u2028separator ü', 'lazy': gettext_lazy('Not found.'), 'items': (1, 2.5, None, True),
+			'huge': 2 ** 70,
+		}
+		self.assertEqual(FastJSONRenderer().render(data), JSONRenderer().render(data))
+		self.assertEqual(FastJSONRenderer().render(data, 'application/json; indent=4'), JSONRenderer().render(data, 'application/json; indent=4'))
+
+
+class ExportTest(APITestCase):
+	def setUp(self):
+		self.user = User.objects.create(username='laila', is_staff=True)
+		self.client.force_authenticate(self.user)
+		self.wakanda = Flight.objects.create(destination='Wakanda', time='10:00', price=230, miles=4000)
+		self.la_la_land = Flight.objects.create(destination='La la land', time='00:00', price=Decimal('1010.5'), miles=1010)
+		for day in range(1, 11):
+			Booking.objects.create(user=self.user, flight=self.wakanda if day % 2 else self.la_la_land, date=date(2030, 5, day), passengers=day % 4 + 1)
+
+	def export(self, name, export_format, query=''):
+		response = self.client.get(reverse(name, args=[export_format]) + query)
+		self.assertEqual(response.status_code, status.HTTP_200_OK)
+		self.assertTrue(response.streaming)
+		return response, b''.join(response.streaming_content).decode('utf-8')
+
+	def test_bookings_csv(self):
+		response, content = self.export('export-bookings', 'csv', '?destination=La la land&date__gte=2030-05-04&date__lte=2030-05-08')
+		self.assertEqual(response['Content-Type'], 'text/csv; charset=utf-8')
+		self.assertEqual(response['Content-Disposition'], 'attachment; filename="bookings.csv"')
+		rows = list(csv.reader(content.splitlines()))
+		self.assertEqual(rows[0], ['id', 'user', 'flight', 'destination', 'date', 'passengers', 'price', 'totalprice'])
+		self.assertEqual([row[4] for row in rows[1:]], ['2030-05-04', '2030-05-06', '2030-05-08'])
+		self.assertEqual(rows[1][3:], ['La la land', '2030-05-04', '1', '1010.500', '1010.500'])
+
+	def test_flights_ndjson(self):
+		response, content = self.export('export-flights', 'ndjson')
+		self.assertEqual(response['Content-Type'], 'application/x-ndjson')
+		lines = [json.loads(line) for line in content.splitlines()]
+		self.assertEqual([line['destination'] for line in lines], ['Wakanda', 'La la land'])
+		self.assertEqual(lines[1], {'id': self.la_la_land.id, 'destination': 'La la land', 'time': '00:00:00', 'price': '1010.500', 'miles': 1010, 'capacity': 200})
+
+	def test_accept_header_is_ignored(self):
+		response = self.client.get(reverse('export-flights', args=['csv']), HTTP_ACCEPT='text/csv')
+		self.assertEqual(response.status_code, status.HTTP_200_OK)
+
+	def test_staff_only(self):
+		self.client.force_authenticate(User.objects.create(username='bee'))
+		response = self.client.get(reverse('export-bookings', args=['csv']))
+		self.assertEqual(response.status_code, status.HTTP_403_FORBIDDEN)
+
+	def test_unknown_format(self):
+		response = self.client.get(reverse('export-bookings', args=['xml']))
+		self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
+
+	def test_keyset_chunks(self):
+		chunks = list(keyset_chunks(Booking.objects.filter(date__gte=date(2030, 5, 3)), ['date'], 3))
+		self.assertEqual([len(chunk) for chunk in chunks], [3, 3, 2])
+		self.assertEqual([row[0] for chunk in chunks for row in chunk], [date(2030, 5, day) for day in range(3, 11)])
+
+	@skipUnless(os.environ.get('SLOW_TESTS'), 'Exports 2M bookings; set SLOW_TESTS=1 to run.')
+	@skipUnless(os.path.exists('/proc/self/statm'), 'Reads the resident set size from /proc.')
+	def test_memory_stays_flat(self):
+		# Two million bookings, streamed while watching the resident set
+		# size: it may not grow by more than a few chunks' worth.
+		with connection.cursor() as cursor:
+			cursor.execute(
+				"WITH RECURSIVE n(i) AS (SELECT 1 UNION ALL SELECT i + 1 FROM n WHERE i < 2000000) "
+				"INSERT INTO flights_booking (flight_id, user_id, date, passengers) "
+				"SELECT %s, %s, date('2030-01-01', '+' || (i %% 365) || ' days'), 1 + i %% 4 FROM n",
+				[self.wakanda.id, self.user.id],
+			)
+		page_size = os.sysconf('SC_PAGE_SIZE')
+
+		def resident():
+			with open('/proc/self/statm') as statm:
+				return int(statm.read().split()[1]) * page_size
+
+		response = self.client.get(reverse('export-bookings', args=['csv']))
+		start = resident()
+		peak = start
+		lines = 0
+		for chunk in response.streaming_content:
+			lines += chunk.count(b'\n')
+			peak = max(peak, resident())
+		self.assertEqual(lines, 2000000 + 10 + 1)
+		self.assertLess(peak - start, 32 * 1024 * 1024)
+
+
+class ImportFlightsTest(TestCase):
+	def setUp(self):
+		self.wakanda = Flight.objects.create(destination='Wakanda', time='10:00', price=230, miles=4000, capacity=150)
+		self.directory = tempfile.TemporaryDirectory()
+		self.addCleanup(self.directory.cleanup)
+
+	def schedule(self, name, content):
+		path = os.path.join(self.directory.name, name)
+		with open(path, 'w', encoding='utf-8') as f:
+			f.write(content)
+		return path
+
+	def run_import(self, path, *args):
+		out, err = StringIO(), StringIO()
+		call_command('import_flights', path, '--chunk-size', '2', *args, stdout=out, stderr=err)
+		return out.getvalue(), err.getvalue()
+
+	def test_csv_upsert(self):
+		path = self.schedule('summer.csv', (
+			'destination,time,price,miles\n'
+			'Wakanda,10:00,250.5,4000\n'
+			'Oslo,07:15,99,800\n'
+			'Oslo,noon,99,800\n'
+			'Lima,23:00,640,6200\n'
+		))
+		version = catalog_version()
+		out, err = self.run_import(path)
+		self.assertIn('Created 2 and updated 1 flight(s), 0 unchanged, 1 invalid row(s).', out)
+		self.assertIn('Line 4: time:', err)
+		self.wakanda.refresh_from_db()
+		self.assertEqual((self.wakanda.price, self.wakanda.capacity), (Decimal('250.5'), 150))
+		self.assertEqual(Flight.objects.get(destination='Oslo').time, dtime(7, 15))
+		self.assertEqual(set(DestinationTrigram.objects.values_list('destination', flat=True)), {'Wakanda', 'Oslo', 'Lima'})
+		self.assertGreater(catalog_version(), version)
+		version = catalog_version()
+
+		out, err = self.run_import(path)
+		self.assertIn('Created 0 and updated 0 flight(s), 3 unchanged', out)
+		self.assertEqual(Flight.objects.count(), 3)
+		self.assertEqual(catalog_version(), version)
+
+	def test_ndjson(self):
+		path = self.schedule('winter.ndjson', (
+			'{"destination": "Wakanda", "time": "10:00:00", "price": "230.000", "miles": 4000, "capacity": 180}\n'
+			'\n'
+			'not json\n'
+			'{"destination": "Lima", "time": "23:00", "price": 640, "miles": 6200}\n'
+		))
+		out, err = self.run_import(path)
+		self.assertIn('Created 1 and updated 1 flight(s), 0 unchanged, 1 invalid row(s).', out)
+		self.assertIn('Line 3: non_field_errors:', err)
+		self.assertEqual(Flight.objects.get(id=self.wakanda.id).capacity, 180)
+		self.assertEqual(Flight.objects.get(destination='Lima').capacity, 200)
+
+	def test_capacity_change_resizes_inventory(self):
+		oslo = Flight.objects.create(destination='Oslo', time='07:15', price=99, miles=800, capacity=150)
+		for flight in [self.wakanda, oslo]:
+			SeatInventory.objects.create(flight=flight, date='2030-05-05', seats_left=20)
+		path = self.schedule('winter.ndjson', (
+			'{"destination": "Wakanda", "time": "10:00", "price": 230, "miles": 4000, "capacity": 100}\n'
+			'{"destination": "Oslo", "time": "07:15", "price": 99, "miles": 800, "capacity": 100}\n'
+		))
+		self.run_import(path)
+		self.assertEqual(list(SeatInventory.objects.order_by('flight_id').values_list('seats_left', flat=True)), [-30, -30])
+
+	def test_dry_run(self):
+		path = self.schedule('summer.csv', 'destination,time,price,miles\nWakanda,10:00,1,1\nOslo,07:15,99,800\n')
+		version = catalog_version()
+		out, err = self.run_import(path, '--dry-run')
+		self.assertIn('Would create 1 and update 1 flight(s)', out)
+		self.assertEqual(list(Flight.objects.values_list('destination', 'price')), [('Wakanda', Decimal('230'))])
+		self.assertFalse(DestinationTrigram.objects.filter(destination='Oslo').exists())
+		self.assertEqual(catalog_version(), version)
+
+	def test_unknown_format(self):
+		with self.assertRaises(CommandError):
+			self.run_import(self.schedule('summer.xlsx', ''))
+
+
+class AdminTest(TestCase):
+	def setUp(self):
+		self.admin = User.objects.create(username='admin', is_staff=True, is_superuser=True)
+		self.client.force_login(self.admin)
+		self.user = User.objects.create(username='laila')
+		self.profile = Profile.objects.create(user=self.user, past_bookings_counted_until=date.today())
+		self.flight = Flight.objects.create(destination='Wakanda', time='10:00', price=230, miles=4000, capacity=10)
+		Flight.objects.create(destination='La la land', time='00:00', price=1010, miles=1010)
+		self.day = date.today() + timedelta(days=10)
+		self.bookings = [Booking.objects.create(flight=self.flight, date=self.day, user=self.user, passengers=2) for _ in range(3)]
+		self.past = Booking.objects.create(flight=self.flight, date=date.today() - timedelta(days=3), user=self.user, passengers=1)
+		SeatInventory._create(self.flight.id, self.day)
+
+	def seats_left(self, booking_date):
+		return SeatInventory.objects.get(flight=self.flight, date=booking_date).seats_left
+
+	def past_count(self):
+		return Profile.objects.get(id=self.profile.id).past_bookings_count
+
+	def act(self, action, bookings, **data):
+		return self.client.post(reverse('admin:flights_booking_changelist'), dict(
+			data, action=action, _selected_action=[booking.id for booking in bookings],
+		))
+
+	def test_changelists_query_count_is_flat(self):
+		urls = [reverse('admin:flights_%s_changelist' % name) for name in ('booking', 'flight', 'profile')]
+		few = []
+		for url in urls:
+			with CaptureQueriesContext(connection) as queries:
+				self.assertEqual(self.client.get(url).status_code, status.HTTP_200_OK)
+			few.append(len(queries))
+		for index in range(20):
+			user = User.objects.create(username='user%d' % index)
+			Profile.objects.create(user=user)
+			Booking.objects.create(flight=Flight.objects.create(destination='Atlantis %d' % index, time='12:00', price=1, miles=1), date=self.day, user=user, passengers=1)
+		for url, count in zip(urls, few):
+			with CaptureQueriesContext(connection) as queries:
+				self.client.get(url)
+			self.assertEqual(len(queries), count, url)
+
+	def test_estimated_count(self):
+		class Paginator(admin.EstimatedCountPaginator):
+			count_limit = 2
+
+		self.assertEqual(Paginator(Booking.objects.filter(date=self.day).order_by('id'), 10).count, 2)
+		self.assertEqual(Paginator(Booking.objects.order_by('id'), 10).count, 2)
+		with connection.cursor() as cursor:
+			cursor.execute('ANALYZE')
+		self.assertEqual(Paginator(Booking.objects.order_by('id'), 10).count, 4)
+		self.assertEqual(Paginator(Booking.objects.filter(date=self.day).order_by('id'), 10).count, 2)
+
+	def test_cancel_action(self):
+		with CaptureQueriesContext(connection) as queries:
+			self.act('cancel_bookings', self.bookings[:2] + [self.past])
+		self.assertEqual(list(Booking.objects.values_list('id', flat=True)), [self.bookings[2].id])
+		self.assertEqual(self.seats_left(self.day), 8)
+		self.assertEqual(self.past_count(), 0)
+		self.assertLess(len(queries), 15)
+
+	def test_cancel_query_count_is_flat(self):
+		counts = []
+		for bookings in [self.bookings[:1], self.bookings[1:] + [self.past]]:
+			with CaptureQueriesContext(connection) as queries:
+				self.act('cancel_bookings', bookings)
+			counts.append(len(queries))
+		self.assertEqual(counts[0], counts[1])
+		self.assertEqual((Booking.objects.count(), self.seats_left(self.day), self.past_count()), (0, 10, 0))
+
+	def test_redate_action(self):
+		later = self.day + timedelta(days=1)
+		SeatInventory._create(self.flight.id, later)
+		self.act('redate_bookings', self.bookings[:1], date=later.isoformat())
+		self.assertEqual(Booking.objects.get(id=self.bookings[0].id).date, later)
+		self.assertEqual((self.seats_left(self.day), self.seats_left(later)), (6, 8))
+
+		self.act('redate_bookings', self.bookings[1:], date=(date.today() - timedelta(days=1)).isoformat())
+		self.assertEqual(self.past_count(), 3)
+		self.assertEqual(self.seats_left(self.day), 10)
+
+	def test_overbooking_tracked(self):
+		later = self.day + timedelta(days=1)
+		SeatInventory._create(self.flight.id, later)
+		Booking.objects.create(flight=self.flight, date=later, user=self.user, passengers=7)
+		self.act('redate_bookings', self.bookings, date=later.isoformat())
+		self.assertEqual((self.seats_left(self.day), self.seats_left(later)), (10, -3))
+		self.act('cancel_bookings', self.bookings)
+		self.assertEqual(self.seats_left(later), 3)
+
+	def test_redate_needs_a_date(self):
+		self.act('redate_bookings', self.bookings, date='soon')
+		self.assertEqual(Booking.objects.filter(date=self.day).count(), 3)
+
+	def test_flight_search_uses_trigrams(self):
+		response = self.client.get(reverse('admin:flights_flight_changelist'), {'q': 'wakand'})
+		self.assertEqual([flight.destination for flight in response.context['cl'].result_list], ['Wakanda'])
+		response = self.client.get(reverse('admin:flights_flight_autocomplete'), {'term': 'la la'})
+		self.assertEqual([result['text'] for result in response.json()['results']], [str(Flight.objects.get(destination='La la land'))])
+
+
+class AuthenticationCacheTest(APITestCase):
+	def setUp(self):
+		self.user_data = {"username" : "laila", "password" : "1234567890-="}
+		self.user = User(username=self.user_data["username"])
+		self.user.set_password(self.user_data["password"])
+		self.user.save()
+		response = self.client.post(reverse('login'), self.user_data)
+		self.client.credentials(HTTP_AUTHORIZATION='Bearer ' + response.data['access'])
+
+	def user_queries(self):
+		with CaptureQueriesContext(connection) as captured:
+			response = self.client.get(reverse('bookings-list'))
+		self.assertEqual(response.status_code, status.HTTP_200_OK)
+		return len([query for query in captured.captured_queries if '"auth_user"' in query['sql']])
+
+	def test_user_is_cached(self):
+		self.assertEqual(self.user_queries(), 1)
+		self.assertEqual(self.user_queries(), 0)
+
+	def test_password_change_invalidates(self):
+		self.user_queries()
+		self.user.set_password("another-password-1")
+		self.user.save()
+		self.assertEqual(self.user_queries(), 1)
+
+	def test_deactivation_invalidates(self):
+		self.user_queries()
+		self.user.is_active = False
+		self.user.save()
+		response = self.client.get(reverse('bookings-list'))
+		self.assertEqual(response.status_code, status.HTTP_401_UNAUTHORIZED)
+
+	def test_deletion_invalidates(self):
+		self.user_queries()
+		self.user.delete()
+		response = self.client.get(reverse('bookings-list'))
+		self.assertEqual(response.status_code, status.HTTP_401_UNAUTHORIZED)
+
+	def test_shared_cache(self):
+		# As configured by settings_production: every worker sees the entry
+		# the signals drop.
+		with tempfile.TemporaryDirectory() as directory:
+			shared = {'BACKEND': 'django.core.cache.backends.filebased.FileBasedCache', 'LOCATION': directory}
+			with override_settings(CACHES=dict(settings.CACHES, auth=shared)):
+				self.assertEqual(self.user_queries(), 1)
+				self.assertEqual(self.user_queries(), 0)
+				self.assertEqual(len(os.listdir(directory)), 1)
+				self.user.is_active = False
+				self.user.save()
+				self.assertEqual(os.listdir(directory), [])
+
+
+class QueryBudgetTest(APITestCase):
+	# Per-request query budgets for every named route in task_1/urls.py. The
+	# fixtures hold several rows per list so that an N+1 shows up as a
+	# blown budget rather than passing by luck.
+	budgets = {
+		'flights-list': 1,
+		'bookings-list': 1,
+		'booking-details': 1,
+		'update-booking': 5,
+		'cancel-booking': 5,
+		'book-flight': 4,
+		'bulk-book-flights': 6,
+		'profile-details': 5,
+		'past-bookings': 2,
+		'login': 1,
+		'token-refresh': 0,
+		'register': 2,
+		'tier-list': 1,
+		'tier-members': 2,
+		'export-flights': 1,
+		'export-bookings': 2,
+		'metrics': 0,
+	}
+
+	def setUp(self):
+		self.user_data = {"username" : "laila", "password" : "1234567890-="}
+		self.user = User(username=self.user_data["username"])
+		self.user.set_password(self.user_data["password"])
+		self.user.save()
+		Profile.objects.create(user=self.user)
+
+		for index in range(5):
+			flight = Flight.objects.create(destination='Wakanda %d' % index, time='10:00', price=230, miles=4000)
+			Booking.objects.create(flight=flight, date=date.today()-timedelta(days=index+1), user=self.user, passengers=2)
+			Booking.objects.create(flight=flight, date=date.today()+timedelta(days=index+10), user=self.user, passengers=2)
+			# Seat inventory rows are created on the first booking for a
+			# flight and date; budgets are for the ones that follow.
+			SeatInventory.objects.create(flight=flight, date=date.today()+timedelta(days=index+10), seats_left=198)
+			SeatInventory.objects.create(flight=flight, date='2030-05-05', seats_left=200)
+		self.booking = Booking.objects.filter(user=self.user, date__gt=date.today()).first()
+
+		response = self.client.post(reverse('login'), self.user_data)
+		self.tokens = response.data
+		self.client.credentials(HTTP_AUTHORIZATION='Bearer ' + self.tokens['access'])
+		# Budgets are for warm requests, with the user already cached by
+		# CachedJWTAuthentication.
+		self.client.get(reverse('bookings-list'))
+
+	def check(self, name):
+		return max_queries(self.budgets[name])
+
+	def assertWithinBudget(self, name, method, url, data=None, **kwargs):
+		with self.check(name):
+			response = getattr(self.client, method)(url, data, **kwargs)
+			if response.streaming:
+				b''.join(response.streaming_content)
+		self.assertLess(response.status_code, 400)
+		return response
+
+	def test_every_route_has_a_budget(self):
+		names = {pattern.name for pattern in urlpatterns if getattr(pattern, 'name', None)}
+		self.assertEqual(names, set(self.budgets))
+
+	def test_flights_list(self):
+		self.client.credentials()
+		self.assertWithinBudget('flights-list', 'get', reverse('flights-list'))
+
+	def test_flights_list_filtered(self):
+		self.client.credentials()
+		for query in [
+			'time__gte=08:00&time__lte=12:00',
+			'ordering=time&time__gte=08:00&time__lte=12:00&price__lte=500',
+			'ordering=-price&price__gte=100&miles__lte=5000',
+			'ordering=miles&miles__gte=1000&miles__lte=5000',
+			'miles__lte=5000',
+			'destination__in=Wakanda 1,Wakanda 2&time__gte=08:00',
+		]:
+			self.assertWithinBudget('flights-list', 'get', reverse('flights-list') + '?' + query)
+
+	def test_bookings_list(self):
+		self.assertWithinBudget('bookings-list', 'get', reverse('bookings-list'))
+
+	def test_booking_details(self):
+		self.assertWithinBudget('booking-details', 'get', reverse('booking-details', args=[self.booking.id]))
+
+	def test_update_booking(self):
+		self.assertWithinBudget('update-booking', 'put', reverse('update-booking', args=[self.booking.id]), {"passengers": 3})
+
+	def test_cancel_booking(self):
+		self.assertWithinBudget('cancel-booking', 'delete', reverse('cancel-booking', args=[self.booking.id]))
+
+	def test_book_flight(self):
+		flight = Flight.objects.first()
+		self.assertWithinBudget('book-flight', 'post', reverse('book-flight', args=[flight.id]), {"date": "2030-05-05", "passengers": 4})
+
+	def test_bulk_book_flights(self):
+		flight = Flight.objects.first()
+		data = [{"flight_id": flight.id, "date": "2030-05-05", "passengers": 2}] * 50
+		response = self.assertWithinBudget('bulk-book-flights', 'post', reverse('bulk-book-flights'), data, format='json')
+		self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+
+	def test_profile_details(self):
+		self.assertWithinBudget('profile-details', 'get', reverse('profile-details'))
+
+	def test_past_bookings(self):
+		self.assertWithinBudget('past-bookings', 'get', reverse('past-bookings'))
+
+	def test_login(self):
+		self.client.credentials()
+		self.assertWithinBudget('login', 'post', reverse('login'), self.user_data)
+
+	def test_token_refresh(self):
+		self.client.credentials()
+		self.assertWithinBudget('token-refresh', 'post', reverse('token-refresh'), {"refresh": self.tokens['refresh']})
+
+	def test_register(self):
+		self.client.credentials()
+		data = {"username": "laila3", "password": "1234567890-=", "first_name": "laila", "last_name":  "bee"}
+		self.assertWithinBudget('register', 'post', reverse('register'), data)
+
+	def make_staff(self):
+		self.user.is_staff = True
+		self.user.save()
+		self.client.get(reverse('bookings-list'))
+
+	def test_tier_list(self):
+		self.make_staff()
+		self.assertWithinBudget('tier-list', 'get', reverse('tier-list'))
+
+	def test_tier_members(self):
+		self.make_staff()
+		self.assertWithinBudget('tier-members', 'get', reverse('tier-members', args=['Blue']))
+
+	def test_export_flights(self):
+		self.make_staff()
+		self.assertWithinBudget('export-flights', 'get', reverse('export-flights', args=['csv']))
+
+	def test_export_bookings(self):
+		self.make_staff()
+		self.assertWithinBudget('export-bookings', 'get', reverse('export-bookings', args=['ndjson']))
+
+	@override_settings(METRICS_TOKEN='scrape-token')
+	def test_metrics(self):
+		self.client.credentials(HTTP_AUTHORIZATION='Bearer scrape-token')
+		self.assertWithinBudget('metrics', 'get', reverse('metrics'))
+
+
+@skipUnless(connection.vendor == 'sqlite', 'EXPLAIN QUERY PLAN is SQLite syntax.')
+class QueryPlanTest(QueryBudgetTest):
+	# The same requests as QueryBudgetTest, checked for full table scans and
+	# temporary sorts instead of query counts.
+	# Exports read whole tables, in primary key order.
+	full_scans = {
+		'export-flights': ['flights_flight'],
+		'export-bookings': ['flights_booking', 'flights_archivedbooking'],
+	}
+
+	def check(self, name):
+		return indexed_queries(allow=self.full_scans.get(name, ()))
+
+	def test_miles_ranges(self):
+		# Ordered by miles, a miles range is read from the miles index. Under
+		# another ordering LookupFilter keeps it out of the index choice, so
+		# SQLite walks that ordering's index and stops at a full page.
+		self.client.credentials()
+		for query, index in [
+			('ordering=miles&miles__gte=1000&miles__lte=5000', 'flight_miles_id_idx'),
+			('miles__lte=5000', 'flight_destination_id_idx'),
+			('ordering=price&miles__gte=1000', 'flight_price_id_idx'),
+		]:
+			with CaptureQueriesContext(connection) as queries:
+				self.client.get(reverse('flights-list') + '?' + query)
+			plan = [line for query in queries.captured_queries for line in query_plan(query['sql'])]
+			self.assertTrue(any(index in line for line in plan), plan)
@@ -1,42 +1,93 @@
-from rest_framework.permissions import IsAuthenticated
-from rest_framework.generics import ListAPIView, RetrieveAPIView, RetrieveUpdateAPIView, DestroyAPIView, CreateAPIView
-from rest_framework.filters import SearchFilter, OrderingFilter
-from datetime import datetime
+from rest_framework.permissions import IsAuthenticated, IsAdminUser
+from rest_framework.generics import ListAPIView, RetrieveAPIView, RetrieveUpdateAPIView, DestroyAPIView, CreateAPIView, GenericAPIView
+from rest_framework.exceptions import NotFound, ValidationError
+from rest_framework.response import Response
+from rest_framework import status
+from django.db import NotSupportedError, transaction
+from django.http import Http404
+from django.db.models import Count, F, OuterRef, Subquery, Value
+from django.db.models.functions import Coalesce
+from collections import defaultdict
+from rest_framework.filters import OrderingFilter
+from datetime import datetime, date
 
-from .models import Flight, Booking
-from .serializers import FlightSerializer, BookingSerializer, BookingDetailsSerializer, UpdateBookingSerializer, RegisterSerializer, AdminUpdateBookingSerializer, ProfileSerializer, UserSerializer
+from .models import Flight, Booking, ArchivedBooking, Profile, SeatInventory, TierThreshold
+from .serializers import FlightSerializer, BookingSerializer, BookingDetailsSerializer, UpdateBookingSerializer, RegisterSerializer, AdminUpdateBookingSerializer, ProfileSerializer, UserSerializer, BulkBookingSerializer, TierSerializer, TierMemberSerializer, FlightExportSerializer, BookingExportSerializer
 from .permissions import IsBookingOwner, IsChangable
+from .pagination import KeysetPagination, MergedKeysetPagination
+from .search import DestinationSearchFilter
+from .filters import LookupFilter
+from .cache import CatalogCacheMixin
+from .rows import ValuesListMixin
+from .exports import StreamingExportMixin, ExportNegotiation
 
+NOT_ENOUGH_SEATS = 'Not enough seats left on this flight.'
 
-class FlightsList(ListAPIView):
+
+class FlightsList(CatalogCacheMixin, ValuesListMixin, ListAPIView):
 	queryset = Flight.objects.all()
 	serializer_class = FlightSerializer
-	filter_backends = [SearchFilter, OrderingFilter]
+	filter_backends = [OrderingFilter, LookupFilter, DestinationSearchFilter]
+	filter_lookups = {
+		'destination': ['exact', 'in'],
+		'time': ['gte', 'lte'],
+		'price': ['gte', 'lte'],
+		'miles': ['gte', 'lte'],
+	}
+	ranges_follow_ordering = True
 	search_fields = ['destination']
+	ordering_fields = ['destination', 'time', 'price', 'miles', 'id']
+	ordering = ['destination', 'id']
+	pagination_class = KeysetPagination
 
 
-class BookingsList(ListAPIView):
+class BookingsList(ValuesListMixin, ListAPIView):
 	serializer_class = BookingSerializer
 	permission_classes = [IsAuthenticated]
+	filter_backends = [LookupFilter, OrderingFilter]
+	filter_lookups = {'totalprice': ['gte', 'lte']}
+	ordering_fields = ['date', 'id', 'totalprice']
+	ordering = ['date', 'id']
+	pagination_class = KeysetPagination
 
 	def get_queryset(self):
-		return Booking.objects.filter(user=self.request.user, date__gte=datetime.today())
+		return Booking.objects.filter(user=self.request.user, date__gte=datetime.today()).with_totalprice().select_related('flight')
 
 
-class BookingDetails(RetrieveAPIView):
-	queryset = Booking.objects.all()
-	serializer_class = BookingDetailsSerializer
+class BookingLookupMixin:
+	# Looks the booking up with IsBookingOwner and, for views that change
+	# bookings, IsChangable applied in the query, so a permitted request
+	# costs one lookup. Only a miss looks at the booking again, to answer
+	# 404 when it doesn't exist and the permission's 403 when it does.
 	lookup_field = 'id'
 	lookup_url_kwarg = 'booking_id'
+	changes_booking = False
+
+	def get_queryset(self):
+		queryset = super().get_queryset().visible_to(self.request.user)
+		return queryset.changeable() if self.changes_booking else queryset
+
+	def get_object(self):
+		try:
+			return super().get_object()
+		except Http404:
+			booking = Booking.objects.only('user', 'date').filter(id=self.kwargs[self.lookup_url_kwarg]).first()
+			if booking is not None:
+				self.check_object_permissions(self.request, booking)
+			raise
+
+
+class BookingDetails(BookingLookupMixin, RetrieveAPIView):
+	queryset = Booking.objects.with_totalprice().select_related('flight')
+	serializer_class = BookingDetailsSerializer
 	permission_classes = [IsAuthenticated, IsBookingOwner]
 
 
 
-class UpdateBooking(RetrieveUpdateAPIView):
+class UpdateBooking(BookingLookupMixin, RetrieveUpdateAPIView):
 	queryset = Booking.objects.all()
-	lookup_field = 'id'
-	lookup_url_kwarg = 'booking_id'
 	permission_classes = [IsAuthenticated, IsBookingOwner, IsChangable]
+	changes_booking = True
 
 	def get_serializer_class(self):
 		if self.request.user.is_staff:
@@ -44,12 +95,30 @@ class UpdateBooking(RetrieveUpdateAPIView):
 		else:
 			return UpdateBookingSerializer
 
+	def perform_update(self, serializer):
+		booking = serializer.instance
+		new_date = serializer.validated_data.get('date', booking.date)
+		new_passengers = serializer.validated_data.get('passengers', booking.passengers)
+		with transaction.atomic():
+			if new_date == booking.date:
+				extra = new_passengers - booking.passengers
+				reserved = SeatInventory.reserve(booking.flight_id, new_date, extra)
+				SeatInventory.release(booking.flight_id, new_date, -extra)
+			else:
+				reserved = SeatInventory.reserve(booking.flight_id, new_date, new_passengers)
+				if reserved:
+					SeatInventory.release(booking.flight_id, booking.date, booking.passengers)
+			if not reserved:
+				raise ValidationError({'passengers': [NOT_ENOUGH_SEATS]})
+			booking._counted_seats = (booking.flight_id, new_date, new_passengers)
+			serializer.save()
 
-class CancelBooking(DestroyAPIView):
+
+class CancelBooking(BookingLookupMixin, DestroyAPIView):
+	# The Booking signals give the seats back.
 	queryset = Booking.objects.all()
-	lookup_field = 'id'
-	lookup_url_kwarg = 'booking_id'
 	permission_classes = [IsAuthenticated, IsBookingOwner, IsChangable]
+	changes_booking = True
 
 
 class BookFlight(CreateAPIView):
@@ -57,7 +126,113 @@ class BookFlight(CreateAPIView):
 	permission_classes = [IsAuthenticated]
 
 	def perform_create(self, serializer):
-		serializer.save(user=self.request.user, flight_id=self.kwargs['flight_id'])
+		try:
+			booking = Booking.objects.book(self.request.user, self.kwargs['flight_id'], serializer.validated_data['date'], serializer.validated_data['passengers'])
+		except Flight.DoesNotExist:
+			raise NotFound('Flight not found.')
+		if booking is None:
+			raise ValidationError({'passengers': [NOT_ENOUGH_SEATS]})
+		serializer.instance = booking
+
+
+class BulkBookFlights(GenericAPIView):
+	serializer_class = BulkBookingSerializer
+	permission_classes = [IsAuthenticated]
+	max_items = 1000
+	batch_size = 500
+	count_batch_size = 400
+
+	def post(self, request, *args, **kwargs):
+		items = request.data
+		if not isinstance(items, list):
+			raise ValidationError({'non_field_errors': ['Expected a list of bookings.']})
+		if len(items) > self.max_items:
+			raise ValidationError({'non_field_errors': ['At most %d bookings per request.' % self.max_items]})
+
+		results = []
+		bookings = []
+		for index, item in enumerate(items):
+			serializer = self.get_serializer(data=item)
+			if not serializer.is_valid():
+				results.append({'index': index, 'status': 'failed', 'errors': serializer.errors})
+			else:
+				booking = Booking(user=request.user, **serializer.validated_data)
+				bookings.append(booking)
+				results.append({'index': index, 'status': 'created', 'booking': booking})
+
+		created, unknown_flights = self.perform_bulk_create(bookings) if bookings else ([], set())
+		for result in results:
+			booking = result.pop('booking', None)
+			if booking is None:
+				continue
+			if booking.flight_id in unknown_flights:
+				result.update(status='failed', errors={'flight_id': ['Flight not found.']})
+			elif booking.pk is None:
+				result.update(status='failed', errors={'passengers': [NOT_ENOUGH_SEATS]})
+			else:
+				result['id'] = booking.pk
+
+		if not created:
+			response_status = status.HTTP_400_BAD_REQUEST
+		elif len(created) < len(items):
+			response_status = status.HTTP_207_MULTI_STATUS
+		else:
+			response_status = status.HTTP_201_CREATED
+		return Response({'created': len(created), 'failed': len(items) - len(created), 'results': results}, status=response_status)
+
+	def reserve_seats(self, bookings):
+		# One reservation per flight and date. Only when that fails are the
+		# bookings tried one by one, in request order, so as many as fit go
+		# through. Returns the bookings reserved and the ids of the flights
+		# that don't exist.
+		groups = defaultdict(list)
+		for index, booking in enumerate(bookings):
+			groups[booking.flight_id, booking.date].append(index)
+		reserved, unknown_flights = set(), set()
+		for (flight_id, booking_date), indexes in groups.items():
+			if flight_id in unknown_flights:
+				continue
+			try:
+				if SeatInventory.reserve(flight_id, booking_date, sum(bookings[index].passengers for index in indexes)):
+					reserved.update(indexes)
+				else:
+					reserved.update(index for index in indexes if SeatInventory.reserve(flight_id, booking_date, bookings[index].passengers))
+			except Flight.DoesNotExist:
+				unknown_flights.add(flight_id)
+		return [booking for index, booking in enumerate(bookings) if index in reserved], unknown_flights
+
+	def perform_bulk_create(self, bookings):
+		# Returns the bookings created and the ids of the flights that don't
+		# exist.
+		connection = transaction.get_connection()
+		returns_ids = connection.features.can_return_ids_from_bulk_insert
+		if not returns_ids and connection.vendor != 'sqlite':
+			raise NotSupportedError('Bulk booking needs a database that returns ids from bulk inserts, or SQLite.')
+		with transaction.atomic():
+			# Reserving comes first, as in BookingQuerySet.book(): on SQLite a transaction
+			# that read before its first write can't take the write lock
+			# while another one holds it, and fails instead of waiting. A
+			# flight that doesn't exist shows when its inventory row can't
+			# be created.
+			bookings, unknown_flights = self.reserve_seats(bookings)
+			if not bookings:
+				return bookings, unknown_flights
+			created = Booking.objects.bulk_create(bookings, batch_size=self.batch_size)
+			if not returns_ids:
+				# SQLite has a single writer: the first insert took the
+				# database write lock and this transaction still holds it, so
+				# the user's newest rows are exactly the ones just inserted,
+				# in insertion order.
+				ids = Booking.objects.filter(user=self.request.user).order_by('-id').values_list('id', flat=True)[:len(created)]
+				for booking, pk in zip(created, reversed(list(ids))):
+					booking.pk = pk
+			# bulk_create skips signals, so past-dated bookings are counted
+			# here, a batch at a time to stay under SQLite's parameter limit.
+			today = date.today()
+			past = [booking.pk for booking in created if booking.date < today]
+			for start in range(0, len(past), self.count_batch_size):
+				Profile.adjust_past_bookings_counts(Booking.objects.filter(id__in=past[start:start + self.count_batch_size]), F('date'), 1)
+		return created, unknown_flights
 
 
 class Register(CreateAPIView):
@@ -66,9 +241,71 @@ class Register(CreateAPIView):
 
 class ProfileDetails(RetrieveAPIView):
 	serializer_class = ProfileSerializer
-	
+	permission_classes = [IsAuthenticated]
 
 	def get_object(self):
-		return self.request.user.profile
+		profile = self.request.user.profile
+		profile.refresh_past_bookings_count()
+		return profile
+
+
+class PastBookingsList(ListAPIView):
+	serializer_class = BookingSerializer
+	permission_classes = [IsAuthenticated]
+	filter_backends = [OrderingFilter]
+	ordering_fields = ['date', 'id']
+	ordering = ['-date', '-id']
+	pagination_class = MergedKeysetPagination
 
+	def get_queryset(self):
+		return Booking.objects.filter(user=self.request.user, date__lt=date.today()).select_related('flight')
+
+	def get_merged_querysets(self):
+		return [ArchivedBooking.objects.filter(user=self.request.user).select_related('flight')]
+
+
+class TierList(ListAPIView):
+	serializer_class = TierSerializer
+	permission_classes = [IsAdminUser]
+
+	def get_queryset(self):
+		# One indexed count per tier, straight from the (tier, id) index.
+		members = Profile.objects.filter(tier=OuterRef('name')).order_by().values('tier').annotate(count=Count('id')).values('count')
+		return TierThreshold.objects.annotate(members=Coalesce(Subquery(members), Value(0)))
+
+
+class TierMembersList(ListAPIView):
+	serializer_class = TierMemberSerializer
+	permission_classes = [IsAdminUser]
+	pagination_class = KeysetPagination
+
+	def get_queryset(self):
+		if not TierThreshold.objects.filter(name=self.kwargs['tier']).exists():
+			raise NotFound('Unknown tier.')
+		return Profile.objects.filter(tier=self.kwargs['tier']).select_related('user')
+
+
+class FlightExport(StreamingExportMixin, GenericAPIView):
+	queryset = Flight.objects.all()
+	serializer_class = FlightExportSerializer
+	permission_classes = [IsAdminUser]
+	content_negotiation_class = ExportNegotiation
+	filter_backends = [LookupFilter]
+	filter_lookups = {'destination': ['exact']}
+	export_name = 'flights'
+
+
+class BookingExport(StreamingExportMixin, GenericAPIView):
+	serializer_class = BookingExportSerializer
+	permission_classes = [IsAdminUser]
+	content_negotiation_class = ExportNegotiation
+	filter_backends = [LookupFilter]
+	filter_lookups = {'date': ['gte', 'lte'], 'destination': ['exact']}
+	export_name = 'bookings'
+
+	def get_queryset(self):
+		return Booking.objects.annotate(destination=F('flight__destination')).with_totalprice()
 
+	def get_export_querysets(self):
+		archived = ArchivedBooking.objects.annotate(destination=F('flight__destination')).with_totalprice()
+		return super().get_export_querysets() + [self.filter_queryset(archived)]
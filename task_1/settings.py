@@ -42,7 +42,10 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    'flights.metrics.MetricsMiddleware',
+    'flights.instrumentation.InstrumentationMiddleware',
     'django.middleware.security.SecurityMiddleware',
+    'flights.routers.ReplicaPinMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
     'django.middleware.csrf.CsrfViewMiddleware',
@@ -82,6 +85,61 @@ DATABASES = {
     }
 }
 
+# Read replica, a copy of the primary kept fresh by `manage.py replicate`.
+# Only used once it exists. Reads are spread over DATABASE_REPLICAS by
+# flights.routers.PrimaryReplicaRouter.
+REPLICA_DATABASE_PATH = os.path.join(BASE_DIR, 'db.replica.sqlite3')
+if os.path.exists(REPLICA_DATABASE_PATH):
+    DATABASES['replica'] = {
+        'ENGINE': 'django.db.backends.sqlite3',
+        'NAME': 'file:%s?mode=ro' % REPLICA_DATABASE_PATH,
+        'OPTIONS': {'uri': True},
+        'TEST': {'MIRROR': 'default'},
+    }
+
+DATABASE_REPLICAS = [alias for alias in DATABASES if alias != 'default']
+
+# PRAGMA name -> value, run on every new SQLite connection. Empty here, see
+# settings_production.py.
+SQLITE_PRAGMAS = {}
+DATABASE_ROUTERS = ['flights.routers.PrimaryReplicaRouter']
+
+
+# Cache
+# https://docs.djangoproject.com/en/2.2/topics/cache/
+
+# The flight catalog response cache (flights.cache) lives in its own alias.
+# The in-process LRU is per worker; multi-worker deployments need a shared
+# local backend such as
+# 'django.core.cache.backends.filebased.FileBasedCache' (settings_production)
+# or 'django.core.cache.backends.db.DatabaseCache'.
+
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+    },
+    'catalog': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        'LOCATION': 'flights-catalog',
+        'TIMEOUT': 600,
+        'OPTIONS': {
+            'MAX_ENTRIES': 1000,
+        },
+    },
+    # Users cached by flights.authentication.CachedJWTAuthentication. Saving
+    # or deleting a user only drops the entry from this cache, so with a
+    # per-process backend the other workers keep accepting a deactivated
+    # user or an old password for up to AUTH_USER_CACHE_TIMEOUT seconds.
+    # settings_production shares it between workers.
+    'auth': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        'LOCATION': 'flights-auth-users',
+    },
+}
+
+CATALOG_CACHE = 'catalog'
+AUTH_USER_CACHE = 'auth'
+
 
 # Password validation
 # https://docs.djangoproject.com/en/2.2/ref/settings/#auth-password-validators
@@ -104,10 +162,47 @@ AUTH_PASSWORD_VALIDATORS = [
 
 REST_FRAMEWORK = {
     'DEFAULT_AUTHENTICATION_CLASSES': [
-        'rest_framework_simplejwt.authentication.JWTAuthentication',
+        'flights.authentication.CachedJWTAuthentication',
+    ],
+    # Uses orjson when it is installed (optional, not in requirements.txt).
+    'DEFAULT_RENDERER_CLASSES': [
+        'flights.renderers.FastJSONRenderer',
+        'rest_framework.renderers.BrowsableAPIRenderer',
     ],
 }
 
+# Seconds an authenticated user stays cached by CachedJWTAuthentication.
+AUTH_USER_CACHE_TIMEOUT = 60
+
+AUTHENTICATION_BACKENDS = ['flights.authentication.PooledModelBackend']
+
+# Password hashing runs in this many worker processes (0 hashes on the
+# request thread). Once PASSWORD_HASHING_MAX_PENDING hashes are queued or
+# running (0 for no limit), API sign-ups and logins get a 429 with this
+# Retry-After.
+PASSWORD_HASHING_WORKERS = min(os.cpu_count() or 1, 8)
+PASSWORD_HASHING_MAX_PENDING = 4 * PASSWORD_HASHING_WORKERS
+PASSWORD_HASHING_RETRY_AFTER = 1
+
+# Share of requests timed by flights.instrumentation (Server-Timing header
+# and a log line), and the duration from which any query is logged with
+# where it came from (None turns the slow query log off).
+INSTRUMENTATION_SAMPLE_RATE = 0.01
+SLOW_QUERY_MS = None
+
+# Directory for the per-process metrics files served at /metrics/, summed
+# across all worker processes. Clear it before starting the server. None
+# keeps this process's metrics in memory only.
+METRICS_DIR = None
+
+# Bearer token a scraper must send to read /metrics/ (Authorization: Bearer
+# <token>). The endpoint answers 404 while this is None.
+METRICS_TOKEN = None
+
+# `manage.py archive_bookings` moves bookings older than this many days out
+# of the bookings table (see flights.archive).
+BOOKING_ARCHIVE_AFTER_DAYS = 365
+
 
 # Internationalization
 # https://docs.djangoproject.com/en/2.2/topics/i18n/
@@ -0,0 +1,71 @@
+"""
+Production profile: DJANGO_SETTINGS_MODULE=task_1.settings_production.
+
+SQLite in WAL mode, so readers never wait for the writer, with persistent
+connections and pragmas applied by flights.signals.configure_sqlite.
+"""
+
+import os
+
+from .settings import *  # noqa: F401,F403
+
+DEBUG = False
+
+# Keep connections open across requests instead of reconnecting (and
+# re-applying the pragmas) every time.
+DATABASES['default']['CONN_MAX_AGE'] = 600
+
+# Replica connections are recycled quickly, since `manage.py replicate`
+# swaps the replica file underneath them.
+if 'replica' in DATABASES:
+    DATABASES['replica']['CONN_MAX_AGE'] = 10
+
+SQLITE_PRAGMAS = {
+    # Wait up to 5 s for a lock instead of failing with "database is locked".
+    'busy_timeout': 5000,
+    # Readers and the writer no longer block each other.
+    'journal_mode': 'WAL',
+    # Safe with WAL: a power loss can lose the last commits, never corrupt.
+    'synchronous': 'NORMAL',
+    'mmap_size': 256 * 1024 * 1024,
+    # Negative means KiB: 64 MiB of page cache per connection.
+    'cache_size': -64 * 1024,
+    'temp_store': 'MEMORY',
+}
+
+SLOW_QUERY_MS = 100
+
+METRICS_DIR = os.environ.get('METRICS_DIR', os.path.join(BASE_DIR, 'metrics'))
+METRICS_TOKEN = os.environ.get('METRICS_TOKEN')
+
+# Shared by every worker on the host, so a saved or deleted user is
+# forgotten by all of them at once.
+CACHES['auth'] = {
+    'BACKEND': 'django.core.cache.backends.filebased.FileBasedCache',
+    'LOCATION': os.environ.get('AUTH_USER_CACHE_DIR', os.path.join(BASE_DIR, 'cache', 'auth-users')),
+}
+
+# Likewise, so a Flight write retires the cached catalog pages and ETags of
+# every worker, not only the one that handled it.
+CACHES['catalog'] = dict(
+    CACHES['catalog'],
+    BACKEND='django.core.cache.backends.filebased.FileBasedCache',
+    LOCATION=os.environ.get('CATALOG_CACHE_DIR', os.path.join(BASE_DIR, 'cache', 'catalog')),
+)
+
+LOGGING = {
+    'version': 1,
+    'disable_existing_loggers': False,
+    'handlers': {
+        'console': {
+            'class': 'logging.StreamHandler',
+        },
+    },
+    'loggers': {
+        'flights.instrumentation': {
+            'handlers': ['console'],
+            'level': 'INFO',
+            'propagate': False,
+        },
+    },
+}
@@ -20,6 +20,7 @@ from rest_framework_simplejwt.views import (
     TokenRefreshView,
 )
 from flights import views
+from flights.metrics import metrics
 
 urlpatterns = [
     path('admin/', admin.site.urls),
@@ -30,9 +31,19 @@ urlpatterns = [
     path('booking/<int:booking_id>/update/', views.UpdateBooking.as_view(), name="update-booking"),
     path('booking/<int:booking_id>/cancel/', views.CancelBooking.as_view(), name="cancel-booking"),
     path('book/<int:flight_id>/', views.BookFlight.as_view(), name="book-flight"),
+    path('book/bulk/', views.BulkBookFlights.as_view(), name="bulk-book-flights"),
 
     path('profile/', views.ProfileDetails.as_view(), name="profile-details"),
+    path('profile/past-bookings/', views.PastBookingsList.as_view(), name="past-bookings"),
     path('login/', TokenObtainPairView.as_view(), name="login"),
     path('token/refresh/', TokenRefreshView.as_view(), name="token-refresh"),
     path('register/', views.Register.as_view(), name="register"),
+
+    path('tiers/', views.TierList.as_view(), name="tier-list"),
+    path('tiers/<str:tier>/members/', views.TierMembersList.as_view(), name="tier-members"),
+
+    path('export/flights.<str:export_format>', views.FlightExport.as_view(), name="export-flights"),
+    path('export/bookings.<str:export_format>', views.BookingExport.as_view(), name="export-bookings"),
+
+    path('metrics/', metrics, name="metrics"),
 ]